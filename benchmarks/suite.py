@@ -0,0 +1,704 @@
+"""
+Serialization benchmark suite for make_response, merge_tuples and Encoder,
+and for the per-request work of the Router around them: compiled response
+functions, schema validation, async views, route metrics, Selector parsing
+and in-memory queries and pages. Encoder and Selector are also measured as
+they were before their optimizations, as a reference.
+
+Every case reports its throughput, p50/p99 latency and peak memory, and is
+compared against the stored baseline. The run fails (exit status 1) when a
+metric regresses beyond its threshold, so it can gate a release.
+
+    python -m benchmarks.suite                  # run and compare
+    python -m benchmarks.suite --save           # store results as baseline
+    python -m benchmarks.suite --only datetime  # cases matching a substring
+
+Baselines are only meaningful on the machine they were recorded on, record a
+new one (and commit it) when the reference environment changes.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from decimal import Decimal
+
+import mongoengine
+from cerberus import Validator
+from flask import Blueprint, Flask
+from werkzeug.datastructures import MultiDict
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from flask_kit import Router
+from flask_kit.json_formatter import (
+    Encoder,
+    compile_response,
+    datetime_modes,
+    dumps,
+    encode_datetime,
+    make_response,
+    merge_tuples,
+)
+from flask_kit.simple_router import Selector
+from flask_kit.simple_router.memory import MemoryCollection, query
+from flask_kit.simple_router.metrics import RouteMetrics
+from flask_kit.simple_router.simple_router import qualified_value
+from flask_kit.simple_router.validation import compile_schema
+
+baseline_path = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Maximum accepted regression for each metric, relative to the baseline.
+# p99 is reported but not gated, it is too noisy on shared machines.
+thresholds = {
+    'throughput': 0.25,
+    'p50': 0.25,
+    'peak_memory': 0.10,
+}
+
+# Metrics reported but not gated for some cases: the peak memory of a pool
+# of threads depends on how they are scheduled
+ungated = {
+    'router/sync_io_workers': {'peak_memory'},
+    'router/async_io_workers': {'peak_memory'},
+}
+
+
+class LegacyEncoder(json.JSONEncoder):
+    """ Encoder.default as it was before the dispatch cache """
+
+    def default(self, obj):
+        to_dict = getattr(obj.__class__, "to_dict", None)
+        if to_dict:
+            return obj.to_dict()
+        to_json = getattr(obj.__class__, "to_json", None)
+        if to_json:
+            return json.loads(obj.to_json())
+        if isinstance(obj, datetime.datetime):
+            return encode_datetime(obj, True)
+        return super(LegacyEncoder, self).default(obj)
+
+
+class LegacyDecimalEncoder(json.JSONEncoder):
+    """ The legacy probe chain, extended with a Decimal check at the end """
+
+    def default(self, obj):
+        to_dict = getattr(obj.__class__, "to_dict", None)
+        if to_dict:
+            return obj.to_dict()
+        to_json = getattr(obj.__class__, "to_json", None)
+        if to_json:
+            return json.loads(obj.to_json())
+        if isinstance(obj, datetime.datetime):
+            return encode_datetime(obj, True)
+        if isinstance(obj, datetime.date):
+            return encode_datetime(obj, False)
+        if isinstance(obj, Decimal):
+            return str(obj)
+        return super(LegacyDecimalEncoder, self).default(obj)
+
+
+class LegacySelector(Selector):
+    """ Selector as it was, walking the arguments on every call """
+
+    def limit(self):
+        value = self.request.args.get('limit', None)
+        return int(value) if value and value.isdigit() else None
+
+    def offset(self):
+        value = self.request.args.get('offset', None)
+        return int(value) if value and value.isdigit() else None
+
+    def filter(self, only=None, mapping=None, types=None):
+        filters = []
+        for key in self.request.args.keys():
+            if not key or key in self.reserved_args:
+                continue
+            if only is not None and key not in only:
+                continue
+            for arg in self.request.args.getlist(key):
+                op, value = qualified_value(arg, self.filter_ops, True, 'eq')
+                if op in ['in', 'nin']:
+                    value = [v.strip() for v in value.split(',')
+                             if v.strip()]
+                filters.append({'field': (mapping or {}).get(key, key),
+                                'op': op, 'value': value})
+        return filters
+
+    def sort(self, only=None, mapping=None):
+        value = self.request.args.get('sort', None)
+        if not value:
+            return {}
+        sorting = []
+        for key in value.split(','):
+            s_dir, val = qualified_value(key, self.sort_dir, False, 'desc')
+            if val and (only is None or val in only):
+                sorting.append({'field': (mapping or {}).get(val, val),
+                                'direction': s_dir})
+        return sorting
+
+
+class ArgsRequest(object):
+    def __init__(self, **args):
+        self.args = MultiDict(args)
+
+
+class Thing(object):
+    def __init__(self, i):
+        self.i = i
+
+    def to_dict(self):
+        return {'id': self.i, 'name': 'thing %d' % self.i, 'active': True}
+
+
+class JsonThing(object):
+    def __init__(self, i):
+        self.i = i
+
+    def to_json(self):
+        return '{"id": %d, "name": "thing %d", "active": true}' % (
+            self.i, self.i)
+
+
+class Item(mongoengine.Document):
+    name = mongoengine.StringField()
+    price = mongoengine.FloatField()
+    created = mongoengine.DateTimeField()
+    tags = mongoengine.ListField(mongoengine.StringField())
+    meta = {'allow_inheritance': False}
+
+
+class Maker(object):
+    def __init__(self, i):
+        self.name = 'maker %d' % i
+        self.founded = datetime.datetime(1990, 1, 1)
+
+    def to_dict(self):
+        return {'name': self.name, 'founded': self.founded}
+
+
+def flat_dict():
+    return {'field_%d' % i: i if i % 2 else 'value %d' % i for i in range(50)}
+
+
+def deep_nesting(depth=50):
+    payload = {'leaf': [1, 2, 3]}
+    for i in range(depth):
+        payload = {'level': i, 'children': [payload, {'sibling': i}]}
+    return payload
+
+
+def large_list():
+    return [i if i % 3 else 'item %d' % i for i in range(100000)]
+
+
+def datetime_rows():
+    start = datetime.datetime(2018, 1, 1)
+    return [
+        {
+            'time': start + datetime.timedelta(minutes=i),
+            'day': (start + datetime.timedelta(minutes=i)).date(),
+            'value': i * 0.25,
+        }
+        for i in range(5000)
+    ]
+
+
+def to_dict_objects():
+    return [Thing(i) for i in range(5000)]
+
+
+def to_json_objects():
+    return [JsonThing(i) for i in range(5000)]
+
+
+def documents():
+    created = datetime.datetime(2018, 1, 1)
+    return [
+        Item(name='item %d' % i, price=i * 1.5, created=created,
+             tags=['a', 'b'])
+        for i in range(2000)
+    ]
+
+
+def datetime_series():
+    # Hourly samples of 3 series, every timestamp repeats 3 times
+    start = datetime.datetime(2018, 1, 1)
+    return [
+        {
+            'series': series,
+            'time': start + datetime.timedelta(hours=hour),
+            'day': (start + datetime.timedelta(hours=hour)).date(),
+            'value': hour * 0.5,
+        }
+        for hour in range(3334)
+        for series in ['a', 'b', 'c']
+    ]
+
+
+def wide_documents():
+    """ A page of 40 fields documents, some of them dates and objects """
+    page = []
+    for i in range(100):
+        doc = {'field_%d' % n: 'value %d' % n for n in range(30)}
+        doc.update({
+            'name': 'product %d' % i,
+            'price': i * 1.5,
+            'maker': Maker(i),
+            'tags': ['a', 'b', 'c'],
+        })
+        doc.update({'date_%d' % n: datetime.datetime(2018, 1, n + 1)
+                    for n in range(6)})
+        page.append(doc)
+    return page
+
+
+def catalog(size=100000):
+    rng = random.Random(0)
+    return [{
+        'id': i,
+        'price': rng.uniform(0, 1000),
+        'category': rng.choice(['audio', 'video', 'misc', 'home', 'garden']),
+        'stock': rng.randint(0, 50),
+    } for i in range(size)]
+
+
+def query_strings(shapes=300, requests=1000):
+    """ requests query strings, repeating shapes distinct ones """
+    rng = random.Random(0)
+    strings = []
+    for i in range(shapes):
+        strings.append(
+            'category=in:%s&price=gt:%d&price=lt:%d&stock=ne:0&brand=b%d'
+            '&sort=price:%s,stock&limit=%d&offset=%d' % (
+                ','.join(rng.sample(['tv', 'audio', 'video', 'misc'], 2)),
+                rng.randint(0, 50), rng.randint(100, 500), i % 20,
+                rng.choice(['asc', 'desc']), rng.choice([10, 20, 50]),
+                rng.randint(0, 100)))
+    return [rng.choice(strings) for _ in range(requests)]
+
+
+user_schema = {
+    'name': {'type': 'string', 'required': True, 'minlength': 1,
+             'maxlength': 64},
+    'email': {'type': 'string', 'required': True,
+              'regex': r'[^@\s]+@[^@\s]+\.[a-z]+'},
+    'age': {'type': 'integer', 'min': 0, 'max': 150, 'nullable': True},
+    'role': {'type': 'string', 'allowed': ['admin', 'user'],
+             'default': 'user'},
+    'address': {
+        'type': 'dict',
+        'schema': {
+            'street': {'type': 'string'},
+            'city': {'type': 'string', 'required': True},
+        },
+    },
+    'tags': {'type': 'list', 'schema': {'type': 'string', 'maxlength': 16}},
+}
+
+user_documents = {
+    'valid': {
+        'name': 'Someone',
+        'email': 'someone@example.com',
+        'age': 42,
+        'address': {'street': 'Main St', 'city': 'Lisbon'},
+        'tags': ['a', 'b', 'c'],
+    },
+    'invalid': {
+        'name': '',
+        'email': 'someone',
+        'address': {'street': 'Main St'},
+    },
+}
+
+# Views of the async cases make this many downstream calls, simulated with
+# sleeps of downstream_latency seconds
+downstream_calls = 5
+downstream_latency = 0.02
+
+
+def _make_response_case(build):
+    payload = build()
+    return lambda: make_response(payload)
+
+
+def _merge_tuples_case():
+    resp = ({'a': 1}, 201)
+    return lambda: merge_tuples(('', 200, {}), resp)
+
+
+def _encoder_default_case(build, encoder=Encoder):
+    default = encoder().default
+    objects = build()
+    return lambda: [default(obj) for obj in objects]
+
+
+def _dumps_case(mode):
+    rows = datetime_series()
+    return lambda: dumps(rows, mode)
+
+
+def _response_case(path):
+    payload = {'id': 1, 'name': 'thing'}
+    traits = {'status': 201, 'headers': {'Cache-Control': 'no-store'}}
+    compiled = compile_response()
+    compiled_traits = compile_response(**traits)
+    compiled_json_only = compile_response(json_only=True, **traits)
+    return {
+        'generic': lambda: make_response(payload, accept='*/*'),
+        'compiled': lambda: compiled(payload, '*/*'),
+        'generic_traits': lambda: make_response(payload, accept='*/*',
+                                                **traits),
+        'compiled_traits': lambda: compiled_traits(payload, '*/*'),
+        'compiled_json_only': lambda: compiled_json_only(payload),
+        'generic_tuple': lambda: make_response((payload, 202), accept='*/*'),
+        'compiled_tuple': lambda: compiled((payload, 202), '*/*'),
+        'dumps_only': lambda: dumps(payload),
+    }[path]
+
+
+def _projection_case(fields):
+    page = wide_documents()
+    return lambda: make_response(page, fields=fields)
+
+
+def _validation_case(compiled, document):
+    validator = (compile_schema(user_schema) if compiled
+                 else Validator(user_schema))
+    document = user_documents[document]
+    return lambda: validator.validate(document)
+
+
+def _router_views():
+    app = Flask(__name__)
+    blueprint = Blueprint('bench', __name__)
+    router = Router(blueprint, document_routes=False)
+
+    @router.get('sync')
+    def sync_view():
+        return {'a': 1}
+
+    @router.get('async')
+    async def async_view():
+        return {'a': 1}
+
+    @router.get('sync_io')
+    def sync_io():
+        for _ in range(downstream_calls):
+            time.sleep(downstream_latency)
+        return {'a': 1}
+
+    @router.get('async_io')
+    async def async_io():
+        await asyncio.gather(*(asyncio.sleep(downstream_latency)
+                               for _ in range(downstream_calls)))
+        return {'a': 1}
+
+    app.register_blueprint(blueprint)
+    return app, app.view_functions
+
+
+def _metrics_case(metrics):
+    """ A validated POST, with its phases timed by metrics """
+    app = Flask(__name__)
+    blueprint = Blueprint('bench', __name__)
+    router = Router(blueprint, document_routes=False, metrics=metrics)
+    schema = {
+        'name': {'type': 'string', 'maxlength': 64},
+        'tags': {'type': 'list', 'schema': {'type': 'string'}},
+    }
+
+    @router.post('things', validate=schema)
+    def create(data):
+        return data
+
+    app.register_blueprint(blueprint)
+    view = app.view_functions['bench.bench_create']
+    document = {'name': 'thing', 'tags': ['a', 'b', 'c']}
+
+    def run():
+        with app.test_request_context('/things', method='POST',
+                                      json=document):
+            view()
+
+    return run
+
+
+def _view_case(name):
+    app, views = _router_views()
+    view = views['bench.bench_%s' % name]
+
+    def run():
+        with app.test_request_context('/'):
+            view()
+
+    return run
+
+
+def _workers_case(name, workers=8, requests=2):
+    """ A pool of worker threads serving requests that wait on I/O """
+    run_view = _view_case(name)
+
+    def worker():
+        for _ in range(requests):
+            run_view()
+
+    def run():
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    return run
+
+
+def _selector_case(selector_class):
+    """ A list view reading its query from a batch of requests """
+    environs = [EnvironBuilder(query_string=q).get_environ()
+                for q in query_strings()]
+    only = ['category', 'price', 'stock', 'brand']
+    mapping = {'brand': 'maker.name'}
+
+    def run():
+        for environ in environs:
+            selector = selector_class(request_obj=Request(environ))
+            # Some of it twice, e.g. for a cache key
+            for _ in range(2):
+                selector.filter(only=only, mapping=mapping)
+                selector.sort(only=only, mapping=mapping)
+            selector.limit()
+            selector.offset()
+
+    return run
+
+
+def _memory_query_case(path):
+    items = catalog()
+    filters = [
+        {'field': 'category', 'op': 'in', 'value': ['audio', 'video']},
+        {'field': 'stock', 'op': 'gt', 'value': '10'},
+    ]
+    sorting = [{'field': 'price', 'direction': 'desc'}]
+    limit = 20
+
+    def ad_hoc():
+        matching = [item for item in items
+                    if item['category'] in ('audio', 'video') and
+                    item['stock'] > int('10')]
+        matching.sort(key=lambda item: item['price'], reverse=True)
+        return matching[:limit]
+
+    if path == 'ad_hoc':
+        return ad_hoc
+    if path == 'engine':
+        return lambda: list(query(items, filters, sorting, limit))
+    if path == 'indexed':
+        indexed = MemoryCollection(items, indexes=['category'])
+        return lambda: list(indexed.query(filters, sorting, limit))
+    return lambda: list(query(items, filters, limit=limit))
+
+
+def _page_case(offset, keyset):
+    """ The page at offset of a collection sorted by price """
+    rng = random.Random(0)
+    collection = MemoryCollection({'id': i, 'price': rng.randint(0, 10000)}
+                                  for i in range(100000))
+
+    def selector(**args):
+        return Selector(request_obj=ArgsRequest(sort='price:asc', limit=20,
+                                                **args),
+                        secret='benchmark')
+
+    if not keyset:
+        by_offset = selector(offset=offset)
+        return lambda: collection.select(by_offset)
+    cursor = collection.page(Selector(
+        request_obj=ArgsRequest(sort='price:asc', limit=offset),
+        secret='benchmark')).next_cursor
+    by_cursor = selector(cursor=cursor)
+    return lambda: collection.page(by_cursor)
+
+
+cases = {
+    'make_response/flat_dict': lambda: _make_response_case(flat_dict),
+    'make_response/deep_nesting': lambda: _make_response_case(deep_nesting),
+    'make_response/list_100k': lambda: _make_response_case(large_list),
+    'make_response/datetime_rows': lambda: _make_response_case(
+        datetime_rows),
+    'make_response/to_dict_objects': lambda: _make_response_case(
+        to_dict_objects),
+    'make_response/to_json_objects': lambda: _make_response_case(
+        to_json_objects),
+    'make_response/mongoengine_documents': lambda: _make_response_case(
+        documents),
+    'merge_tuples': _merge_tuples_case,
+    'encoder_default/to_dict_objects': lambda: _encoder_default_case(
+        to_dict_objects),
+    'encoder_default/datetimes': lambda: _encoder_default_case(
+        lambda: [datetime.datetime(2018, 1, 1, i % 24) for i in range(5000)]),
+    'encoder_default/decimals': lambda: _encoder_default_case(
+        lambda: [Decimal(i) for i in range(5000)]),
+    'encoder_default/legacy_to_dict_objects': lambda: _encoder_default_case(
+        to_dict_objects, LegacyEncoder),
+    'encoder_default/legacy_datetimes': lambda: _encoder_default_case(
+        lambda: [datetime.datetime(2018, 1, 1, i % 24) for i in range(5000)],
+        LegacyEncoder),
+    'encoder_default/legacy_decimals': lambda: _encoder_default_case(
+        lambda: [Decimal(i) for i in range(5000)], LegacyDecimalEncoder),
+    **{
+        'dumps/datetime_series_%s' % mode: (lambda mode=mode:
+                                            _dumps_case(mode))
+        for mode in datetime_modes
+    },
+    **{
+        'response/%s' % path: (lambda path=path: _response_case(path))
+        for path in ['generic', 'compiled', 'generic_traits',
+                     'compiled_traits', 'compiled_json_only',
+                     'generic_tuple', 'compiled_tuple', 'dumps_only']
+    },
+    'make_response/wide_documents': lambda: _projection_case(None),
+    'make_response/wide_documents_projected': lambda: _projection_case(
+        ['name', 'price', 'maker.name']),
+    **{
+        'validation/%s_%s' % (name, document): (
+            lambda compiled=compiled, document=document:
+            _validation_case(compiled, document))
+        for name, compiled in [('cerberus', False), ('compiled', True)]
+        for document in user_documents
+    },
+    'router/sync_view': lambda: _view_case('sync_view'),
+    'router/async_view': lambda: _view_case('async_view'),
+    'router/sync_io_workers': lambda: _workers_case('sync_io'),
+    'router/async_io_workers': lambda: _workers_case('async_io'),
+    'router/metrics_off': lambda: _metrics_case(None),
+    **{
+        'router/metrics_sampled_%s' % rate: (
+            lambda rate=rate: _metrics_case(RouteMetrics(sample_rate=rate)))
+        for rate in [1.0, 0.1, 0.01]
+    },
+    'selector/legacy': lambda: _selector_case(LegacySelector),
+    'selector/parsed_once': lambda: _selector_case(Selector),
+    **{
+        'memory_query/%s' % path: (lambda path=path:
+                                   _memory_query_case(path))
+        for path in ['ad_hoc', 'engine', 'indexed', 'unsorted_page']
+    },
+    **{
+        'pages/%s_%d' % ('keyset' if keyset else 'offset', offset): (
+            lambda offset=offset, keyset=keyset: _page_case(offset, keyset))
+        for offset in [20, 1000, 10000, 50000]
+        for keyset in [False, True]
+    },
+}
+
+
+def percentile(sorted_values, fraction):
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def measure(run, min_time=1.0, min_samples=20, max_samples=100000):
+    """
+    Runs the case until min_time has elapsed, with at least min_samples
+    samples. Latencies are in seconds, throughput in calls per second and
+    peak memory in bytes.
+    """
+    for _ in range(3):
+        run()
+
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_samples:
+        before = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - before)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time and len(samples) >= min_samples:
+            break
+    samples.sort()
+
+    tracemalloc.start()
+    run()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'throughput': len(samples) / sum(samples),
+        'p50': percentile(samples, 0.50),
+        'p99': percentile(samples, 0.99),
+        'peak_memory': peak_memory,
+    }
+
+
+def regressions(result, baseline, skip=()):
+    """ Returns a list of (metric, relative change) beyond the thresholds """
+    found = []
+    for metric, threshold in thresholds.items():
+        if metric in skip or metric not in baseline or not baseline[metric]:
+            continue
+        change = (result[metric] - baseline[metric]) / baseline[metric]
+        if metric == 'throughput':
+            change = -change
+        if change > threshold:
+            found.append((metric, change))
+    return found
+
+
+def _format_line(name, result, failed):
+    return '{:<38} {:>12.1f} {:>11.3f} {:>11.3f} {:>10.1f}  {}'.format(
+        name,
+        result['throughput'],
+        result['p50'] * 1000,
+        result['p99'] * 1000,
+        result['peak_memory'] / 1024,
+        ', '.join('%s +%.0f%%' % (m, c * 100) for m, c in failed),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--only', default='',
+                        help='run only the cases containing this string')
+    parser.add_argument('--baseline', default=baseline_path)
+    parser.add_argument('--min-time', type=float, default=1.0,
+                        help='minimum seconds spent on each case')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print('{:<38} {:>12} {:>11} {:>11} {:>10}  {}'.format(
+        'case', 'calls/s', 'p50 ms', 'p99 ms', 'peak KiB', 'regressions'))
+
+    results = {}
+    failed = False
+    for name, build in cases.items():
+        if args.only not in name:
+            continue
+        results[name] = measure(build(), min_time=args.min_time)
+        found = regressions(results[name], baseline.get(name, {}),
+                            ungated.get(name, ()))
+        failed = failed or bool(found)
+        print(_format_line(name, results[name], found))
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({**baseline, **results}, f, indent=2, sort_keys=True)
+        print('Baseline saved to %s' % args.baseline)
+        return 0
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,5 @@
 from .app_factory import create_app
 from .bac import BasicAccessControl
 from .config import get_configs
+from .json_formatter import register_encoder
 from .simple_router import Router, Selector, make_error
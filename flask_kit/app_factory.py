@@ -3,12 +3,13 @@ from flask_cors import CORS
 from flask_talisman import Talisman, DENY
 
 from .config import AppConfig
+from .json_formatter import set_datetime_mode, set_json_backend
 
 two_years = 63072000
 
 
 def create_app(configs=None, blueprints=None, https=True, hsts_age=two_years,
-               hsts_preload=False):
+               hsts_preload=False, json_backend=None, datetime_mode=None):
     """
     Flask app factory
     :param configs: Dict-like object with flask configs
@@ -16,10 +17,22 @@ def create_app(configs=None, blueprints=None, https=True, hsts_age=two_years,
     :param https: Force https
     :param hsts_age: Max age for HSTS header
     :param hsts_preload: Set preload for HSTS header
+    :param json_backend: JSON serializer used for responses ('json',
+                         'orjson', 'rapidjson', 'ujson' or 'auto'). This is
+                         process-wide. Optional.
+    :param datetime_mode: How dates are encoded on responses ('full', 'iso',
+                          'unix' or 'epoch_millis'). This is process-wide.
+                          Optional.
     :return:
     """
     app = Flask(__name__)
 
+    if json_backend:
+        set_json_backend(json_backend)
+
+    if datetime_mode:
+        set_datetime_mode(datetime_mode)
+
     if configs:
         AppConfig(app, configs)
 
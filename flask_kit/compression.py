@@ -0,0 +1,84 @@
+import gzip
+import zlib
+
+from .json_formatter import accept_qualities
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# Supported encodings, most preferred first
+encodings = (['br'] if brotli else []) + ['gzip', 'deflate']
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Returns the content encoding to use given an Accept-Encoding header,
+    or None if the response should not be compressed. Among the encodings
+    with the highest quality, ours are preferred in the order of `encodings`.
+    """
+    qualities = accept_qualities(accept_encoding)
+    wildcard = qualities.get('*', 0)
+    best, best_quality = None, 0
+    for encoding in encodings:
+        quality = qualities.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding, level=6):
+    """
+    Compress data (bytes) with the given content encoding.
+    Levels go from 1 to 9, and are capped to 11 for brotli.
+    """
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == 'deflate':
+        return zlib.compress(data, level)
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    raise ValueError('Unsupported encoding %s' % encoding)
+
+
+class _Brotli(object):
+    """ A brotli compressor with the zlib compressobj interface """
+
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self, mode=None):
+        if mode == zlib.Z_FINISH or mode is None:
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+def compressor(encoding, level=6):
+    """ An incremental compressor, as returned by zlib.compressobj """
+    if encoding == 'gzip':
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS)
+    if encoding == 'br':
+        return _Brotli(level)
+    raise ValueError('Unsupported encoding %s' % encoding)
+
+
+def iter_compressed(chunks, encoding, level=6):
+    """
+    Compress an iterable of str or bytes chunks incrementally. Every chunk
+    is flushed, so clients receive data as soon as it is produced.
+    """
+    compressobj = compressor(encoding, level)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressobj.compress(chunk) + compressobj.flush(
+            zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressobj.flush(zlib.Z_FINISH)
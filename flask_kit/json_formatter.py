@@ -1,37 +1,488 @@
+import base64
 import datetime
+import io
 import json
+import os
+import re
+import uuid
+from collections.abc import Iterator
+from decimal import Decimal
+from enum import Enum
+from functools import lru_cache
+from inspect import getattr_static
 from itertools import zip_longest
+from operator import methodcaller
+from types import FunctionType
+
+try:
+    from bson import ObjectId
+except ImportError:  # pragma: no cover
+    ObjectId = None
+
+try:
+    import cbor2.encoder
+except ImportError:  # pragma: no cover
+    cbor2 = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import rapidjson
+except ImportError:  # pragma: no cover
+    rapidjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
 
 _json_mime = 'application/json'
 _text_mime = 'text/plain'
+_ndjson_mime = 'application/x-ndjson'
+_ndjson_mimes = [_ndjson_mime, 'application/ndjson', 'application/jsonlines']
+_msgpack_mimes = ['application/msgpack', 'application/x-msgpack',
+                  'application/vnd.msgpack']
+_cbor_mime = 'application/cbor'
+_binary_mimes = {'msgpack': _msgpack_mimes[0], 'cbor': _cbor_mime}
 _default_headers = {}
 
+# Splicing of RawJSON fragments into the output, see set_raw_json
+_raw_json = {'splice': False, 'validate': False}
+_fragment_prefix = '__raw_json_%s_' % uuid.uuid4().hex
+_fragment_re = re.compile('"%s(\\d+)__"' % _fragment_prefix)
+
+
+# How dates and datetimes are encoded, see set_datetime_mode
+datetime_modes = ('full', 'iso', 'unix', 'epoch_millis')
+_datetime = {'mode': 'full'}
+_epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_millisecond = datetime.timedelta(milliseconds=1)
+
+
+def set_datetime_mode(mode='full'):
+    """
+    Set how dates and datetimes are encoded by default:
+        - full: a dict with iso, unix, tuple, tz and with_time
+        - iso: the ISO 8601 string
+        - unix: the unix timestamp in seconds, as a float
+        - epoch_millis: the unix timestamp in milliseconds, as an int
+    Dates are encoded as datetimes at midnight. The timestamps of naive
+    datetimes take them as UTC, the unix and epoch_millis timestamps of aware
+    ones are the instants they stand for (the unix value of the full mode
+    keeps being computed from their wall time).
+    """
+    if mode not in datetime_modes:
+        raise ValueError('Invalid datetime mode %s' % mode)
+    _datetime['mode'] = mode
+
 
-def encode_datetime(obj, with_time):
+def _encode_datetime(obj, with_time, mode):
+    if mode == 'iso':
+        return obj.isoformat()
+    wall_time = obj.replace(tzinfo=datetime.timezone.utc)
+    instant = wall_time if obj.tzinfo is None else obj
+    if mode == 'epoch_millis':
+        return (instant - _epoch) // _millisecond
+    if mode == 'unix':
+        return instant.timestamp()
     return {
         'with_time': with_time,
         'iso': obj.isoformat(),
-        'unix': obj.replace(tzinfo=datetime.timezone.utc).timestamp(),
+        'unix': wall_time.timestamp(),
         'tuple': obj.timetuple()[:6],
         'tz': obj.tzname() if getattr(obj, 'tzname') else None,
     }
 
 
+# Naive datetimes and dates repeat a lot on time series, and can be cached as
+# equal values always have the same encoding. Aware datetimes can't, as equal
+# instants in different timezones are encoded differently. The cached dicts
+# of the full mode are shared, and only given to the encoders.
+_encode_naive_datetime = lru_cache(maxsize=4096)(_encode_datetime)
+
+
+@lru_cache(maxsize=4096)
+def _encode_date(obj, mode):
+    dt = datetime.datetime(obj.year, obj.month, obj.day)
+    return _encode_datetime(dt, False, mode)
+
+
+def _encode_any_datetime(obj, with_time, mode):
+    if obj.tzinfo is None:
+        return _encode_naive_datetime(obj, with_time, mode)
+    return _encode_datetime(obj, with_time, mode)
+
+
+def encode_datetime(obj, with_time, mode='full'):
+    value = _encode_any_datetime(obj, with_time, mode)
+    return dict(value) if isinstance(value, dict) else value
+
+
+class RawJSON(object):
+    """
+    An already serialized JSON document, written to the output unchanged
+    when splicing is enabled. Encoders may return it to avoid decoding and
+    serializing the same value again.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def set_raw_json(splice=True, validate=False):
+    """
+    Embed the output of to_json methods (and any RawJSON) as is, instead of
+    parsing and serializing it again. Applies to `dumps` (and responses),
+    and to `json.dumps` and `json.dump` with `cls=Encoder`.
+
+    :param splice: enable splicing
+    :param validate: parse every fragment, raising ValueError if invalid
+    """
+    _raw_json['splice'] = splice
+    _raw_json['validate'] = validate
+
+
+def _encode_bytes(obj):
+    return base64.b64encode(obj).decode('ascii')
+
+
+# Encoders registered by the user, these take precedence over everything else
+_encoders = {}
+
+# Fallback encoders for common types, used after to_dict and to_json
+_builtin_encoders = {
+    Decimal: str,
+    uuid.UUID: str,
+    Enum: lambda obj: obj.value,
+    bytes: _encode_bytes,
+    bytearray: _encode_bytes,
+    set: list,
+    frozenset: list,
+}
+
+if ObjectId is not None:
+    _builtin_encoders[ObjectId] = str
+
+
+def _datetime_encoders(mode):
+    return {
+        datetime.datetime: lambda obj: _encode_any_datetime(obj, True,
+                                                            mode),
+        datetime.date: lambda obj: _encode_date(obj, mode),
+    }
+
+
+# Resolved encoder (or None) for every class seen by Encoder.default, for
+# each datetime mode
+_dispatch = {mode: {} for mode in datetime_modes}
+
+
+def register_encoder(cls, fn):
+    """
+    Register fn as the encoder for instances of cls and its subclasses.
+
+    fn receives the object and must return something JSON serializable.
+    Registered encoders take precedence over to_dict/to_json methods.
+
+    >>> register_encoder(Money, lambda m: {'amount': m.cents, 'cur': m.cur})
+    """
+    _encoders[cls] = fn
+    for table in _dispatch.values():
+        table.clear()
+
+
+def _method_caller(cls, name):
+    """
+    A function calling obj.<name>(), using the plain function from the class
+    when possible as it is considerably cheaper than a methodcaller
+    """
+    if isinstance(getattr_static(cls, name), FunctionType):
+        return getattr(cls, name)
+    return methodcaller(name)
+
+
+def _resolve_encoder(cls, datetime_mode):
+    for base in cls.__mro__:
+        if base in _encoders:
+            return _encoders[base]
+    if getattr(cls, 'to_dict', None):
+        return _method_caller(cls, 'to_dict')
+    if getattr(cls, 'to_json', None):
+        to_json = _method_caller(cls, 'to_json')
+        return lambda obj: RawJSON(to_json(obj))
+    builtin_encoders = {**_builtin_encoders,
+                        **_datetime_encoders(datetime_mode)}
+    for base in cls.__mro__:
+        if base in builtin_encoders:
+            return builtin_encoders[base]
+    return None
+
+
 class Encoder(json.JSONEncoder):
+    def __init__(self, *args, splice=None, datetime_mode=None, **kwargs):
+        super(Encoder, self).__init__(*args, **kwargs)
+        self.splice = _raw_json['splice'] if splice is None else splice
+        self.datetime_mode = datetime_mode or _datetime['mode']
+        if self.datetime_mode not in datetime_modes:
+            raise ValueError('Invalid datetime mode %s' % datetime_mode)
+        self._dispatch = _dispatch[self.datetime_mode]
+        self.fragments = []
+
     def default(self, obj):
-        to_dict = getattr(obj.__class__, "to_dict", None)
-        if to_dict:
-            return obj.to_dict()
-        to_json = getattr(obj.__class__, "to_json", None)
-        if to_json:
-            return json.loads(obj.to_json())
-        if isinstance(obj, datetime.datetime):
-            return encode_datetime(obj, True)
-        if isinstance(obj, datetime.date):
-            dt = datetime.datetime(*obj.timetuple()[:3], 0, 0, 0)
-            print(dt)
-            return encode_datetime(dt, False)
-        return super(Encoder, self).default(obj)
+        cls = obj.__class__
+        if cls is RawJSON:
+            return self._raw_json(obj.value)
+        try:
+            encode = self._dispatch[cls]
+        except KeyError:
+            encode = self._dispatch[cls] = _resolve_encoder(
+                cls, self.datetime_mode)
+        if encode is None:
+            return super(Encoder, self).default(obj)
+        return encode(obj)
+
+    def encode(self, o):
+        text = self.splice_fragments(super(Encoder, self).encode(o))
+        self.fragments = []
+        return text
+
+    def iterencode(self, o, _one_shot=False):
+        chunks = super(Encoder, self).iterencode(o, _one_shot)
+        if _one_shot or not self.splice:
+            # encode splices the whole text
+            return chunks
+        # Placeholders are written whole, in the chunk of their string
+        return (self.splice_fragments(chunk) for chunk in chunks)
+
+    def _raw_json(self, value):
+        if not self.splice:
+            return json.loads(value)
+        if _raw_json['validate']:
+            try:
+                json.loads(value)
+            except ValueError as e:
+                raise ValueError('Invalid raw JSON fragment: %s' % e)
+        self.fragments.append(value)
+        return '%s%d__' % (_fragment_prefix, len(self.fragments) - 1)
+
+    def splice_fragments(self, text):
+        """ Replaces the fragment placeholders on text by the raw JSON """
+        if not self.fragments:
+            return text
+        return _fragment_re.sub(lambda m: self.fragments[int(m.group(1))],
+                                text)
+
+
+class JsonBackend(object):
+    """
+    A JSON serializer used by `make_response`, also used to parse request
+    bodies.
+
+    Given the same payload, `dumps` must return exactly what
+    `json.dumps(obj, cls=Encoder, separators=..., ensure_ascii=...)` would,
+    using the `separators` and `ensure_ascii` declared by the backend, but
+    for the kinds of values named in `differences` (described on each
+    backend).
+    """
+    name = None
+    module = None
+    separators = (', ', ': ')
+    ensure_ascii = True
+    differences = ()
+
+    @classmethod
+    def available(cls):
+        return cls.module is not None
+
+    def dumps(self, obj, encoder):
+        raise NotImplementedError
+
+    def loads(self, data):
+        """ Parse a JSON document from str or bytes """
+        return self.module.loads(data)
+
+
+class StdlibBackend(JsonBackend):
+    name = 'json'
+    module = json
+
+    def dumps(self, obj, encoder):
+        return encoder.encode(obj)
+
+
+class OrjsonBackend(JsonBackend):
+    """
+    Compact, non-ASCII-escaping output. Note that floats in exponent
+    notation are written without the sign and padding of the exponent
+    (1e16, 1e-7 instead of 1e+16, 1e-07), and NaN and infinities as null.
+    Integers wider than 64 bits are serialized with the standard library.
+    """
+    name = 'orjson'
+    module = orjson
+    separators = (',', ':')
+    ensure_ascii = False
+    differences = ('float exponents', 'non-finite floats')
+
+    def __init__(self):
+        self.options = (orjson.OPT_NON_STR_KEYS |
+                        orjson.OPT_PASSTHROUGH_DATETIME |
+                        orjson.OPT_PASSTHROUGH_DATACLASS)
+
+    def dumps(self, obj, encoder):
+        try:
+            return orjson.dumps(obj, default=encoder.default,
+                                option=self.options).decode('utf-8')
+        except orjson.JSONEncodeError:
+            # Unsupported values, or objects no encoder can serialize (the
+            # standard library raises a TypeError for those too)
+            encoder.fragments = []
+            return json.dumps(obj, default=encoder.default,
+                              separators=self.separators,
+                              ensure_ascii=self.ensure_ascii)
+
+
+class RapidjsonBackend(JsonBackend):
+    """
+    Compact, non-ASCII-escaping output. Note that None and boolean dict keys
+    are written as "None", "True" and "False".
+    """
+    name = 'rapidjson'
+    module = rapidjson
+    separators = (',', ':')
+    ensure_ascii = False
+    differences = ('null and boolean keys',)
+
+    def dumps(self, obj, encoder):
+        return rapidjson.dumps(
+            obj,
+            default=encoder.default,
+            ensure_ascii=False,
+            bytes_mode=rapidjson.BM_NONE,
+            mapping_mode=rapidjson.MM_COERCE_KEYS_TO_STRINGS,
+        )
+
+
+class UjsonBackend(JsonBackend):
+    """
+    Note that ujson writes Decimal values as JSON numbers, and negative
+    exponents of floats without padding (1e-7 instead of 1e-07)
+    """
+    name = 'ujson'
+    module = ujson
+    differences = ('float exponents', 'decimals')
+
+    def dumps(self, obj, encoder):
+        return ujson.dumps(obj, default=encoder.default,
+                           ensure_ascii=True,
+                           escape_forward_slashes=False,
+                           separators=self.separators)
+
+
+# Ordered from fastest to slowest, used when picking a backend with 'auto'
+json_backends = [OrjsonBackend, RapidjsonBackend, UjsonBackend, StdlibBackend]
+
+
+def available_json_backends():
+    """ Names of the JSON backends that can be used on this environment """
+    return [b.name for b in json_backends if b.available()]
+
+
+def resolve_json_backend(backend='json'):
+    """
+    Returns a `JsonBackend` instance given a backend name, 'auto' for the
+    fastest one installed, or an instance (returned as is)
+    """
+    if isinstance(backend, JsonBackend):
+        return backend
+
+    if backend == 'auto':
+        backend = available_json_backends()[0]
+
+    by_name = {b.name: b for b in json_backends}
+    if backend not in by_name:
+        raise ValueError('Unknown JSON backend "%s"' % backend)
+    if not by_name[backend].available():
+        raise ValueError('JSON backend "%s" is not installed' % backend)
+    return by_name[backend]()
+
+
+def set_json_backend(backend='json'):
+    """
+    Select the serializer used by `make_response`.
+
+    :param backend: a backend name, 'auto' for the fastest one installed, or
+                    a `JsonBackend` instance. The output only differs from
+                    the one of 'json' on the `differences` of the backend.
+    :return: the selected backend
+    """
+    global _backend
+    _backend = resolve_json_backend(backend)
+    return _backend
+
+
+def get_json_backend():
+    """ Returns the serializer currently used by `make_response` """
+    return _backend
+
+
+def dumps(obj, datetime_mode=None):
+    """ Serialize obj to a JSON string using the selected backend """
+    encoder = Encoder(datetime_mode=datetime_mode)
+    return encoder.splice_fragments(_backend.dumps(obj, encoder))
+
+
+_backend = None
+set_json_backend(os.environ.get('FLASK_KIT_JSON_BACKEND', 'json'))
+
+
+def available_binary_formats():
+    """ Binary formats that can be negotiated on this environment """
+    return [name for name, module in [('msgpack', msgpack), ('cbor', cbor2)]
+            if module is not None]
+
+
+def pack(obj, binary_format, datetime_mode=None):
+    """
+    Serialize obj to 'msgpack' or 'cbor' bytes, using the same type hooks as
+    the JSON responses. Bytes are kept as binary, and raw JSON fragments are
+    decoded.
+    """
+    encoder = Encoder(splice=False, datetime_mode=datetime_mode)
+
+    def default(value):
+        value = encoder.default(value)
+        if value.__class__ is RawJSON:
+            return json.loads(value.value)
+        return value
+
+    if binary_format == 'msgpack' and msgpack is not None:
+        return msgpack.packb(obj, default=default, use_bin_type=True)
+    if binary_format == 'cbor' and cbor2 is not None:
+        def hook(cbor_encoder, value):
+            cbor_encoder.encode(default(value))
+
+        output = io.BytesIO()
+        cbor_encoder = cbor2.encoder.CBOREncoder(output, default=hook)
+        # cbor2 encodes these natively and only calls default for the rest,
+        # so its type table sends them to the same hook (the C encoder
+        # handles datetimes and sets before looking at it, the Python one
+        # doesn't). Some are listed by name, imported on first use.
+        for cls in [datetime.datetime, datetime.date, Decimal, uuid.UUID,
+                    set, frozenset] + list(_encoders):
+            cbor_encoder._encoders.pop((cls.__module__, cls.__name__), None)
+            cbor_encoder._encoders[cls] = hook
+        cbor_encoder.encode(obj)
+        return output.getvalue()
+    raise ValueError('Binary format %s is not available' % binary_format)
 
 
 def merge_tuples(defaults, values):
@@ -47,23 +498,284 @@ def merge_tuples(defaults, values):
     )
 
 
-def make_response(resp=None):
+@lru_cache(maxsize=256)
+def projection_tree(fields):
+    """
+    The tree of a tuple of dotted paths, e.g. ('a', 'b.c', 'b.d') gives
+    {'a': None, 'b': {'c': None, 'd': None}}, None selecting a whole value
+    """
+    tree = {}
+    for path in fields:
+        node = tree
+        parts = path.split('.')
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if node is None:
+                # A parent is selected whole
+                break
+        else:
+            node[parts[-1]] = None
+    return tree
+
+
+# Values that are never projected, nor converted ahead of the serializer
+_unprojected = (str, int, float, bool, type(None), bytes, bytearray)
+
+
+def projector(fields, datetime_mode=None):
     """
-    Correctly format the route response
+    A function projecting a body on fields (dotted paths): dicts only keep
+    the selected keys, lists are projected item by item. Objects encoded as
+    dicts (with to_dict or a registered encoder) are converted first, so
+    the values left out are never encoded. Raw JSON, e.g. the output of
+    to_json (mongoengine documents), is decoded to be projected.
     """
-    body, status, headers = merge_tuples(('', 200, {}), resp)
+    tree = projection_tree(tuple(fields))
+    mode = datetime_mode or _datetime['mode']
+    dispatch = _dispatch[mode]
+
+    def project(obj, tree):
+        cls = obj.__class__
+        if cls is not dict and cls is not list:
+            if isinstance(obj, _unprojected):
+                return obj
+            try:
+                encode = dispatch[cls]
+            except KeyError:
+                encode = dispatch[cls] = _resolve_encoder(cls, mode)
+            if encode is not None:
+                obj = encode(obj)
+            if obj.__class__ is RawJSON:
+                obj = json.loads(obj.value)
+            if not isinstance(obj, (dict, list, tuple)):
+                return obj
+        if isinstance(obj, dict):
+            return {key: value if tree[key] is None else project(value,
+                                                                 tree[key])
+                    for key, value in obj.items() if key in tree}
+        return [project(item, tree) for item in obj]
+
+    return lambda obj: project(obj, tree)
+
+
+def project(obj, fields, datetime_mode=None):
+    """ obj projected on fields, see `projector` """
+    return projector(fields, datetime_mode)(obj)
+
+
+def make_response(resp=None, datetime_mode=None, accept=None, status=None,
+                  headers=None, fields=None):
+    """
+    Correctly format the route response. Bodies other than strings are
+    serialized to JSON, or to MessagePack or CBOR if the `accept` header
+    prefers them. `status` and `headers` are defaults for the ones returned
+    by the view. Bodies are projected on `fields` (dotted paths) when given,
+    see `projector`.
+    """
+    body, resp_status, resp_headers = merge_tuples(('', status or 200, {}),
+                                                   resp)
+    if fields is not None and not isinstance(body, str):
+        body = project(body, fields, datetime_mode)
     content_type = _text_mime
-    has_status = isinstance(resp, tuple) and len(resp) >= 2
+    has_status = status is not None or (
+        isinstance(resp, tuple) and len(resp) >= 2)
+    if headers:
+        resp_headers = {**headers, **resp_headers}
 
-    if resp is None or (body == '' and not has_status):
-        status = 204
+    if not has_status and (resp is None or body == ''):
+        resp_status = 204
 
     if not isinstance(body, str):
-        body = json.dumps(body, cls=Encoder)
-        content_type = _json_mime
+        body_format = response_format(accept)
+        if body_format == 'json':
+            body = dumps(body, datetime_mode)
+            content_type = _json_mime
+        else:
+            body = pack(body, body_format, datetime_mode)
+            content_type = _binary_mimes[body_format]
+        if accept is not None:
+            resp_headers = add_vary(resp_headers, 'Accept')
 
-    return body, status, {
+    return body, resp_status, {
         **_default_headers,
         'Content-Type': content_type,
-        **headers,
+        **resp_headers,
+    }
+
+
+def compile_response(status=None, headers=None, json_only=False,
+                     datetime_mode=None):
+    """
+    Returns a function equivalent to `make_response` for a route with the
+    given response traits, with as much work as possible done upfront.
+    Views returning a dict or a list take a direct path, anything else goes
+    through `make_response`.
+
+    :param status: status used when the view does not return one
+    :param headers: static headers, overridden by the ones from the view
+    :param json_only: always answer with JSON, ignoring the Accept header
+    :param datetime_mode: the datetime mode of the route
+    """
+    headers = dict(headers or {})
+    fixed_status = status or 200
+    json_headers = {**_default_headers, 'Content-Type': _json_mime, **headers}
+    negotiated_headers = {
+        **_default_headers,
+        'Content-Type': _json_mime,
+        **add_vary(headers, 'Accept'),
+    }
+
+    def respond(resp=None, accept=None, fields=None):
+        if json_only:
+            accept = None
+        if fields is not None:
+            if resp.__class__ is not dict and resp.__class__ is not list:
+                return make_response(resp, datetime_mode, accept, status,
+                                     headers, fields)
+            resp = project(resp, fields, datetime_mode)
+        if resp.__class__ is dict or resp.__class__ is list:
+            if accept is None:
+                return (dumps(resp, datetime_mode), fixed_status,
+                        dict(json_headers))
+            if not accept or _cached_format(accept) == 'json':
+                return (dumps(resp, datetime_mode), fixed_status,
+                        dict(negotiated_headers))
+        return make_response(resp, datetime_mode, accept, status, headers)
+
+    return respond
+
+
+def accept_qualities(header):
+    """
+    Returns a dict with the quality of each value on an Accept-like header,
+    in the order they appear. Values explicitly refused have quality 0.
+    """
+    qualities = {}
+    for item in (header or '').split(','):
+        parts = item.split(';')
+        value = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, raw = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(raw)
+                except ValueError:
+                    quality = 0.0
+        if value:
+            qualities[value] = quality
+    return qualities
+
+
+def parse_accept(header):
+    """
+    Returns the values of an Accept-like header, most preferred first.
+    Values with q=0 are dropped.
+    """
+    qualities = accept_qualities(header)
+    accepted = [value for value in qualities if qualities[value] > 0]
+    return sorted(accepted, key=lambda value: -qualities[value])
+
+
+def response_format(accept=None):
+    """
+    Pick 'json', 'msgpack' or 'cbor' for a response given an Accept header.
+    JSON is used unless a binary format is preferred and available.
+    """
+    for mime in parse_accept(accept):
+        if mime in _msgpack_mimes and msgpack is not None:
+            return 'msgpack'
+        if mime == _cbor_mime and cbor2 is not None:
+            return 'cbor'
+        if mime in (_json_mime, 'application/*', '*/*'):
+            return 'json'
+    return 'json'
+
+
+# Clients send a handful of distinct Accept headers, the compiled responses
+# negotiate each one only once
+_cached_format = lru_cache(maxsize=256)(response_format)
+
+
+def add_vary(headers, value):
+    """ Returns a copy of headers with value added to the Vary header """
+    vary = headers.get('Vary')
+    if not vary:
+        return {**headers, 'Vary': value}
+    if value.lower() in [v.strip().lower() for v in vary.split(',')]:
+        return dict(headers)
+    return {**headers, 'Vary': '%s, %s' % (vary, value)}
+
+
+def is_stream(body, lists=False):
+    """
+    True if body should be streamed: any iterator or generator, and lists
+    or tuples if `lists` is set
+    """
+    return isinstance(body, Iterator) or (
+        lists and isinstance(body, (list, tuple)))
+
+
+def stream_format(accept=None, default='json'):
+    """
+    Pick 'json' (a JSON array) or 'ndjson' (newline delimited JSON) for a
+    streamed response, given an Accept header
+    """
+    for mime in parse_accept(accept):
+        if mime in _ndjson_mimes:
+            return 'ndjson'
+        if mime in (_json_mime, 'application/*', '*/*'):
+            return default
+    return default
+
+
+def iter_json(iterable, ndjson=False, flush_size=16384, datetime_mode=None,
+              fields=None):
+    """
+    Serialize the items of iterable one at a time, as a JSON array or as
+    newline delimited JSON. Yields chunks of at least flush_size characters,
+    except for the last one. Items are projected on fields when given.
+    """
+    if fields is not None:
+        iterable = map(projector(fields, datetime_mode), iterable)
+    separator = '\n' if ndjson else _backend.separators[0]
+    buffer = [] if ndjson else ['[']
+    size = len(buffer)
+    first = True
+
+    for item in iterable:
+        chunk = dumps(item, datetime_mode)
+        if ndjson:
+            chunk += separator
+        elif not first:
+            chunk = separator + chunk
+        first = False
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= flush_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+
+    if not ndjson:
+        buffer.append(']')
+    if buffer:
+        yield ''.join(buffer)
+
+
+def make_stream_response(resp, ndjson=False, flush_size=16384,
+                         datetime_mode=None, status=None, headers=None,
+                         fields=None):
+    """
+    Like `make_response`, but the body is an iterable that is serialized
+    incrementally by `iter_json`
+    """
+    body, resp_status, resp_headers = merge_tuples(((), status or 200, {}),
+                                                   resp)
+    body = iter_json(body, ndjson, flush_size, datetime_mode, fields)
+    return body, resp_status, {
+        **_default_headers,
+        'Content-Type': _ndjson_mime if ndjson else _json_mime,
+        **(headers or {}),
+        **resp_headers,
     }
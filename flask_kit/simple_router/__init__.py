@@ -1 +1,7 @@
-from .simple_router import Router, Selector, make_error
+from .simple_router import (
+    QueryError,
+    RenderedResponse,
+    Router,
+    Selector,
+    make_error,
+)
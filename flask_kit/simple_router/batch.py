@@ -0,0 +1,143 @@
+"""
+Execution of several operations on the API in a single request, see the
+`batch_route` option of `Router`.
+
+Each operation is dispatched through the Flask application as a request of
+its own, with the headers of the batch request (so authentication and
+access checks apply as usual), in a fresh application and request context.
+Consecutive GET operations are independent of each other and can run
+concurrently, other methods run alone, in order.
+"""
+import json
+
+from werkzeug.test import EnvironBuilder
+
+from flask_kit.json_formatter import RawJSON
+
+# Set on the WSGI environment of the operations, batches can't be nested
+batch_environ_key = 'flask_kit.batch_operation'
+
+batch_methods = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+# Headers of the batch request that don't apply to its operations
+_dropped_headers = {
+    'accept',
+    'accept-encoding',
+    'content-length',
+    'content-type',
+    'if-match',
+    'if-modified-since',
+    'if-none-match',
+    'if-unmodified-since',
+}
+
+
+class BatchError(Exception):
+    """ An invalid batch request """
+
+
+def parse_operations(document, max_operations=None):
+    """
+    Validates a batch request body, a list of {method, path, body}
+    operations, returning the list of (method, path, body)
+    """
+    if not isinstance(document, list):
+        raise BatchError('Batch body must be a list of operations')
+    if max_operations is not None and len(document) > max_operations:
+        raise BatchError('Batch with more than %d operations'
+                         % max_operations)
+    operations = []
+    for index, operation in enumerate(document):
+        if not isinstance(operation, dict) or set(operation) - {
+                'method', 'path', 'body'}:
+            raise BatchError('Invalid operation %d' % index)
+        method = str(operation.get('method', 'GET')).upper()
+        path = operation.get('path')
+        if method not in batch_methods:
+            raise BatchError('Invalid method on operation %d' % index)
+        if not isinstance(path, str) or not path.startswith('/'):
+            raise BatchError('Invalid path on operation %d' % index)
+        operations.append((method, path, operation.get('body')))
+    return operations
+
+
+def schedule(operations):
+    """
+    Groups the indexes of operations in the order they must run: runs of
+    consecutive GETs form a group, any other operation is a group alone
+    """
+    groups = []
+    previous = None
+    for index, (method, _, _) in enumerate(operations):
+        if method == 'GET' and previous == 'GET':
+            groups[-1].append(index)
+        else:
+            groups.append([index])
+        previous = method
+    return groups
+
+
+def operation_environ(request, method, path, body):
+    """ The WSGI environment of an operation of the batch request """
+    headers = [(name, value) for name, value in request.headers.items()
+               if name.lower() not in _dropped_headers]
+    if body is not None:
+        headers.append(('Content-Type', 'application/json'))
+        body = json.dumps(body)
+    builder = EnvironBuilder(
+        path=path,
+        base_url=request.host_url.rstrip('/') + request.script_root,
+        method=method,
+        headers=headers,
+        data=body,
+        environ_base={
+            'REMOTE_ADDR': request.remote_addr or '',
+            batch_environ_key: True,
+        },
+    )
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+
+def dispatch(app, environ):
+    """
+    Runs a request through app, as its WSGI entry point would, returning
+    its status and body. JSON bodies are returned as `RawJSON`, so they
+    can be spliced in the batch response.
+    """
+    with app.app_context(), app.request_context(environ):
+        try:
+            response = app.full_dispatch_request()
+        except Exception as e:
+            response = app.make_response(app.handle_exception(e))
+        try:
+            if response.is_json:
+                data = response.get_data(as_text=True)
+                body = RawJSON(data) if data.strip() else None
+            else:
+                body = response.get_data(as_text=True) or None
+            return {'status': response.status_code, 'body': body}
+        finally:
+            response.close()
+
+
+def run_batch(app, request, operations, executor=None):
+    """
+    Dispatches operations, running groups of GETs on executor when given.
+    Returns the list of their results, in order.
+    """
+    environs = [operation_environ(request, *operation)
+                for operation in operations]
+    results = [None] * len(operations)
+    for group in schedule(operations):
+        if executor is None or len(group) == 1:
+            for index in group:
+                results[index] = dispatch(app, environs[index])
+            continue
+        futures = [(index, executor.submit(dispatch, app, environs[index]))
+                   for index in group]
+        for index, future in futures:
+            results[index] = future.result()
+    return results
@@ -0,0 +1,121 @@
+"""
+Bounded parsing of JSON request bodies.
+
+Bodies larger than the limit are refused from their Content-Length, or while
+being read when it is missing, without parsing anything. Documents
+can also be limited in depth and in number of keys, checked on the raw body
+before parsing it.
+"""
+import io
+import re
+
+from flask_kit.json_formatter import resolve_json_backend
+
+# Strings (skipped, as they may hold brackets and colons) and the structural
+# characters of a JSON document
+_structure_tokens = re.compile(rb'"(?:[^"\\]|\\.)*"|[\[\]{}:]')
+
+
+class BodyError(Exception):
+    """ A request body that was refused, with the status to answer with """
+
+    def __init__(self, message, status=400):
+        super(BodyError, self).__init__(message)
+        self.status = status
+
+
+def read_body(request, max_size=None, chunk_size=65536):
+    """
+    Returns the raw request body, refusing it past max_size bytes. It's read
+    with `get_data(cache=True)`, so the view can still use `request.data`
+    or `request.get_json()`.
+    """
+    if max_size is not None:
+        try:
+            length = int(request.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = 0
+        if length > max_size:
+            raise _too_large(max_size)
+        if not length:
+            # Without a Content-Length the stream isn't bounded by it: read
+            # it up to the limit, and hand what was read back to the request
+            request.stream = io.BytesIO(
+                _read_stream(request.stream, max_size, chunk_size))
+    return request.get_data(cache=True)
+
+
+def _read_stream(stream, max_size, chunk_size):
+    chunks = []
+    size = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_size:
+            raise _too_large(max_size)
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def _too_large(max_size):
+    return BodyError('Request body larger than %d bytes' % max_size, 413)
+
+
+def _too_deep(max_depth):
+    return BodyError('JSON body nested deeper than %d' % max_depth)
+
+
+def _too_many_keys(max_keys):
+    return BodyError('JSON body with more than %d keys' % max_keys)
+
+
+def scan_structure(data, max_depth=None, max_keys=None):
+    """
+    Raises BodyError if the JSON document data (bytes) nests lists and
+    dicts deeper than max_depth, or has more than max_keys dict keys in
+    total, scanning it up to the first excess without parsing it.
+    """
+    # Documents with fewer brackets or colons than the limits are within them
+    if max_depth is not None and (
+            data.count(b'[') + data.count(b'{') <= max_depth):
+        max_depth = None
+    if max_keys is not None and data.count(b':') <= max_keys:
+        max_keys = None
+    if max_depth is None and max_keys is None:
+        return
+
+    depth = keys = 0
+    for match in _structure_tokens.finditer(data):
+        token = match.group()
+        if token == b'{' or token == b'[':
+            depth += 1
+            if max_depth is not None and depth > max_depth:
+                raise _too_deep(max_depth)
+        elif token == b'}' or token == b']':
+            depth -= 1
+        elif token == b':':
+            keys += 1
+            if max_keys is not None and keys > max_keys:
+                raise _too_many_keys(max_keys)
+
+
+def parse_json_body(request, max_size=None, max_depth=None, max_keys=None,
+                    decoder=None):
+    """
+    Reads and parses the JSON body of request within the given limits.
+    Returns None for empty bodies and raises BodyError for refused ones.
+
+    :param decoder: the JSON backend (name or instance) used to parse,
+                    defaults to the standard library
+    """
+    data = read_body(request, max_size)
+    if not data.strip():
+        return None
+    scan_structure(data, max_depth, max_keys)
+    decoder = resolve_json_backend(decoder or 'json')
+    try:
+        return decoder.loads(data)
+    except (ValueError, RecursionError):
+        raise BodyError('Invalid JSON body')
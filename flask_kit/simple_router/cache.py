@@ -0,0 +1,246 @@
+"""
+Cache of serialized route responses, see the `cache` option of
+`Router.route`.
+
+Entries live in a `CacheBackend`. `MemoryCache`, the default, keeps them in
+the process; backends storing them elsewhere (e.g. Redis or memcached) let
+every worker share the same entries.
+"""
+import datetime
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from decimal import Decimal
+
+try:
+    from bson import ObjectId
+except ImportError:  # pragma: no cover
+    ObjectId = None
+
+# Types other than the JSON ones allowed in keys, as their str identifies
+# their value
+_key_types = (datetime.date, datetime.time, Decimal, uuid.UUID)
+if ObjectId is not None:
+    _key_types += (ObjectId,)
+
+
+class CacheBackend(object):
+    """
+    Storage of cached responses. Entries are opaque values, keys are
+    strings. Backends shared between processes must serialize the entries
+    (e.g. with pickle) and expire them after ttl seconds.
+    """
+
+    def get(self, key):
+        """ The entry stored for key, or None if missing or expired """
+        raise NotImplementedError
+
+    def set(self, key, entry, ttl, tags=()):
+        """ Store entry for ttl seconds, tagged with tags """
+        raise NotImplementedError
+
+    def invalidate(self, tags):
+        """ Drop every entry tagged with any of tags """
+        raise NotImplementedError
+
+    def clear(self):
+        """ Drop every entry """
+        raise NotImplementedError
+
+    def stats(self):
+        """ A dict of backend specific statistics """
+        return {}
+
+
+class MemoryCache(CacheBackend):
+    """
+    A per-process LRU cache, bounded by the approximate size in bytes of the
+    stored responses.
+    """
+
+    def __init__(self, max_size=64 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                entry, expires, _, _ = self._entries[key]
+            except KeyError:
+                return None
+            if expires <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, ttl, tags=()):
+        size = entry_size(key, entry)
+        if size > self.max_size:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (entry, time.monotonic() + ttl, size,
+                                  tuple(tags))
+            self.size += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'size': self.size,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+    def _remove(self, key):
+        _, _, size, tags = self._entries.pop(key)
+        self.size -= size
+        for tag in tags:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+
+def entry_size(key, entry):
+    """ Approximate memory used by a cached response tuple, in bytes """
+    (body, status, headers), _ = entry
+    size = 256 + len(key) + len(body)
+    for name, value in headers.items():
+        size += len(name) + len(str(value))
+    return size
+
+
+class ResponseCache(object):
+    """ A cache backend with hit and miss statistics """
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryCache()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.backend.get(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def set(self, key, entry, ttl, tags=()):
+        self.backend.set(key, entry, ttl, tags)
+        with self._lock:
+            self.stores += 1
+
+    def invalidate(self, *tags):
+        """ Drop the responses cached with any of tags """
+        self.backend.invalidate(tags)
+        with self._lock:
+            self.invalidations += 1
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        """ Hit/miss counters of this process, and the backend stats """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'stores': self.stores,
+            'invalidations': self.invalidations,
+            **self.backend.stats(),
+        }
+
+
+def cache_options(cache):
+    """
+    Normalizes the `cache` option of a route, a TTL in seconds or a dict
+    with 'ttl', 'tags' and 'vary', to a dict (or None when not cached)
+    """
+    if cache is None or cache is False:
+        return None
+    if not isinstance(cache, dict):
+        cache = {'ttl': cache}
+    unknown = set(cache) - {'ttl', 'tags', 'vary'}
+    if unknown or not isinstance(cache.get('ttl'), (int, float)):
+        raise ValueError('Invalid cache option %r' % cache)
+    return {'tags': (), 'vary': None, **cache}
+
+
+def tags_for(tags, view_args):
+    """ The tags of a route, calling tags with the view arguments if needed """
+    if callable(tags):
+        return tags(**view_args)
+    return tags
+
+
+def response_status(resp):
+    """ The status of a view return value, before formatting """
+    if isinstance(resp, tuple) and len(resp) >= 2 and resp[1] is not None:
+        return resp[1]
+    return 200
+
+
+def cache_key(route, view_args, filters, sort, limit, offset, variant):
+    """
+    A string key for a response, given the route endpoint, the view
+    arguments, the query parsed by `Selector` and the negotiated variant.
+    Filters are sorted, as their order doesn't change their meaning.
+
+    Parts must be JSON values, dates, times, decimals, UUIDs or ObjectIds:
+    other objects (e.g. a user given to the view by the decorator hook)
+    raise TypeError, as their str doesn't tell equal values from different
+    ones. The hook should pass a JSON key instead, or the route a 'vary'.
+    """
+    parts = [
+        route,
+        sorted(view_args.items()),
+        sorted(filters, key=lambda f: json.dumps(f, sort_keys=True)),
+        sort,
+        limit,
+        offset,
+        variant,
+    ]
+    raw = json.dumps(parts, sort_keys=True, default=_key_part)
+    return '%s:%s' % (route, hashlib.blake2b(raw.encode('utf-8'),
+                                             digest_size=16).hexdigest())
+
+
+def _key_part(value):
+    if isinstance(value, _key_types):
+        return [value.__class__.__name__, str(value)]
+    raise TypeError('Cannot build a cache key from %s %r, pass a JSON value '
+                    'instead' % (value.__class__.__name__, value))
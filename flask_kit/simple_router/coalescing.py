@@ -0,0 +1,109 @@
+"""
+Coalescing of identical concurrent requests ("single flight"), see the
+`coalesce` options of `Router`.
+"""
+import threading
+
+
+class _Call(object):
+    __slots__ = ('key', 'done', 'result', 'error')
+
+    def __init__(self, key):
+        self.key = key
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Runs a function once per key among concurrent callers: the first caller
+    runs it, the ones arriving while it runs wait and get the same result,
+    or the same exception.
+    """
+
+    def __init__(self):
+        self.executions = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        """
+        Returns a tuple with the result of fn and whether it was computed by
+        this caller. Callers waiting for more than timeout seconds stop
+        waiting and run fn themselves.
+        """
+        call, leader = self.join(key)
+        if not leader:
+            if self.wait(call, timeout):
+                return call.result, False
+            return fn(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(call, error=e)
+            raise
+        self.finish(call, result)
+        return result, True
+
+    def join(self, key):
+        """
+        Returns the call running for key, started if there is none, and
+        whether this caller leads it. The leader ends it with `finish`, the
+        other callers `wait` for it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                return call, False
+            call = self._calls[key] = _Call(key)
+            self.executions += 1
+        return call, True
+
+    def finish(self, call, result=None, error=None):
+        """ Ends a call led by this caller with its result or exception """
+        call.result = result
+        call.error = error
+        with self._lock:
+            del self._calls[call.key]
+        call.done.set()
+
+    def wait(self, call, timeout=None):
+        """
+        Waits for a call led by another caller: True once it has finished
+        (raising its exception if it failed), False after timeout seconds
+        """
+        if not call.done.wait(timeout):
+            with self._lock:
+                self.timeouts += 1
+            return False
+        with self._lock:
+            self.coalesced += 1
+        if call.error is not None:
+            raise call.error
+        return True
+
+    def stats(self):
+        """ Executions, requests served by another execution and timeouts """
+        return {
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'timeouts': self.timeouts,
+            'in_flight': len(self._calls),
+        }
+
+
+def coalesce_options(coalesce):
+    """
+    Normalizes the `coalesce` option of a route, a boolean or a dict with
+    'vary', to a dict (or None when not coalesced)
+    """
+    if not coalesce:
+        return None
+    if coalesce is True:
+        coalesce = {}
+    if not isinstance(coalesce, dict) or set(coalesce) - {'vary'}:
+        raise ValueError('Invalid coalesce option %r' % coalesce)
+    return {'vary': None, **coalesce}
@@ -0,0 +1,106 @@
+"""
+Coercion of query string values to the types of the fields they filter, so
+predicates compare (and databases look up their indexes with) typed values
+instead of strings. Types are described with Cerberus type names, alone or
+in a dict of rules, so validation schemas can be reused:
+
+    selector.filter(types={
+        'price': 'float',
+        'created': {'type': 'datetime'},
+        'owner': 'objectid',
+        'tags': {'type': 'list', 'schema': {'type': 'string'}},
+    })
+
+The values of in and nin filters are coerced one by one, list fields are
+filtered with the type of their items.
+"""
+import datetime
+import math
+
+try:
+    from bson import ObjectId
+    from bson.errors import InvalidId
+except ImportError:  # pragma: no cover
+    ObjectId = None
+
+
+def _boolean(value):
+    try:
+        return {'true': True, 'false': False, '1': True, '0': False}[
+            value.lower()]
+    except KeyError:
+        raise ValueError('not a boolean')
+
+
+def _float(value):
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError('not a finite number')
+    return number
+
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return _float(value)
+
+
+def _datetime(value):
+    # fromisoformat only takes the 'Z' suffix from Python 3.11
+    if value.endswith(('Z', 'z')):
+        value = value[:-1] + '+00:00'
+    return datetime.datetime.fromisoformat(value)
+
+
+def _object_id(value):
+    if ObjectId is None:  # pragma: no cover
+        raise TypeError('The objectid type needs bson (pymongo)')
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise ValueError('not an ObjectId')
+
+
+_coercers = {
+    'string': str,
+    'integer': int,
+    'float': _float,
+    'number': _number,
+    'boolean': _boolean,
+    'datetime': _datetime,
+    'date': datetime.date.fromisoformat,
+    'objectid': _object_id,
+}
+
+
+def coercer(rules):
+    """
+    The function converting a query string value to the type of a field,
+    given its type name or rules. It raises ValueError on invalid values.
+    """
+    if isinstance(rules, str):
+        rules = {'type': rules}
+    kinds = rules.get('type', 'string')
+    if kinds in ('list', 'set'):
+        return coercer(rules.get('schema', 'string'))
+    if isinstance(kinds, str):
+        kinds = [kinds]
+
+    try:
+        functions = [_coercers[kind] for kind in kinds]
+    except KeyError as e:
+        raise TypeError('Unsupported filter type %s' % e)
+    if len(functions) == 1:
+        return functions[0]
+
+    def coerce(value):
+        # The first of the types that value converts to
+        for function in functions:
+            try:
+                return function(value)
+            except ValueError:
+                continue
+        raise ValueError('not any of %s' % ', '.join(kinds))
+
+    return coerce
@@ -0,0 +1,74 @@
+"""
+Helpers for conditional requests (ETag, If-None-Match, Last-Modified and
+If-Modified-Since), see https://tools.ietf.org/html/rfc7232
+"""
+import datetime
+import hashlib
+
+from werkzeug.http import http_date, parse_date
+
+from flask_kit.compression import encodings
+
+
+def body_etag(body):
+    """ A strong ETag for a serialized body (str or bytes) """
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def version_etag(version):
+    """ A strong ETag for a version key provided by a view """
+    return body_etag(str(version))
+
+
+def encoded_etag(etag, encoding):
+    """ The ETag of the representation compressed with encoding """
+    return '%s-%s"' % (etag[:-1], encoding)
+
+
+def _strip_encoding(tag):
+    for encoding in encodings:
+        suffix = '-%s"' % encoding
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)] + '"'
+    return tag
+
+
+def match_etag(if_none_match, etag):
+    """
+    Returns the tag on an If-None-Match header that matches etag, or None.
+    Uses the weak comparison and ignores the encoding suffixes added by
+    `encoded_etag`.
+    """
+    for tag in (if_none_match or '').split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return etag
+        opaque = tag[2:] if tag.startswith('W/') else tag
+        if _strip_encoding(opaque) == etag:
+            return tag
+    return None
+
+
+def _as_utc(value):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc)
+
+
+def last_modified_header(last_modified):
+    """ Last-Modified header value for a datetime (naive means UTC) """
+    return http_date(_as_utc(last_modified))
+
+
+def modified_since(if_modified_since, last_modified):
+    """
+    False if last_modified (a datetime) is not later than the date on an
+    If-Modified-Since header. Invalid dates are ignored.
+    """
+    since = parse_date(if_modified_since) if if_modified_since else None
+    if since is None or last_modified is None:
+        return True
+    last_modified = _as_utc(last_modified).replace(microsecond=0)
+    return last_modified > _as_utc(since)
@@ -0,0 +1,219 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of skipping `offset` items, each page starts after (or before) the
+sort key of the last (or first) item of the page the client comes from.
+That key travels in an opaque cursor token, signed with HMAC so clients
+can't forge or alter it, and is turned into a range predicate on the sort
+fields, which databases answer from an index however deep the page.
+
+The sort must be total for pages not to skip or repeat items: a unique
+field (the tiebreaker) is appended to it when missing.
+"""
+import base64
+import hashlib
+import hmac
+import json
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from bson import json_util
+from werkzeug.datastructures import MultiDict
+
+from .simple_router import QueryError
+
+# Length of the signatures, in bytes
+signature_size = 16
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _sign(payload, secret):
+    if isinstance(secret, str):
+        secret = secret.encode('utf-8')
+    return hmac.new(secret, payload, hashlib.sha256).digest()[
+        :signature_size]
+
+
+def encode_cursor(values, direction, sorting, secret):
+    """
+    A signed token with the sort key values of an item, to continue the
+    listing after it (direction 'next') or before it ('prev'). The token is
+    only valid for the same sorting.
+    """
+    payload = json_util.dumps({
+        'v': list(values),
+        'd': direction,
+        's': _sorting_id(sorting),
+    }, separators=(',', ':')).encode('utf-8')
+    return '%s.%s' % (_b64encode(payload), _b64encode(_sign(payload, secret)))
+
+
+def decode_cursor(token, sorting, secret):
+    """
+    The (values, direction) of a token created with `encode_cursor`.
+    Raises QueryError if it was altered, or made for another sorting.
+    """
+    try:
+        payload, signature = token.split('.')
+        payload = _b64decode(payload)
+        valid = hmac.compare_digest(_b64decode(signature),
+                                    _sign(payload, secret))
+    except (ValueError, TypeError):
+        valid = False
+    if not valid:
+        raise QueryError('Invalid cursor')
+    cursor = json_util.loads(payload.decode('utf-8'))
+    if cursor['s'] != _sorting_id(sorting) or cursor['d'] not in (
+            'next', 'prev') or len(cursor['v']) != len(sorting):
+        raise QueryError('Cursor does not match the sorting')
+    return cursor['v'], cursor['d']
+
+
+def _sorting_id(sorting):
+    raw = json.dumps([[s['field'], s['direction']] for s in sorting])
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def with_tiebreaker(sorting, tiebreaker):
+    """ sorting, ending with tiebreaker (ascending) if it isn't sorted on """
+    if tiebreaker is None or any(s['field'] == tiebreaker for s in sorting):
+        return list(sorting)
+    return list(sorting) + [{'field': tiebreaker, 'direction': 'asc'}]
+
+
+def reverse_sorting(sorting):
+    """ sorting with every direction inverted """
+    return [{'field': s['field'],
+             'direction': 'desc' if s['direction'] == 'asc' else 'asc'}
+            for s in sorting]
+
+
+def keyset_filters(sorting, values, nulls_first=False):
+    """
+    The range predicate matching the items after values in sorting, as a
+    list of alternatives, each a list of filter descriptors that must all
+    hold: [[a > x], [a == x, b > y], ...]
+
+    With nulls_first, for databases sorting null (and missing) values
+    before the others and not comparing them with range operators, as
+    MongoDB does, the alternatives include the items without a value that
+    come after values.
+    """
+    clauses = []
+    for i, descriptor in enumerate(sorting):
+        field, value = descriptor['field'], values[i]
+        ascending = descriptor['direction'] == 'asc'
+        clause = [{'field': s['field'], 'op': 'eq', 'value': v}
+                  for s, v in zip(sorting[:i], values)]
+        if not nulls_first or value is not None:
+            clauses.append(clause + [{
+                'field': field,
+                'op': 'gt' if ascending else 'lt',
+                'value': value,
+            }])
+        if nulls_first and (value is None) == ascending:
+            # After a null ascending come the values, after a value
+            # descending come the nulls
+            clauses.append(clause + [{
+                'field': field,
+                'op': 'ne' if ascending else 'eq',
+                'value': None,
+            }])
+    return clauses
+
+
+class Page(object):
+    """
+    A page of items, with the cursor tokens of the next and previous pages
+    (None if there is no such page)
+    """
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def links(self, url):
+        """
+        The value of a Link header (RFC 8288) with the next and previous
+        pages of url, or None if there are none
+        """
+        links = []
+        for rel, cursor in [('next', self.next_cursor),
+                            ('prev', self.prev_cursor)]:
+            if cursor is not None:
+                links.append('<%s>; rel="%s"' % (cursor_url(url, cursor),
+                                                 rel))
+        return ', '.join(links) or None
+
+    def headers(self, url):
+        """ Response headers with the Link to the other pages """
+        links = self.links(url)
+        return {'Link': links} if links else {}
+
+    def to_dict(self):
+        """ The items with the next and previous cursors """
+        return {
+            'items': self.items,
+            'next': self.next_cursor,
+            'prev': self.prev_cursor,
+        }
+
+
+def cursor_url(url, cursor):
+    """ url with its cursor argument set to cursor and without offset """
+    parsed = urlsplit(url)
+    args = MultiDict(parse_qsl(parsed.query, keep_blank_values=True))
+    args.poplist('offset')
+    args['cursor'] = cursor
+    return parsed._replace(query=urlencode(list(args.items(multi=True))))\
+        .geturl()
+
+
+def keyset_page(fetch, key_values, sorting, limit, token, secret):
+    """
+    Fetches a page with keyset pagination.
+
+    :param fetch: function receiving the sort key values to start after
+                  (None for the first page), the sorting and the maximum
+                  number of items, that returns the items
+    :param key_values: function returning the values of the sort fields of
+                       an item
+    :param sorting: sort descriptors, ending with a unique field
+    :param limit: the page size, None for a single page
+    :param token: the cursor token of the request, or None
+    :param secret: key signing the cursors
+
+    Raises QueryError if limit is under 1, as such pages have no item to
+    continue from.
+    """
+    if limit is not None and limit < 1:
+        raise QueryError('The limit must be at least 1')
+    values, direction = None, 'next'
+    if token:
+        values, direction = decode_cursor(token, sorting, secret)
+    order = sorting if direction == 'next' else reverse_sorting(sorting)
+    items = list(fetch(values, order, None if limit is None else limit + 1))
+    more = limit is not None and len(items) > limit
+    items = items[:limit]
+    if direction == 'prev':
+        items.reverse()
+
+    # Coming from a page, there is a page in the opposite direction
+    forward = more if direction == 'next' else values is not None
+    backward = more if direction == 'prev' else values is not None
+    if items:
+        last, first = key_values(items[-1]), key_values(items[0])
+    else:
+        last = first = values
+    return Page(
+        items,
+        encode_cursor(last, 'next', sorting, secret) if forward else None,
+        encode_cursor(first, 'prev', sorting, secret) if backward else None,
+    )
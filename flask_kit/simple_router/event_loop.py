@@ -0,0 +1,107 @@
+"""
+Runs the coroutines returned by `async def` views on an asyncio event loop.
+
+The loop lives on a background thread shared by every worker thread of the
+process. Workers wait for their own coroutine, while the loop multiplexes
+the I/O of all of them, so they can share async clients and connection
+pools, and a view can fan out to several downstream calls concurrently
+with `asyncio.gather`.
+
+Coroutines see the Flask request context through context variables, which
+needs Flask >= 2.0 (on older versions the context is thread local, and
+isn't available on the loop thread).
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+
+
+class EventLoopBridge(object):
+    """ An event loop on a daemon thread, started on first use """
+
+    def __init__(self):
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ Starts the loop thread, if it is not running yet """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self.loop = asyncio.new_event_loop()
+            started = threading.Event()
+            self._thread = threading.Thread(target=self._run_loop,
+                                            args=(started,),
+                                            name='flask-kit-event-loop',
+                                            daemon=True)
+            self._thread.start()
+            started.wait()
+
+    def _run_loop(self, started):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(started.set)
+        self.loop.run_forever()
+
+    def stop(self):
+        """ Stops the loop thread, it is started again when needed """
+        with self._lock:
+            if self._thread is None:
+                return
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self.loop.close()
+            self._thread = None
+
+    def run(self, awaitable, timeout=None):
+        """
+        Runs awaitable on the loop and waits for its result. The context
+        variables of the caller, like the Flask request context on
+        Flask >= 2, are visible to the coroutine. On timeout the coroutine
+        is cancelled and `concurrent.futures.TimeoutError` is raised.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        future = concurrent.futures.Future()
+        context = contextvars.copy_context()
+        tasks = []
+        timed_out = threading.Event()
+
+        def chain(task):
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+
+        def schedule():
+            if timed_out.is_set():
+                # Timed out before being scheduled
+                if asyncio.iscoroutine(awaitable):
+                    awaitable.close()
+                return
+            task = context.run(asyncio.ensure_future, awaitable)
+            task.add_done_callback(chain)
+            tasks.append(task)
+
+        def cancel():
+            for task in tasks:
+                task.cancel()
+
+        self.loop.call_soon_threadsafe(schedule)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            timed_out.set()
+            self.loop.call_soon_threadsafe(cancel)
+            raise
+
+
+_default = EventLoopBridge()
+
+
+def default_bridge():
+    """ The bridge shared by every router that doesn't set its own """
+    return _default
@@ -0,0 +1,453 @@
+"""
+Filtering, sorting and pagination of in-memory collections (lists of dicts
+or objects) with the descriptors parsed by `Selector`.
+
+    products = MemoryCollection(load_products(), indexes=['category'])
+    page = products.select(Selector(), only=['category', 'price'])
+
+Filters are compiled once into a single generated loop, fields are read with
+dotted paths ('dimensions.width'), a sorted page is selected with a
+partial sort (heapq) instead of sorting the whole collection, and results
+are generated lazily, so only the requested page is materialized. Filters
+on indexed fields look up the matching items instead of scanning.
+
+Query string values are strings, they are converted to the type of the
+value they are compared to when it is a scalar (str, int, float, bool,
+Decimal, date or datetime); values that can't be converted, or compared to
+values of other types, don't match. Values typed by the Selector (see its
+`types`) are compared as they are.
+"""
+import datetime
+import heapq
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from itertools import islice
+from operator import itemgetter
+
+from .coercion import coercer
+from .cursor import keyset_page, with_tiebreaker
+from .simple_router import negated_filter
+
+_missing = object()
+
+# The types query string values are converted to, other types of field
+# values (e.g. lists, or classes with their own constructors) never get them
+_converters = {
+    str: str,
+    int: int,
+    float: float,
+    bool: coercer('boolean'),
+    Decimal: Decimal,
+    datetime.datetime: coercer('datetime'),
+    datetime.date: coercer('date'),
+}
+
+
+def field_getter(path):
+    """
+    A function returning the value at a dotted path of a dict or object,
+    or None if missing
+    """
+    parts = path.split('.')
+    if len(parts) == 1:
+        return lambda item: (item.get(path) if isinstance(item, dict)
+                             else getattr(item, path, None))
+
+    def get(item):
+        for part in parts:
+            if isinstance(item, dict):
+                item = item.get(part)
+            else:
+                item = getattr(item, part, None)
+            if item is None:
+                return None
+        return item
+
+    return get
+
+
+def _convert(value, kind):
+    """
+    value converted to kind, or _missing. Only strings are converted, to
+    the types of `_converters`, other values (typed by the Selector) are
+    compared as they are.
+    """
+    if isinstance(value, kind) or not isinstance(value, str):
+        return value
+    convert = _converters.get(kind)
+    if convert is None:
+        return _missing
+    try:
+        return convert(value)
+    except (ValueError, InvalidOperation):
+        return _missing
+
+
+def _converter(cache, value):
+    """
+    A function converting value to a type, storing the conversion in cache.
+    Lists of values are converted to sets.
+    """
+    def convert(kind):
+        if not isinstance(value, list):
+            converted = _convert(value, kind)
+        else:
+            converted = [_convert(v, kind) for v in value]
+            converted = [c for c in converted if c is not _missing]
+            try:
+                converted = frozenset(converted)
+            except TypeError:
+                pass
+        cache[kind] = converted
+        return converted
+
+    return convert
+
+
+# Source of the test of each operator on the field value f, setting m to
+# whether it matches v, the query value converted to the type of f
+_tests = {
+    'eq': ('m = False', ['m = v == f']),
+    'ne': ('m = True', ['m = v != f']),
+    'in': ('m = False', [
+        'try:',
+        '    m = f in v',
+        'except TypeError:',
+        '    pass',
+    ]),
+    'nin': ('m = True', [
+        'try:',
+        '    m = f not in v',
+        'except TypeError:',
+        '    pass',
+    ]),
+}
+for _op, _operator in [('lt', '<'), ('le', '<='), ('gt', '>'), ('ge', '>=')]:
+    _tests[_op] = ('m = False', [
+        'if v is not _missing:',
+        '    try:',
+        '        m = f %s v' % _operator,
+        '    except TypeError:',
+        '        pass',
+    ])
+
+
+def compile_filters(filters):
+    """
+    A function generating the items of an iterable that pass every filter
+    descriptor, or None if there are no filters.
+
+    The function is generated with every filter tested inline in its loop.
+    Only variable names are written in its source, the fields and values
+    are bound in its namespace, so queries with the same operators share
+    the compiled code.
+    """
+    if not filters:
+        return None
+    namespace = {'_missing': _missing}
+    lines = [
+        'def matching(items):',
+        '    for item in items:',
+    ]
+    for i, descriptor in enumerate(filters):
+        op, value, negate = descriptor['op'], descriptor['value'], False
+        if op == 'not':
+            (op, value), negate = negated_filter(value), True
+        field = descriptor['field']
+        cache = {}
+        namespace.update({
+            'k%d' % i: field,
+            'g%d' % i: field_getter(field),
+            'c%d' % i: cache,
+            'x%d' % i: _converter(cache, value),
+        })
+        if '.' in field:
+            lines.append('        f = g%d(item)' % i)
+        else:
+            lines.append('        f = (item.get(k%d) if item.__class__ is dict'
+                         ' else g%d(item))' % (i, i))
+        default, test = _tests[op]
+        lines.extend([
+            '        ' + default,
+            '        if f is not None:',
+            '            try:',
+            '                v = c%d[f.__class__]' % i,
+            '            except KeyError:',
+            '                v = x%d(f.__class__)' % i,
+        ])
+        lines.extend('            ' + line for line in test)
+        lines.append('        if %s:' % ('m' if negate else 'not m'))
+        lines.append('            continue')
+    lines.append('        yield item')
+    exec(_compile('\n'.join(lines)), namespace)
+    return namespace['matching']
+
+
+@lru_cache(maxsize=256)
+def _compile(source):
+    """ Code of the filters, shared by the queries with the same shape """
+    return compile(source, '<flask_kit filters>', 'exec')
+
+
+class _Descending(object):
+    """ Sort key wrapper inverting the order of its value """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def compile_sort(sorting):
+    """
+    A sort key function for a list of sort descriptors, or None if there
+    are none. Missing values go after the others (before, if descending).
+    """
+    keys = []
+    for descriptor in sorting:
+        get = field_getter(descriptor['field'])
+        if descriptor['direction'] == 'asc':
+            keys.append(lambda item, get=get: _sort_value(get(item)))
+        else:
+            keys.append(lambda item, get=get: _Descending(
+                _sort_value(get(item))))
+
+    if not keys:
+        return None
+    if len(keys) == 1:
+        return keys[0]
+    return lambda item: tuple(key(item) for key in keys)
+
+
+def _sort_value(value):
+    return (1, 0) if value is None else (0, value)
+
+
+def _key_bound(sorting, values):
+    """ The sort key (as returned by `compile_sort`) of a list of values """
+    return tuple(_sort_value(value) if s['direction'] == 'asc'
+                 else _Descending(_sort_value(value))
+                 for s, value in zip(sorting, values))
+
+
+def paginate(items, key=None, limit=None, offset=None):
+    """
+    Sorts (with key) and slices items lazily. With a limit, only the
+    first offset + limit items are sorted, using a heap.
+    """
+    start = offset or 0
+    if key is not None:
+        if limit is not None:
+            items = heapq.nsmallest(start + limit, items, key=key)
+        else:
+            items = sorted(items, key=key)
+    stop = None if limit is None else start + limit
+    return islice(items, start, stop)
+
+
+def _sort_by_field(items, descriptor, limit=None, offset=None):
+    """
+    As `paginate` for a single sort descriptor, comparing the field values
+    directly instead of through a key wrapper
+    """
+    get = field_getter(descriptor['field'])
+    descending = descriptor['direction'] == 'desc'
+    keyed = [(get(item), item) for item in items]
+    present = [pair for pair in keyed if pair[0] is not None]
+    missing = [pair for pair in keyed if pair[0] is None]
+    first = itemgetter(0)
+
+    start = offset or 0
+    if limit is not None:
+        select = heapq.nlargest if descending else heapq.nsmallest
+        present = select(start + limit, present, key=first)
+    else:
+        present.sort(key=first, reverse=descending)
+    ordered = missing + present if descending else present + missing
+    stop = None if limit is None else start + limit
+    return map(itemgetter(1), islice(ordered, start, stop))
+
+
+def after_key(items, sorting, values=None, limit=None):
+    """
+    The first limit items of items in sorting (a list), after the item with
+    the sort field values (from the start if None).
+
+    The candidates are narrowed comparing the values of the first sort
+    field directly, before comparing the whole sort keys of the remaining
+    ones.
+    """
+    fields = [field_getter(s['field']) for s in sorting]
+
+    def key(item):
+        return _key_bound(sorting, [get(item) for get in fields])
+
+    first, descending = fields[0], sorting[0]['direction'] == 'desc'
+    keyed = [(first(item), item) for item in items]
+    present = [pair for pair in keyed if pair[0] is not None]
+    missing = [pair for pair in keyed if pair[0] is None]
+
+    if values is not None:
+        # Missing values go after the others ascending, before descending
+        start, bound = values[0], _key_bound(sorting, values)
+        if start is None:
+            present = present if descending else []
+        elif descending:
+            present = [pair for pair in present if pair[0] <= start]
+            missing = []
+        else:
+            present = [pair for pair in present if pair[0] >= start]
+        # Only the items with the same first value need the whole key
+        present = [pair for pair in present
+                   if pair[0] != start or bound < key(pair[1])]
+        missing = [pair for pair in missing if bound < key(pair[1])]
+
+    if limit is not None:
+        if len(missing if descending else present) >= limit:
+            present, missing = (([], missing) if descending
+                                else (present, []))
+        if len(present) > limit:
+            # The page is within the limit first values
+            select = heapq.nlargest if descending else heapq.nsmallest
+            last = select(limit, [value for value, _ in present])[-1]
+            present = [pair for pair in present if (
+                pair[0] >= last if descending else pair[0] <= last)]
+
+    candidates = [item for _, item in present + missing]
+    return paginate(candidates, key, limit)
+
+
+def query(items, filters=(), sorting=(), limit=None, offset=None):
+    """
+    A generator of the items matching filters, sorted by sorting, and
+    paginated with limit and offset
+    """
+    matching = compile_filters(filters)
+    if matching is not None:
+        items = matching(items)
+    if len(sorting) == 1:
+        return _sort_by_field(items, sorting[0], limit, offset)
+    return paginate(items, compile_sort(sorting), limit, offset)
+
+
+class MemoryCollection(object):
+    """
+    A list of items (dicts or objects) to query with Selector descriptors,
+    with optional hash indexes on some fields, used by eq and in filters.
+    The items must not be changed after the collection is created.
+
+    :param items: the items, an iterable
+    :param indexes: dotted paths of the fields to index
+    """
+
+    def __init__(self, items, indexes=()):
+        self.items = list(items)
+        self.indexes = {}
+        for path in indexes:
+            get = field_getter(path)
+            index = {}
+            for position, item in enumerate(self.items):
+                value = get(item)
+                if value is None:
+                    continue
+                # Keyed by type too, as True == 1 and 1 == 1.0
+                try:
+                    index.setdefault((value.__class__, value),
+                                     []).append(position)
+                except TypeError:
+                    # Unhashable values can't be looked up
+                    continue
+            self.indexes[path] = index, {kind for kind, _ in index}
+
+    def __len__(self):
+        return len(self.items)
+
+    def _lookup(self, path, values):
+        """ Positions of the items whose indexed field is in values """
+        index, kinds = self.indexes[path]
+        positions = set()
+        for value in values:
+            for kind in kinds:
+                converted = _convert(value, kind)
+                if converted is not _missing:
+                    positions.update(index.get((kind, converted), ()))
+        return positions
+
+    def candidates(self, filters):
+        """
+        The items that may match filters, narrowed with the indexes, and
+        the filters left to check on them
+        """
+        positions = None
+        remaining = []
+        for descriptor in filters:
+            if (descriptor['field'] in self.indexes and
+                    descriptor['op'] in ('eq', 'in')):
+                values = descriptor['value']
+                if descriptor['op'] == 'eq':
+                    values = [values]
+                found = self._lookup(descriptor['field'], values)
+                positions = found if positions is None else positions & found
+            else:
+                remaining.append(descriptor)
+        if positions is None:
+            return self.items, remaining
+        return [self.items[p] for p in sorted(positions)], remaining
+
+    def query(self, filters=(), sorting=(), limit=None, offset=None):
+        """ As `query`, using the indexes """
+        items, remaining = self.candidates(filters)
+        return query(items, remaining, sorting, limit, offset)
+
+    def select(self, selector, only=None, mapping=None, sort_only=None,
+               types=None):
+        """
+        The page of items requested, a list, for the filters, sorting,
+        limit and offset parsed by selector
+
+        :param only: query string keys that may be filtered on
+        :param mapping: maps query string keys to item fields
+        :param sort_only: keys that may be sorted on, defaults to only
+        :param types: types of the filtered keys, see `Selector.filter`
+        """
+        return list(self.query(
+            selector.filter(only=only, mapping=mapping, types=types),
+            selector.sort(only=only if sort_only is None else sort_only,
+                          mapping=mapping),
+            selector.limit(),
+            selector.offset(),
+        ))
+
+    def page(self, selector, only=None, mapping=None, sort_only=None,
+             tiebreaker='id', types=None):
+        """
+        As `select`, with keyset pagination: returns a `Page` starting
+        after the sort key of the cursor of the request, ignoring offset.
+
+        :param tiebreaker: unique field ending the sorting
+        """
+        sorting = with_tiebreaker(selector.sort(
+            only=only if sort_only is None else sort_only, mapping=mapping),
+            tiebreaker)
+        items, remaining = self.candidates(
+            selector.filter(only=only, mapping=mapping, types=types))
+        matching = compile_filters(remaining)
+        getters = [field_getter(s['field']) for s in sorting]
+
+        def fetch(values, order, count):
+            selected = items if matching is None else matching(items)
+            return after_key(selected, order, values, count)
+
+        return keyset_page(
+            fetch,
+            lambda item: [get(item) for get in getters],
+            sorting,
+            selector.limit(),
+            selector.cursor(),
+            selector.cursor_secret(),
+        )
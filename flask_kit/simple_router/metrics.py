@@ -0,0 +1,189 @@
+"""
+Latency histograms for each phase of the requests handled by a `Router`.
+
+Phases are recorded with `mark` as the request goes through the router:
+parse (reading the body), validate, view, serialize and compress, plus the
+total time. Every thread aggregates in its own histograms, so recording
+takes no lock; they are merged when read, and folded into a shared total
+when their thread ends. Only a sample of the requests is
+timed, see `sample_rate`.
+"""
+import contextvars
+import random
+import threading
+import weakref
+from bisect import bisect_left
+from time import perf_counter
+
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+prometheus_mime = 'text/plain; version=0.0.4; charset=utf-8'
+
+_current = contextvars.ContextVar('flask_kit_request_timer', default=None)
+
+
+class _Shard(object):
+    """ The histograms of one thread, kept in a thread local """
+    __slots__ = ('histograms', '__weakref__')
+
+    def __init__(self):
+        self.histograms = {}
+
+
+def _merge(target, histograms):
+    for key, (counts, total) in histograms.items():
+        if key not in target:
+            target[key] = [[0] * len(counts), 0.0]
+        target[key][0] = [a + b for a, b in zip(target[key][0], counts)]
+        target[key][1] += total
+
+
+class _Timer(object):
+    __slots__ = ('endpoint', 'started', 'last', 'phases', 'token')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = self.last = perf_counter()
+        self.phases = []
+        self.token = None
+
+
+def mark(phase):
+    """
+    Ends phase for the request being timed: the time since the previous
+    mark (or since the request started) is recorded for it
+    """
+    timer = _current.get()
+    if timer is not None:
+        now = perf_counter()
+        timer.phases.append((phase, now - timer.last))
+        timer.last = now
+
+
+class RouteMetrics(object):
+    """
+    Per endpoint and phase latency histograms.
+
+    :param sample_rate: fraction of the requests that are timed
+    :param buckets: upper bounds of the histogram buckets, in seconds
+    """
+
+    def __init__(self, sample_rate=1.0, buckets=default_buckets):
+        self.sample_rate = sample_rate
+        self.buckets = tuple(sorted(buckets))
+        # Histograms of the live threads by id, and the merged histograms
+        # of the threads that ended
+        self._shards = {}
+        self._retired = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self, endpoint):
+        """ Starts timing a request, or returns None if it isn't sampled """
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None
+        timer = _Timer(endpoint)
+        timer.token = _current.set(timer)
+        return timer
+
+    def finish(self, timer):
+        """ Records the phases and total time of a timed request """
+        _current.reset(timer.token)
+        total = perf_counter() - timer.started
+        for phase, seconds in timer.phases:
+            self.observe(timer.endpoint, phase, seconds)
+        self.observe(timer.endpoint, 'total', total)
+
+    def observe(self, endpoint, phase, seconds):
+        """ Adds a measurement to the histogram of endpoint and phase """
+        shard = self._shard()
+        histogram = shard.get((endpoint, phase))
+        if histogram is None:
+            histogram = shard[(endpoint, phase)] = [
+                [0] * (len(self.buckets) + 1), 0.0]
+        histogram[0][bisect_left(self.buckets, seconds)] += 1
+        histogram[1] += seconds
+
+    def _shard(self):
+        try:
+            return self._local.shard.histograms
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            histograms = shard.histograms
+            with self._lock:
+                self._shards[id(histograms)] = histograms
+            # The thread local drops the shard when its thread (or
+            # greenlet) ends
+            weakref.finalize(shard, self._retire, histograms)
+            return histograms
+
+    def _retire(self, histograms):
+        with self._lock:
+            self._shards.pop(id(histograms), None)
+            _merge(self._retired, histograms)
+
+    def snapshot(self):
+        """
+        The merged histograms, as
+        {endpoint: {phase: {'count': n, 'sum': s, 'buckets': [(le, n)]}}}
+        with cumulative bucket counts, the last one having le=inf
+        """
+        merged = {}
+        with self._lock:
+            shards = [dict(shard) for shard in self._shards.values()]
+            _merge(merged, self._retired)
+        for shard in shards:
+            _merge(merged, shard)
+
+        result = {}
+        bounds = self.buckets + (float('inf'),)
+        for (endpoint, phase), (counts, total) in sorted(merged.items()):
+            cumulative = []
+            running = 0
+            for bound, count in zip(bounds, counts):
+                running += count
+                cumulative.append((bound, running))
+            result.setdefault(endpoint, {})[phase] = {
+                'count': running,
+                'sum': total,
+                'buckets': cumulative,
+            }
+        return result
+
+    def reset(self):
+        """ Drops every measurement """
+        with self._lock:
+            for shard in self._shards.values():
+                shard.clear()
+            self._retired.clear()
+
+    def prometheus(self, name='flask_kit_request_phase_seconds'):
+        """ The histograms in the Prometheus text exposition format """
+        lines = [
+            '# HELP %s Time spent on each phase of the sampled requests'
+            % name,
+            '# TYPE %s histogram' % name,
+        ]
+        for endpoint, phases in self.snapshot().items():
+            for phase, histogram in phases.items():
+                labels = 'endpoint="%s",phase="%s"' % (
+                    _escape(endpoint), _escape(phase))
+                for bound, count in histogram['buckets']:
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (
+                        name, labels, le, count))
+                lines.append('%s_sum{%s} %r' % (name, labels,
+                                                histogram['sum']))
+                lines.append('%s_count{%s} %d' % (name, labels,
+                                                  histogram['count']))
+        lines.append('# HELP %s_sample_rate Fraction of the requests timed'
+                     % name)
+        lines.append('# TYPE %s_sample_rate gauge' % name)
+        lines.append('%s_sample_rate %r' % (name, float(self.sample_rate)))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n',
+                                                                   '\\n')
@@ -0,0 +1,273 @@
+"""
+Translation of the filters, sorting and pagination parsed by `Selector` to
+MongoDB queries, so they run on the server (and its indexes) instead of on
+documents loaded in Python.
+
+    /products?category=in:tvs,audio&price=gt:10&sort=price:asc&limit=20
+
+    query = MongoQuery(Selector(), only=['category', 'price'])
+    collection.find(**query.find_args())    # pymongo
+    query.apply(Product.objects)            # mongoengine
+
+Values are compared as given; the query string values are strings unless
+the fields coerce them, as mongoengine fields do, or they are typed by the
+Selector, so they match the stored values and their indexes:
+
+    MongoQuery(Selector(), types={'price': 'float', 'created': 'datetime'})
+
+The fields selected with the `fields` argument are fetched alone, with a
+projection (pymongo) or `only` (mongoengine).
+
+Field names with a '$' (MongoDB operators) or a '__' (mongoengine operators
+and raw queries) are refused with a QueryError, whitelisted with `only` or
+not, so query strings can't inject operators.
+"""
+import operator
+from functools import reduce
+
+import pymongo
+from mongoengine.queryset.base import BaseQuerySet
+from mongoengine.queryset.visitor import Q
+
+from .cursor import keyset_filters, keyset_page, with_tiebreaker
+from .memory import field_getter
+from .simple_router import QueryError, negated_filter
+
+_operators = {
+    'eq': '$eq',
+    'in': '$in',
+    'nin': '$nin',
+    'lt': '$lt',
+    'le': '$lte',
+    'gt': '$gt',
+    'ge': '$gte',
+    'ne': '$ne',
+}
+
+_mongoengine_operators = {
+    'eq': None,
+    'in': 'in',
+    'nin': 'nin',
+    'lt': 'lt',
+    'le': 'lte',
+    'gt': 'gt',
+    'ge': 'gte',
+    'ne': 'ne',
+}
+
+
+def check_field(path):
+    """
+    Returns the dotted path of a field, raising QueryError if it holds
+    MongoDB or mongoengine operators
+    """
+    if '$' in path or '__' in path:
+        raise QueryError('Invalid field %s' % path)
+    return path
+
+
+def mongo_filter(filters):
+    """ A pymongo query document for a list of filter descriptors """
+    conditions = []
+    fields = {}
+    for descriptor in filters:
+        field, op, value = (check_field(descriptor['field']), descriptor['op'],
+                            descriptor['value'])
+        if op == 'not':
+            inner, value = negated_filter(value)
+            condition = {'$not': {_operators[inner]: value}}
+        else:
+            condition = {_operators[op]: value}
+
+        operators = fields.setdefault(field, {})
+        if set(condition) & set(operators):
+            # The same operator twice on a field, both must hold
+            conditions.append({field: condition})
+        else:
+            operators.update(condition)
+
+    query = {field: operators for field, operators in fields.items()}
+    if conditions:
+        query = {'$and': [query] + conditions}
+    return query
+
+
+def mongo_sort(sorting):
+    """ A pymongo sort specification for a list of sort descriptors """
+    return [(check_field(s['field']), pymongo.ASCENDING
+             if s['direction'] == 'asc' else pymongo.DESCENDING)
+            for s in sorting]
+
+
+def covering_fields(fields):
+    """
+    The fields (dotted paths) without the ones inside another one, which
+    MongoDB rejects in projections, in their order
+    """
+    selected = set(fields)
+    covering = []
+    for path in fields:
+        parts = path.split('.')
+        if path in covering or any('.'.join(parts[:i]) in selected
+                                   for i in range(1, len(parts))):
+            continue
+        covering.append(path)
+    return covering
+
+
+def mongo_projection(fields):
+    """ A pymongo projection of fields, None for whole documents """
+    if not fields:
+        return None
+    return {check_field(path): 1 for path in covering_fields(fields)}
+
+
+def mongoengine_q(filters):
+    """ A mongoengine Q object for a list of filter descriptors """
+    query = Q()
+    for descriptor in filters:
+        path = check_field(descriptor['field']).replace('.', '__')
+        op, value = descriptor['op'], descriptor['value']
+        if op == 'not':
+            op, value = negated_filter(value)
+            # Negated equality has its own operator, the others take 'not'
+            if op == 'eq':
+                op = 'ne'
+            else:
+                path += '__not'
+        if _mongoengine_operators.get(op):
+            path = '%s__%s' % (path, _mongoengine_operators[op])
+        query &= Q(**{path: value})
+    return query
+
+
+def mongoengine_order(sorting):
+    """ The arguments of `QuerySet.order_by` for a list of sort descriptors """
+    return ['%s%s' % ('+' if s['direction'] == 'asc' else '-',
+                      check_field(s['field']).replace('.', '__'))
+            for s in sorting]
+
+
+class MongoQuery(object):
+    """
+    The filters, sorting, limit and offset of a request, as parsed by a
+    `Selector`, for pymongo and mongoengine.
+
+    :param selector: the `Selector` of the request
+    :param only: query string keys that may be filtered on
+    :param mapping: maps query string keys to document fields
+    :param sort_only: keys that may be sorted on, defaults to only
+    :param types: types of the filtered keys, see `Selector.filter`
+    :param fields_only: fields that may be selected with `fields`, any
+                        by default
+    """
+
+    def __init__(self, selector, only=None, mapping=None, sort_only=None,
+                 types=None, fields_only=None):
+        self.selector = selector
+        self.filters = selector.filter(only=only, mapping=mapping,
+                                       types=types)
+        self.sorting = selector.sort(
+            only=only if sort_only is None else sort_only, mapping=mapping)
+        self.limit = selector.limit()
+        self.offset = selector.offset()
+        self.fields = selector.fields(only=fields_only, mapping=mapping)
+        for path in self.fields or ():
+            check_field(path)
+
+    def query(self):
+        """ The pymongo query document """
+        return mongo_filter(self.filters)
+
+    def sort(self):
+        """ The pymongo sort specification, or None if not sorted """
+        return mongo_sort(self.sorting) or None
+
+    def projection(self):
+        """ The pymongo projection, or None for whole documents """
+        return mongo_projection(self.fields)
+
+    def find_args(self):
+        """ Keyword arguments for `Collection.find` """
+        query = self.query()
+        if self.limit == 0:
+            # A zero limit means no limit to pymongo, match nothing instead
+            query = {'$and': [query, {'_id': {'$in': []}}]}
+        args = {'filter': query}
+        if self.sorting:
+            args['sort'] = self.sort()
+        if self.offset:
+            args['skip'] = self.offset
+        if self.limit:
+            args['limit'] = self.limit
+        if self.fields:
+            args['projection'] = self.projection()
+        return args
+
+    def q(self):
+        """ The mongoengine Q object of the filters """
+        return mongoengine_q(self.filters)
+
+    def apply(self, queryset):
+        """ Filters, sorts and paginates a mongoengine QuerySet """
+        queryset = queryset.filter(self.q())
+        if self.fields:
+            queryset = queryset.only(*covering_fields(self.fields))
+        if self.sorting:
+            queryset = queryset.order_by(*mongoengine_order(self.sorting))
+        if self.offset:
+            queryset = queryset.skip(self.offset)
+        if self.limit == 0:
+            return queryset.none()
+        if self.limit is not None:
+            queryset = queryset.limit(self.limit)
+        return queryset
+
+    def page(self, target, tiebreaker=None):
+        """
+        A `Page` of a pymongo Collection or a mongoengine QuerySet, with
+        keyset pagination (the offset is ignored): each page starts after
+        the sort key of the last item of the previous one, given by the
+        cursor of the request. Items with null or missing sort values are
+        paged too, where MongoDB sorts them (first ascending).
+
+        :param tiebreaker: unique field ending the sorting, defaults to
+                           '_id' for collections and 'id' for querysets
+        """
+        is_queryset = isinstance(target, BaseQuerySet)
+        if tiebreaker is None:
+            tiebreaker = 'id' if is_queryset else '_id'
+        sorting = with_tiebreaker(self.sorting, tiebreaker)
+        getters = [field_getter(s['field']) for s in sorting]
+        # The cursors are made of the sort fields
+        fields = self.fields and covering_fields(
+            self.fields + [s['field'] for s in sorting])
+
+        def fetch(values, order, count):
+            if is_queryset:
+                queryset = target.filter(self.q())
+                if fields:
+                    queryset = queryset.only(*fields)
+                if values is not None:
+                    queryset = queryset.filter(reduce(operator.or_, [
+                        mongoengine_q(clause)
+                        for clause in keyset_filters(order, values, True)]))
+                queryset = queryset.order_by(*mongoengine_order(order))
+                return queryset.limit(count) if count else queryset
+
+            query = self.query()
+            if values is not None:
+                query = {'$and': [query, {'$or': [
+                    mongo_filter(clause)
+                    for clause in keyset_filters(order, values, True)]}]}
+            return target.find(query, mongo_projection(fields),
+                               sort=mongo_sort(order), limit=count or 0)
+
+        return keyset_page(
+            fetch,
+            lambda item: [get(item) for get in getters],
+            sorting,
+            self.limit,
+            self.selector.cursor(),
+            self.selector.cursor_secret(),
+        )
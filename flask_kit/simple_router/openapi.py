@@ -0,0 +1,190 @@
+"""
+OpenAPI 3 description of the routes documented by a `Router`, with the
+request bodies described by JSON schemas converted from their Cerberus
+validation schemas.
+"""
+import json
+import re
+
+openapi_version = '3.0.3'
+
+_rule_argument = re.compile(r'<(?:(\w+)(?:\([^)]*\))?:)?(\w+)>')
+
+_converters = {
+    'int': {'type': 'integer'},
+    'float': {'type': 'number'},
+    'uuid': {'type': 'string', 'format': 'uuid'},
+}
+
+_types = {
+    'string': {'type': 'string'},
+    'integer': {'type': 'integer'},
+    'float': {'type': 'number'},
+    'number': {'type': 'number'},
+    'boolean': {'type': 'boolean'},
+    'dict': {'type': 'object'},
+    'list': {'type': 'array'},
+    'set': {'type': 'array', 'uniqueItems': True},
+    'datetime': {'type': 'string', 'format': 'date-time'},
+    'date': {'type': 'string', 'format': 'date'},
+    'binary': {'type': 'string', 'format': 'binary'},
+}
+
+_combinators = [('anyof', 'anyOf'), ('oneof', 'oneOf'), ('allof', 'allOf')]
+
+# Cerberus rules with a JSON schema counterpart, for strings and arrays
+_length_rules = {
+    'string': {'minlength': 'minLength', 'maxlength': 'maxLength'},
+    'array': {'minlength': 'minItems', 'maxlength': 'maxItems'},
+}
+
+
+def openapi_path(rule):
+    """
+    Converts a Flask rule to an OpenAPI path, returning it with the schemas
+    of its arguments, e.g. '/items/<int:id>' to '/items/{id}'
+    """
+    arguments = []
+
+    def replace(match):
+        converter, name = match.groups()
+        arguments.append((name, dict(_converters.get(converter,
+                                                     {'type': 'string'}))))
+        return '{%s}' % name
+
+    return _rule_argument.sub(replace, rule), arguments
+
+
+def json_schema(cerberus_schema):
+    """ JSON schema of the documents valid for a Cerberus schema """
+    return _object_schema(cerberus_schema)
+
+
+def _object_schema(fields):
+    properties = {}
+    required = []
+    for name, rules in fields.items():
+        properties[name] = _field_schema(rules)
+        if rules.get('required'):
+            required.append(name)
+    schema = {
+        'type': 'object',
+        'properties': properties,
+        'additionalProperties': False,
+    }
+    if required:
+        schema['required'] = required
+    return schema
+
+
+def _field_schema(rules):
+    for rule, keyword in _combinators:
+        if isinstance(rules.get(rule), (list, tuple)):
+            base = {key: value for key, value in rules.items() if key != rule}
+            return {keyword: [_field_schema({**base, **extra})
+                              for extra in rules[rule]]}
+
+    types = rules.get('type')
+    if isinstance(types, (list, tuple)):
+        schema = {'anyOf': [_typed_schema(rules, kind) for kind in types]}
+    else:
+        schema = _typed_schema(rules, types)
+    if rules.get('nullable'):
+        schema['nullable'] = True
+    if 'default' in rules and not callable(rules['default']):
+        schema['default'] = rules['default']
+    meta = rules.get('meta')
+    if isinstance(meta, dict) and meta.get('description'):
+        schema['description'] = meta['description']
+    return schema
+
+
+def _typed_schema(rules, kind):
+    schema = dict(_types.get(kind, {}))
+    json_type = schema.get('type')
+
+    nested = rules.get('schema')
+    if isinstance(nested, dict):
+        if json_type == 'object':
+            schema.update(_object_schema(nested))
+        elif json_type == 'array':
+            schema['items'] = _field_schema(nested)
+    values = rules.get('valuesrules', rules.get('valueschema'))
+    if json_type == 'object' and isinstance(values, dict):
+        schema['additionalProperties'] = _field_schema(values)
+
+    if 'allowed' in rules:
+        if json_type == 'array':
+            schema['items'] = {**schema.get('items', {}),
+                               'enum': list(rules['allowed'])}
+        else:
+            schema['enum'] = list(rules['allowed'])
+    if 'min' in rules:
+        schema['minimum'] = rules['min']
+    if 'max' in rules:
+        schema['maximum'] = rules['max']
+    for rule, keyword in _length_rules.get(json_type, {}).items():
+        if rule in rules:
+            schema[keyword] = rules[rule]
+    if json_type == 'string':
+        if 'regex' in rules:
+            schema['pattern'] = '^(?:%s)$' % rules['regex']
+        if rules.get('empty') is False and not schema.get('minLength'):
+            schema['minLength'] = 1
+    return schema
+
+
+def openapi_spec(routes, title='API', version='1.0.0', servers=None):
+    """
+    The OpenAPI document of routes, as documented by `Router` (a dict of
+    rules, to methods, to their description, name and Cerberus schema)
+    """
+    paths = {}
+    for rule, methods in sorted(routes.items()):
+        path, arguments = openapi_path(rule)
+        item = paths.setdefault(path, {})
+        for method, route in sorted(methods.items()):
+            item[method.lower()] = _operation(route, arguments)
+
+    spec = {
+        'openapi': openapi_version,
+        'info': {'title': title, 'version': version},
+        'paths': paths,
+    }
+    if servers:
+        spec['servers'] = [{'url': url} for url in servers]
+    return spec
+
+
+def _operation(route, arguments):
+    operation = {
+        'operationId': route['name'],
+        'responses': {'200': {'description': 'Success'}},
+    }
+    description = route.get('description')
+    if description:
+        operation['summary'] = description.splitlines()[0].strip()
+        operation['description'] = description
+    if arguments:
+        operation['parameters'] = [
+            {'name': name, 'in': 'path', 'required': True, 'schema': schema}
+            for name, schema in arguments
+        ]
+    schema = route.get('parameters')
+    if schema:
+        body = json_schema(schema)
+        # Router validates the JSON body whatever the method, GETs included.
+        # Missing bodies are validated as empty documents.
+        operation['requestBody'] = {
+            'required': 'required' in body,
+            'content': {'application/json': {'schema': body}},
+        }
+        operation['responses']['400'] = {'description': 'Invalid body'}
+    return operation
+
+
+def write_openapi(spec, path):
+    """ Writes an OpenAPI document to a JSON file """
+    with open(path, 'w') as f:
+        json.dump(spec, f, indent=2, sort_keys=True, default=str)
+        f.write('\n')
@@ -3,12 +3,57 @@ https://specs.openstack.org/openstack/api-wg/guidelines/pagination_filter_sort.h
 http://json-schema.org/latest/json-schema-hypermedia.html#rfc.section.9
 http://werkzeug.pocoo.org/docs/0.14/datastructures/#werkzeug.datastructures.MultiDict.getlist
 """
-from functools import wraps
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial, wraps
+from inspect import isawaitable
+from urllib.parse import parse_qsl
 
 from cerberus import Validator
+from flask import (
+    Response,
+    current_app,
+    has_app_context,
+    has_request_context,
+    stream_with_context,
+)
 from flask import request as flask_request
+from werkzeug.datastructures import MultiDict
 
-from flask_kit.json_formatter import make_response
+from flask_kit import compression
+from flask_kit.json_formatter import (
+    add_vary,
+    compile_response,
+    is_stream,
+    make_response,
+    make_stream_response,
+    resolve_json_backend,
+    response_format,
+    stream_format,
+)
+from .batch import BatchError, batch_environ_key, parse_operations, run_batch
+from .body import BodyError, parse_json_body
+from .cache import (
+    ResponseCache,
+    cache_key,
+    cache_options,
+    response_status,
+    tags_for,
+)
+from .coalescing import SingleFlight, coalesce_options
+from .coercion import coercer
+from .conditional import (
+    body_etag,
+    encoded_etag,
+    last_modified_header,
+    match_etag,
+    modified_since,
+    version_etag,
+)
+from .event_loop import default_bridge
+from .metrics import RouteMetrics, mark, prometheus_mime
+from .openapi import openapi_spec, write_openapi
+from .validation import ValidatorPool, compile_schema
 
 
 class Router(object):
@@ -16,8 +61,39 @@ class Router(object):
     Simple router wrapper to the API endpoints. Does a few things:
         - Adds a normalized 'data' argument to the route with the
              request input
-        - Facilitates input validation with cerberus
-        - Document the API at the root endpoint
+        - Facilitates input validation with cerberus, compiling the schemas
+             into plain Python checks when possible
+        - Refuses request bodies over a size limit before reading them, and
+             JSON bodies too deep or with too many keys (`max_body_size`,
+             `max_json_depth`, `max_json_keys`)
+        - Document the API at the root endpoint (with an ETag, the body is
+             only rebuilt when routes are added), and as an OpenAPI 3
+             document with `openapi` or `write_openapi`
+        - Serializes responses as JSON, or as MessagePack or CBOR when
+             preferred by the Accept header
+        - Streams views that return generators or iterators as a JSON array
+             or as newline delimited JSON (NDJSON), depending on the Accept
+             header or on the route `stream` option
+        - Compresses responses with gzip, deflate or brotli, as negotiated
+             with the Accept-Encoding header, when enabled on the router or
+             on routes (`compress`, off by default as proxies often do it)
+        - Answers conditional GETs (If-None-Match, If-Modified-Since) with
+             304 Not Modified on routes with `etag` or `last_modified`
+        - Caches serialized responses of GET routes, dropping them by tag
+             when write routes succeed
+        - Coalesces identical concurrent GETs, running the view only once
+             (`coalesce`)
+        - Runs several operations in a single request on an optional batch
+             route (`batch_route`), GETs concurrently on a thread pool
+        - Caps page sizes to `max_page` (`Selector`), and turns the
+             `QueryError` raised by views into a 400
+        - Projects the responses on the fields requested with the `fields`
+             argument (`fields`), without encoding the others
+        - Records latency histograms of each phase of the requests (parse,
+             validate, view, serialize, compress), available from
+             `metrics` and optionally on a Prometheus route
+        - Accepts `async def` views, run on an event loop shared by all the
+             worker threads (see `event_loop.EventLoopBridge`)
 
     Example:
         router = Router(blueprint)
@@ -62,7 +138,29 @@ class Router(object):
                  document_routes=True,
                  request=flask_request,
                  data_key='data',
-                 as_json=True):
+                 as_json=True,
+                 stream_flush_size=16384,
+                 compress=False,
+                 compress_min_size=500,
+                 compress_level=6,
+                 compile_schemas=True,
+                 event_loop=None,
+                 async_timeout=None,
+                 max_body_size=None,
+                 max_json_depth=None,
+                 max_json_keys=None,
+                 json_decoder=None,
+                 cache_backend=None,
+                 coalesce=False,
+                 coalesce_timeout=30,
+                 metrics=None,
+                 metrics_route=None,
+                 batch_route=None,
+                 batch_max_operations=50,
+                 batch_workers=4,
+                 max_page=500,
+                 page_size=None,
+                 cursor_secret=None):
         self.decorator = decorator
         self.blueprint = blueprint
         self.bp_name = self.blueprint.name
@@ -71,14 +169,84 @@ class Router(object):
         self.request = request
         self.document_routes = document_routes
         self.as_json = as_json
-        self.selector = Selector()
-        self.max_page = 500
+        self.stream_flush_size = stream_flush_size
+        self.compress = compress
+        self.compress_min_size = compress_min_size
+        self.compress_level = compress_level
+        self.compile_schemas = compile_schemas
+        self.event_loop = event_loop or default_bridge()
+        self.async_timeout = async_timeout
+        self.max_body_size = max_body_size
+        self.max_json_depth = max_json_depth
+        self.max_json_keys = max_json_keys
+        self.json_decoder = json_decoder and resolve_json_backend(
+            json_decoder)
+        self.max_page = max_page
+        self.selector = Selector(request_obj=request, max_page=max_page,
+                                 page_size=page_size, secret=cursor_secret)
+        self.cache = ResponseCache(cache_backend)
+        self.coalesce = coalesce
+        self.coalesce_timeout = coalesce_timeout
+        self.single_flight = SingleFlight()
+        self.metrics = RouteMetrics() if metrics is True else metrics
+        self.batch_max_operations = batch_max_operations
+        self.batch_workers = batch_workers
+        self._batch_executor = None
+        self._batch_lock = threading.Lock()
+        self._documentation = None
+        self._documentation_cache = {}
 
         if document_routes:
             self._add_documentation_route()
+        if self.metrics is not None and metrics_route:
+            self._add_metrics_route(metrics_route)
+        if batch_route:
+            self._add_batch_route(batch_route)
 
     def _documentation_view(self):
-        return make_response(self.routes)
+        # Built once per set of documented routes, see `_document_route`
+        body, etag = self._documentation_body()
+        not_modified = self._not_modified(etag=etag)
+        if not_modified:
+            return not_modified
+
+        encoding = self._negotiate_encoding() if self.compress else None
+        try:
+            return self._documentation_cache[encoding]
+        except KeyError:
+            resp = make_response(body, headers={
+                'Content-Type': 'application/json',
+                'ETag': etag,
+            })
+            if self.compress:
+                resp = self._compress(resp, encoding)
+            self._documentation_cache[encoding] = resp
+            return resp
+
+    def _documentation_body(self):
+        """ The serialized documentation and its ETag """
+        documentation = self._documentation
+        if documentation is None:
+            body = make_response(self.routes)[0]
+            documentation = self._documentation = body, body_etag(body)
+        return documentation
+
+    def openapi(self, title='API', version='1.0.0', servers=None):
+        """
+        The OpenAPI 3 document of the documented routes, with the request
+        bodies described from their validation schemas
+
+        :param servers: base URLs of the API
+        """
+        return openapi_spec(self.routes, title, version, servers)
+
+    def write_openapi(self, path, **kwargs):
+        """
+        Writes the OpenAPI document to a JSON file, e.g. when building
+        the application, so it can be served without a live worker.
+        Takes the arguments of `openapi`.
+        """
+        write_openapi(self.openapi(**kwargs), path)
 
     def _add_documentation_route(self):
         endpoint = '%s_documentation' % self.bp_name
@@ -90,16 +258,350 @@ class Router(object):
             methods=['GET', 'OPTIONS']
         )
 
-    def _response_decorator(self, f):
+    def _metrics_view(self):
+        return self.metrics.prometheus(), 200, {
+            'Content-Type': prometheus_mime,
+        }
+
+    def _add_metrics_route(self, rule):
+        self.blueprint.add_url_rule(
+            rule='/%s' % rule.strip('/'),
+            endpoint='%s_metrics' % self.bp_name,
+            view_func=self._metrics_view,
+            methods=['GET']
+        )
+
+    def _add_batch_route(self, rule):
+        def batch():
+            """
+            Runs a list of {method, path, body} operations and returns the
+            status and body of each one, in order
+            """
+            if flask_request.environ.get(batch_environ_key):
+                return make_error('Batches can not be nested')
+            try:
+                document = parse_json_body(flask_request, self.max_body_size,
+                                           self.max_json_depth,
+                                           self.max_json_keys,
+                                           self.json_decoder)
+                operations = parse_operations(document,
+                                              self.batch_max_operations)
+            except BodyError as e:
+                return make_error(str(e), e.status)
+            except BatchError as e:
+                return make_error(str(e))
+            return run_batch(current_app._get_current_object(), flask_request,
+                             operations, self._batch_pool())
+
+        self.route(rule, 'POST')(batch)
+
+    def _batch_pool(self):
+        """ The threads running the GETs of batches, None if disabled """
+        if not self.batch_workers:
+            return None
+        with self._batch_lock:
+            if self._batch_executor is None:
+                self._batch_executor = ThreadPoolExecutor(
+                    max_workers=self.batch_workers,
+                    thread_name_prefix='flask-kit-batch')
+            return self._batch_executor
+
+    def _response_decorator(self, f, method='GET', stream=None,
+                            compress=None, etag=None, last_modified=None,
+                            datetime_mode=None, status=None, headers=None,
+                            json_only=False, endpoint=None, cache=None,
+                            invalidates=None, coalesce=None, fields=None):
+        compress = self.compress if compress is None else compress
+        is_get = method.upper() in ('GET', 'HEAD')
+        conditional = is_get and bool(etag or last_modified)
+        respond = compile_response(status, headers, json_only, datetime_mode)
+        traits = {'status': status, 'headers': headers}
+        cache = cache_options(cache)
+        if coalesce is None:
+            coalesce = self.coalesce and is_get
+        coalesce = coalesce_options(coalesce)
+        vary = (cache or coalesce or {}).get('vary')
+        timed = self.metrics is not None
+        preconditions = conditional and (callable(etag) or
+                                         bool(last_modified))
+        answering = preconditions or cache is not None or coalesce is not None
+
+        def handle(*args, **kwargs):
+            if not self.as_json:
+                run, refusal = f(None, *args, **kwargs)
+                return refusal if run is None else run()
+
+            validators = {}
+            accept = None if json_only else get_header(self.request,
+                                                       'Accept', '')
+            encoding = self._negotiate_encoding() if compress else None
+            selected = None
+            if fields:
+                selected = self.selector.fields(
+                    only=None if fields is True else fields)
+            # What answered for the view inside the decorator hook: a 304,
+            # or the key of the request, whether the view ran and the call
+            # this request leads for concurrent ones
+            answered = {}
+
+            def render(resp):
+                if isinstance(resp, RenderedResponse):
+                    return resp.entry
+                if invalidates and response_status(resp) < 400:
+                    self.invalidate(*tags_for(invalidates, kwargs))
+                body = resp[0] if isinstance(resp, tuple) else resp
+                if is_stream(body, lists=stream is not None):
+                    return self._stream_response(resp, stream, compress,
+                                                 validators, datetime_mode,
+                                                 traits, selected)
+
+                resp = respond(resp, accept, selected)
+                if conditional and resp[1] == 200:
+                    if etag is True:
+                        validators['etag'] = body_etag(resp[0])
+                    resp = resp[0], resp[1], {
+                        **resp[2],
+                        **self._validator_headers(**validators),
+                    }
+                if timed:
+                    mark('serialize')
+                if compress:
+                    resp = self._compress(resp, encoding)
+                    if timed:
+                        mark('compress')
+                return resp, validators
+
+            def answer(view, *view_args, **view_kwargs):
+                """
+                Stands for the view inside the decorator hook: answers with
+                a 304, the cached response or the one of a concurrent
+                request when it can, and runs the view otherwise
+                """
+                if preconditions:
+                    if callable(etag):
+                        version = etag(*args, **kwargs)
+                        if version is not None:
+                            validators['etag'] = version_etag(version)
+                    if last_modified:
+                        validators['last_modified'] = last_modified(*args,
+                                                                    **kwargs)
+                    not_modified = self._not_modified(**validators)
+                    if not_modified:
+                        answered['not_modified'] = not_modified
+                        return not_modified
+
+                key = None
+                if cache is not None or coalesce is not None:
+                    # Requests without a key are neither cached nor coalesced
+                    key = answered['key'] = self._cache_key(
+                        endpoint, kwargs, vary, accept, encoding, selected)
+                if key is not None and cache is not None:
+                    entry = self.cache.get(key)
+                    if entry is not None:
+                        return RenderedResponse(entry)
+                # A hook calling the view again doesn't wait for itself
+                if (key is not None and coalesce is not None and
+                        'call' not in answered):
+                    call, leader = self.single_flight.join(key)
+                    if leader:
+                        answered['call'] = call
+                    elif (self.single_flight.wait(call,
+                                                  self.coalesce_timeout) and
+                            call.result is not None):
+                        return RenderedResponse(call.result)
+                answered['executed'] = True
+                return view(*view_args, **view_kwargs)
+
+            run, refusal = f(answer if answering else None, *args, **kwargs)
+            if run is None:
+                # Refused by the validation
+                entry = render(refusal)
+                if isinstance(entry, Response):
+                    return entry
+                return self._entry_response(entry, etag is True)
+
+            if timed:
+                mark('prepare')
+            try:
+                resp = run()
+                if ('not_modified' in answered and
+                        resp is answered['not_modified']):
+                    return resp
+                entry = render(resp)
+            except BaseException as e:
+                if 'call' in answered:
+                    self.single_flight.finish(answered['call'], error=e)
+                raise
+            # Streams are consumed once, each request needs its own
+            shared = not isinstance(entry, Response)
+            if 'call' in answered:
+                self.single_flight.finish(answered['call'],
+                                          entry if shared else None)
+            if not shared:
+                return entry
+            if (answered.get('executed') and cache is not None and
+                    answered['key'] is not None and entry[0][1] == 200):
+                self.cache.set(answered['key'], entry, cache['ttl'],
+                               tags_for(cache['tags'], kwargs))
+            return self._entry_response(entry, etag is True)
+
+        if not timed:
+            return wraps(f)(handle)
+
         @wraps(f)
         def decorated(*args, **kwargs):
-            if self.as_json:
-                return make_response(f(*args, **kwargs))
-            return f(*args, **kwargs)
+            timer = self.metrics.start(endpoint)
+            if timer is None:
+                return handle(*args, **kwargs)
+            try:
+                return handle(*args, **kwargs)
+            finally:
+                self.metrics.finish(timer)
 
         return decorated
 
+    def _cache_key(self, endpoint, view_args, vary, accept, encoding,
+                   fields=None):
+        """
+        Key of the responses of a request to a cached or coalesced route,
+        or None when the view arguments or the 'vary' parts of the request
+        aren't JSON values
+        """
+        variant = [
+            'json' if accept is None else response_format(accept),
+            encoding,
+            vary() if vary else None,
+            self.selector.cursor(),
+            fields,
+        ]
+        try:
+            return cache_key(
+                endpoint,
+                view_args,
+                self.selector.filter(),
+                self.selector.sort(),
+                self.selector.limit(),
+                self.selector.offset(),
+                variant,
+            )
+        except TypeError:
+            return None
+
+    def _entry_response(self, entry, check_etag):
+        """
+        The response tuple of a rendered (possibly cached or shared) entry,
+        or a 304 if it matches the If-None-Match of the request
+        """
+        (body, status, headers), validators = entry
+        if check_etag and status == 200:
+            not_modified = self._not_modified(**validators)
+            if not_modified:
+                return not_modified
+        return body, status, dict(headers)
+
+    def invalidate(self, *tags):
+        """ Drop the cached responses tagged with any of tags """
+        self.cache.invalidate(*tags)
+
+    def _validator_headers(self, etag=None, last_modified=None):
+        headers = {}
+        if etag:
+            headers['ETag'] = etag
+        if last_modified:
+            headers['Last-Modified'] = last_modified_header(last_modified)
+        return headers
+
+    def _not_modified(self, etag=None, last_modified=None):
+        """
+        A 304 response tuple if the request preconditions allow it, or None.
+        If-None-Match takes precedence over If-Modified-Since.
+        """
+        headers = self._validator_headers(etag, last_modified)
+        if_none_match = get_header(self.request, 'If-None-Match')
+        if if_none_match:
+            matched = etag and match_etag(if_none_match, etag)
+            if not matched:
+                return None
+            headers['ETag'] = matched
+        elif not last_modified or modified_since(
+                get_header(self.request, 'If-Modified-Since'), last_modified):
+            return None
+        return '', 304, headers
+
+    def _stream_response(self, resp, stream, compress, validators,
+                         datetime_mode, traits, fields=None):
+        if stream is None:
+            stream = stream_format(get_header(self.request, 'Accept'))
+        body, status, headers = make_stream_response(
+            resp,
+            ndjson=stream == 'ndjson',
+            flush_size=self.stream_flush_size,
+            datetime_mode=datetime_mode,
+            fields=fields,
+            **traits
+        )
+        if status == 200:
+            headers.update(self._validator_headers(**validators))
+        if has_request_context():
+            body = stream_with_context(body)
+
+        if compress and 'Content-Encoding' not in headers:
+            headers = add_vary(headers, 'Accept-Encoding')
+            encoding = self._negotiate_encoding()
+            if encoding:
+                body = compression.iter_compressed(body, encoding,
+                                                   self.compress_level)
+                headers['Content-Encoding'] = encoding
+                if 'ETag' in headers:
+                    headers['ETag'] = encoded_etag(headers['ETag'], encoding)
+
+        return Response(body, status=status, headers=headers)
+
+    def _negotiate_encoding(self):
+        return compression.negotiate_encoding(
+            get_header(self.request, 'Accept-Encoding'))
+
+    def _compress(self, resp, encoding):
+        """
+        Compress a response tuple with encoding, if it's large enough.
+        A None encoding only adds the Vary header.
+        """
+        body, status, headers = resp
+        if status in (204, 304) or 'Content-Encoding' in headers:
+            return resp
+        data = body.encode('utf-8') if isinstance(body, str) else body
+        if len(data) < self.compress_min_size:
+            return resp
+
+        headers = add_vary(headers, 'Accept-Encoding')
+        if encoding is None:
+            return body, status, headers
+        headers = {**headers, 'Content-Encoding': encoding}
+        if 'ETag' in headers:
+            headers['ETag'] = encoded_etag(headers['ETag'], encoding)
+        data = compression.compress(data, encoding, self.compress_level)
+        return data, status, headers
+
+    def _read_json(self, max_body_size):
+        """
+        The JSON body of the request. Unless limits or a decoder are set,
+        it's read with `get_json` and invalid bodies are taken as empty.
+        """
+        if (max_body_size is None and self.max_json_depth is None and
+                self.max_json_keys is None and self.json_decoder is None):
+            return get_json(self.request)
+        return parse_json_body(self.request, max_body_size,
+                               self.max_json_depth, self.max_json_keys,
+                               self.json_decoder)
+
+    def _validator(self, schema):
+        if self.compile_schemas:
+            return compile_schema(schema)
+        return Validator(schema)
+
     def _document_route(self, view, rule, method, endpoint, cerberus_schema):
+        self._documentation = None
+        self._documentation_cache.clear()
         prefix = '/%s' % (self.blueprint.url_prefix or '').strip('/')
         with_prefix = '{}/{}'.format(prefix, (rule or '').strip('/'))
         full_rule = '/%s' % with_prefix.strip('/')
@@ -121,7 +623,20 @@ class Router(object):
               rule_path: str,
               method: str,
               validate: dict = None,
-              document: bool = True):
+              document: bool = True,
+              stream: str = None,
+              compress: bool = None,
+              etag=None,
+              last_modified=None,
+              datetime_mode: str = None,
+              status: int = None,
+              headers: dict = None,
+              json_only: bool = False,
+              max_body_size: int = None,
+              cache=None,
+              invalidates=None,
+              coalesce=None,
+              fields=None):
         """
         Decorator that registers a route on the BP or app.
 
@@ -130,30 +645,174 @@ class Router(object):
         :param validate: Cerberus JSON schema. Defaults to None.
                           if provided, will enforce validation using it.
         :param document: Add route to API documentation
+        :param stream: 'json' or 'ndjson' to always stream the response in
+                       that format, lists included. By default, only
+                       iterators are streamed, in the format negotiated
+                       with the Accept header.
+        :param compress: True to compress the responses of this route (when
+                         large enough, see `compress_min_size`), False to
+                         never compress them. Defaults to the `compress`
+                         option of the router.
+        :param etag: GET routes only. True to send an ETag computed from the
+                     serialized body, or a callable receiving the view
+                     arguments that returns a version key for the resource.
+                     With a callable, matching If-None-Match requests get a
+                     304 without running the view: the `decorator` hook
+                     receives it (as a ('', 304, headers) tuple) when it
+                     calls the view, as with `cache`.
+        :param last_modified: GET routes only. A callable receiving the view
+                              arguments that returns the datetime (naive
+                              means UTC) the resource was last modified, used
+                              for Last-Modified and If-Modified-Since.
+        :param datetime_mode: How dates are encoded on this route ('full',
+                              'iso', 'unix' or 'epoch_millis'). Defaults to
+                              the mode set with `set_datetime_mode`.
+        :param status: Status of the responses when the view returns none
+                       (e.g. 201 for routes creating resources)
+        :param headers: Static headers added to every response, the ones
+                        returned by the view take precedence
+        :param json_only: Always answer with JSON, without negotiating the
+                          format with the Accept header
+        :param max_body_size: Maximum size in bytes of the request body of
+                              validated routes, overriding the one of the
+                              router. Larger bodies get a 413.
+        :param cache: GET routes only. Cache the serialized responses, given
+                      a TTL in seconds or a dict with 'ttl', 'tags' (a list
+                      of tags, or a callable receiving the view arguments
+                      that returns one) and 'vary' (a callable returning
+                      extra key parts, e.g. the caller permissions). Keys
+                      are made of the route, the arguments of its URL,
+                      the query parsed by `Selector` and the negotiated
+                      format and encoding; requests whose URL arguments or
+                      'vary' parts aren't JSON values (see `cache_key`)
+                      aren't cached. The lookup runs when the `decorator`
+                      hook of the router calls the view: on a hit, the
+                      hook gets a `RenderedResponse` instead of what the
+                      view returns, and should return it as is (it's sent
+                      as it was cached, rendered from what the hook
+                      returned then). The arguments the hook gives the
+                      view aren't part of the key, responses depending on
+                      the caller need 'vary', as do access checks made by
+                      decorators of the view itself, which run after the
+                      lookup.
+        :param invalidates: Tags (or a callable receiving the view arguments
+                            that returns them) of the cached responses to
+                            drop when this route succeeds
+        :param coalesce: GET routes only. Run the view once for identical
+                         concurrent requests (same key as `cache`) and give
+                         all of them its rendered response, or its
+                         exception. True, False, or a dict with 'vary' (as
+                         in `cache`). Defaults to the `coalesce` option of
+                         the router. As with `cache`, requests join the one
+                         running when the `decorator` hook calls the view,
+                         and the hook gets its response as a
+                         `RenderedResponse`. Requests without a key run the
+                         view on their own.
+        :param fields: Project the responses on the fields of the `fields`
+                       argument (see `Selector.fields`): True for any
+                       fields, or the list of the ones that may be selected.
+                       Dicts keep the selected keys, lists are projected
+                       item by item, and the values left out are never
+                       encoded.
+
+        The response traits (status, headers, json_only and datetime_mode)
+        are used to build a specialized response function when the route is
+        registered, views returning other shapes use the generic path.
         """
+        if stream not in (None, 'json', 'ndjson'):
+            raise ValueError('Invalid stream format %s' % stream)
+        if method.upper() not in ('GET', 'HEAD'):
+            if cache is not None:
+                raise ValueError('Only GET routes can be cached')
+            if coalesce:
+                raise ValueError('Only GET routes can be coalesced')
 
         def inner(f):
             view_name = f.__name__
             endpoint = '%s_%s' % (self.bp_name, view_name)
             rule = '/%s' % rule_path.strip('/')
-            validator = Validator(validate) if validate else None
+            body_limit = (max_body_size if max_body_size is not None
+                          else self.max_body_size)
+            validators = None
+            if validate:
+                validators = ValidatorPool(partial(self._validator, validate))
+                # Invalid schemas fail on registration, not on first request
+                validators.get()
+
+            timed = self.metrics is not None
+
+            def resolve(view, *args, **kwargs):
+                response = view(*args, **kwargs)
+                if isawaitable(response):
+                    response = self.event_loop.run(response,
+                                                   self.async_timeout)
+                return response
+
+            def call(view, *args, **kwargs):
+                try:
+                    response = resolve(view, *args, **kwargs)
+                except QueryError as e:
+                    return make_error(str(e))
+                if timed:
+                    mark('view')
+                return response
 
-            @self._response_decorator
-            def decorated_route(*args, **kwargs):
+            def answering(answer):
+                @wraps(f)
+                def view(*args, **kwargs):
+                    return answer(partial(resolve, f), *args, **kwargs)
+
+                return view
+
+            @wraps(f)
+            def admit(answer, *args, **kwargs):
+                """
+                Validates the request. Returns the function running the view
+                through the decorator hook, or None and the response
+                refusing the request. When set, answer stands for the view
+                in the hook: it receives a function running the view and
+                the arguments given by the hook.
+                """
                 new_kwargs = {}
-                if validator:
-                    input_json = get_json(self.request)
-                    if not validator.validate(input_json or {}):
-                        response = make_error(validator.errors)
-                        return response
+                if validators is not None:
+                    validator = validators.get()
+                    try:
+                        input_json = self._read_json(body_limit)
+                    except BodyError as e:
+                        return None, make_error(str(e), e.status)
+                    if timed:
+                        mark('parse')
+                    valid = validator.validate(input_json or {})
+                    if timed:
+                        mark('validate')
+                    if not valid:
+                        return None, make_error(validator.errors)
                     new_kwargs[self.data_key] = validator.document
 
                 full_kwargs = {**kwargs, **new_kwargs}
-                if self.decorator:
-                    response = self.decorator(f, *args, **full_kwargs)
-                else:
-                    response = f(*args, **full_kwargs)
-                return response
+                view = f if answer is None else answering(answer)
+                if not self.decorator:
+                    return partial(call, view, *args, **full_kwargs), None
+                return (partial(call, self.decorator, view, *args,
+                                **full_kwargs), None)
+
+            decorated_route = self._response_decorator(
+                admit,
+                method=method,
+                stream=stream,
+                compress=compress,
+                etag=etag,
+                last_modified=last_modified,
+                datetime_mode=datetime_mode,
+                status=status,
+                headers=headers,
+                json_only=json_only,
+                endpoint=endpoint,
+                cache=cache,
+                invalidates=invalidates,
+                coalesce=coalesce,
+                fields=fields,
+            )
 
             self.blueprint.add_url_rule(
                 rule=rule,
@@ -193,66 +852,212 @@ def get_json(request):
     return res
 
 
+def get_header(request, name, default=None):
+    """ A request header, or default when outside of a request context """
+    try:
+        return request.headers.get(name, default)
+    except RuntimeError:
+        return default
+
+
+class QueryError(ValueError):
+    """ An invalid query string, views raising it get a 400 from Router """
+
+
+class RenderedResponse(object):
+    """
+    A response already rendered by Router, that the decorator hook gets in
+    place of what the view returns when the view didn't run for the request
+    (see the `cache` and `coalesce` options of routes). Returned as is by
+    the hook, it's sent as it was rendered.
+    """
+    __slots__ = ('entry',)
+
+    def __init__(self, entry):
+        self.entry = entry
+
+
 class Selector(object):
+    """
+    Parses the filters, sorting and pagination of the query string.
+
+    :param max_page: maximum limit, larger ones are capped to it
+    :param page_size: limit when none is given, defaults to max_page
+    :param secret: key signing the pagination cursors, defaults to the
+                   secret key of the Flask application
+    """
     filter_ops = ['eq', 'in', 'nin', 'lt', 'le', 'gt', 'ge', 'ne', 'not']
     sort_dir = ['asc', 'desc']
+    # Query string arguments that are never filters
+    reserved_args = ['sort', 'limit', 'offset', 'cursor', 'fields']
 
-    def __init__(self, list_obj=None, request_obj=flask_request):
+    def __init__(self, list_obj=None, request_obj=flask_request,
+                 max_page=None, page_size=None, secret=None):
         self.request = request_obj
         self.list_obj = list_obj or list
+        self.max_page = max_page
+        self.page_size = page_size if page_size is not None else max_page
+        self.secret = secret
+
+    def parsed(self):
+        """
+        The `ParsedQuery` of the request, parsed once per request and shared
+        by the requests with the same query string
+        """
+        request = self.request
+        # Requests without a raw query string are parsed from their args
+        source = getattr(request, 'query_string', None)
+        if source is None:
+            source = request.args
+        memo = getattr(request, query_memo_attribute, None)
+        if memo is not None and memo[0] is source:
+            return memo[1]
+        if isinstance(source, (bytes, str)):
+            parsed = _parse_query_string(source, self.__class__)
+        else:
+            parsed = self.parse_args(source)
+        setattr(request, query_memo_attribute, (source, parsed))
+        return parsed
+
+    @classmethod
+    def parse_args(cls, args):
+        """ The `ParsedQuery` of the arguments of a request, a MultiDict """
+        filters = []
+        for key in args.keys():
+            if not key or key in cls.reserved_args:
+                continue
+            for arg in args.getlist(key):
+                op, value = qualified_value(arg, cls.filter_ops, True, 'eq')
+                if op in ['in', 'nin']:
+                    value = tuple(v.strip() for v in value.split(',')
+                                  if v.strip())
+                filters.append((key, op, value))
+
+        sorting = None
+        sort_val = args.get('sort', None)
+        if sort_val:
+            sorting = []
+            for key in sort_val.split(','):
+                s_dir, val = qualified_value(key, cls.sort_dir, False, 'desc')
+                if val:
+                    sorting.append((val, s_dir))
+            sorting = tuple(sorting)
+
+        fields = tuple(field.strip() for arg in args.getlist('fields')
+                       for field in arg.split(',') if field.strip())
+
+        limit, offset = args.get('limit', None), args.get('offset', None)
+        return ParsedQuery(
+            tuple(filters),
+            sorting,
+            int(limit) if is_non_neg_int(limit) else None,
+            int(offset) if is_non_neg_int(offset) else None,
+            args.get('cursor', None) or None,
+            fields or None,
+        )
 
     def limit(self):
-        """ Returns the limit as an integer or None """
-        limit_value = self.request.args.get('limit', None)
-        if is_non_neg_int(limit_value):
-            return int(limit_value)
-        return None
+        """
+        Returns the limit as an integer, capped to max_page, or the page
+        size (None if unset) when not given
+        """
+        limit_value = self.parsed().limit
+        if limit_value is None:
+            return self.page_size
+        if self.max_page is not None:
+            return min(limit_value, self.max_page)
+        return limit_value
+
+    def cursor(self):
+        """ Returns the pagination cursor token, or None """
+        return self.parsed().cursor
+
+    def cursor_secret(self):
+        """ The key signing the cursors """
+        if self.secret:
+            return self.secret
+        if has_app_context() and current_app.secret_key:
+            return current_app.secret_key
+        raise RuntimeError('Cursor pagination needs a secret: set the one '
+                           'of the Selector or the Flask secret key')
 
     def offset(self):
         """ Returns the offset as an integer or None """
-        offset_value = self.request.args.get('offset', None)
-        if is_non_neg_int(offset_value):
-            return int(offset_value)
-        return None
+        return self.parsed().offset
 
-    def filter(self, only=None, mapping=None):
+    def filter(self, only=None, mapping=None, types=None):
         """
         Returns a list of filter descriptors.
 
         /users?gender=male&age=23
         /products?category=in:computers,tvs&price=gt:10.00&price=lt:100.00
+
+        :param types: maps query string keys to the Cerberus type (or rules)
+                      their values are converted to, see `coercion`. Values
+                      that can't be converted raise QueryError.
         """
-        final_filter = self.list_obj()
-        for key in self.request.args.keys():
-            if not key or (only is not None and key not in only):
-                continue
-            final_filter.extend(self._add_filter_key(key, mapping))
-        return final_filter
+        parsed = self.parsed()
+        try:
+            selected = _selected_filters(
+                parsed,
+                None if only is None else tuple(only),
+                tuple(sorted(mapping.items())) if mapping else None,
+            )
+        except TypeError:
+            # Unhashable only or mapping
+            selected = _selected_filters.__wrapped__(parsed, only, mapping)
 
-    def _add_filter_key(self, key, mapping):
-        filters = []
-        for arg in self.request.args.getlist(key):
-            final_key = (mapping or dict()).get(key, key)
-            op, value = qualified_value(arg, self.filter_ops, True, 'eq')
-            if op in ['in', 'nin']:
-                value = [v.strip() for v in value.split(',') if v.strip()]
-            filters.append({
-                'field': final_key,
+        coercers = {}
+        final_filter = self.list_obj()
+        for key, field, op, value in selected:
+            if isinstance(value, tuple):
+                value = list(value)
+            if types and key in types:
+                if key not in coercers:
+                    coercers[key] = coercer(types[key])
+                value = _coerced(key, op, value, coercers[key])
+            final_filter.append({
+                'field': field,
                 'op': op,
                 'value': value,
             })
-        return filters
+        return final_filter
+
+    def fields(self, only=None, mapping=None):
+        """
+        Returns the list of fields (dotted paths) selected by the fields
+        argument, or None to select them all.
+
+        /products?fields=name,price,dimensions.width
+
+        :param only: fields that may be selected, with their subfields
+        :param mapping: maps the selected fields, or their first part, to
+                        document fields
+        """
+        fields = self.parsed().fields
+        if fields is None:
+            return None
+        selected = []
+        for path in fields:
+            top = path.split('.', 1)[0]
+            if only is not None and path not in only and top not in only:
+                continue
+            if mapping and path in mapping:
+                path = mapping[path]
+            elif mapping and top in mapping:
+                path = mapping[top] + path[len(top):]
+            selected.append(path)
+        # Nothing left is no projection, as for Mongo
+        return selected or None
 
     def sort(self, only=None, mapping=None):
-        final_sorting = list()
-        sort_val = self.request.args.get('sort', None)
-        if not sort_val:
+        sorting = self.parsed().sort
+        if sorting is None:
             return {}
-        sort_keys = sort_val.split(',')
-        for key in sort_keys:
-            if not key or (only is not None and key not in only):
+        final_sorting = list()
+        for val, s_dir in sorting:
+            if only is not None and val not in only:
                 continue
-            s_dir, val = qualified_value(key, self.sort_dir, False, 'desc')
             final_key = (mapping or dict()).get(val, val)
             final_sorting.append({
                 'field': final_key,
@@ -261,6 +1066,56 @@ class Selector(object):
         return final_sorting
 
 
+# Attribute of the requests keeping their parsed query string
+query_memo_attribute = '_flask_kit_query'
+
+# Number of query strings, and of their filters for each only and mapping,
+# kept parsed
+query_cache_size = 1024
+
+
+class ParsedQuery(object):
+    """
+    A query string parsed by `Selector`, shared by the requests with the
+    same query string, so it must not be changed.
+
+    :param filters: tuple of (key, op, value), with tuple values for in
+                    and nin
+    :param sort: tuple of (key, direction), None without a sort argument
+    :param fields: tuple of the selected fields, None to select them all
+    """
+    __slots__ = ('filters', 'sort', 'limit', 'offset', 'cursor', 'fields')
+
+    def __init__(self, filters, sort, limit, offset, cursor, fields=None):
+        self.filters = filters
+        self.sort = sort
+        self.limit = limit
+        self.offset = offset
+        self.cursor = cursor
+        self.fields = fields
+
+
+@lru_cache(maxsize=query_cache_size)
+def _parse_query_string(query_string, selector_class):
+    if isinstance(query_string, bytes):
+        query_string = query_string.decode('utf-8', 'replace')
+    return selector_class.parse_args(
+        MultiDict(parse_qsl(query_string, keep_blank_values=True)))
+
+
+@lru_cache(maxsize=query_cache_size)
+def _selected_filters(parsed, only, mapping):
+    """
+    The (key, field, op, value) of the filters of parsed on the keys in
+    only, renamed by mapping (a tuple of pairs). Queries with the same
+    query string share parsed, which is hashed by identity.
+    """
+    mapping = dict(mapping or ())
+    return tuple((key, mapping.get(key, key), op, value)
+                 for key, op, value in parsed.filters
+                 if only is None or key in only)
+
+
 def qualified_value(raw_value, valid, qualifier_first, default):
     """
     Given a string with one optional qualifier and a payload, both separated
@@ -285,6 +1140,38 @@ def qualified_value(raw_value, valid, qualifier_first, default):
     return qualifier, value
 
 
+def _coerced(key, op, value, coerce):
+    """
+    The value of a filter converted with coerce. The value of typed 'not'
+    filters is the negated filter, {'op': op, 'value': value}.
+    """
+    if op == 'not':
+        op, value = negated_filter(value)
+        return {'op': op, 'value': _coerced(key, op, value, coerce)}
+    try:
+        if isinstance(value, list):
+            return [coerce(v) for v in value]
+        return coerce(value)
+    except ValueError:
+        raise QueryError('Invalid value for %s' % key)
+
+
+def negated_filter(value):
+    """
+    The operator and value negated by a 'not' filter, which takes another
+    filter as its value: 'not:gt:10', 'not:in:a,b' or 'not:a' (for eq), or
+    {'op': 'gt', 'value': 10} once typed
+    """
+    if isinstance(value, dict):
+        return value['op'], value['value']
+    op, value = qualified_value(value, Selector.filter_ops, True, 'eq')
+    if op == 'not':
+        op, value = 'eq', 'not:%s' % value
+    if op in ['in', 'nin']:
+        value = [v.strip() for v in value.split(',') if v.strip()]
+    return op, value
+
+
 def is_non_neg_int(value):
     """ Returns true if the value is a non-negative int """
     try:
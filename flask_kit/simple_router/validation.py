@@ -0,0 +1,297 @@
+"""
+Compiles Cerberus schemas into plain Python functions.
+
+Cerberus walks the schema rule by rule for every document it validates. For
+the rules APIs use the most (type, required, nullable, empty, allowed,
+min/max, minlength/maxlength, regex, nested dict and list schemas and
+defaults) the checks can be decided once, when the schema is compiled.
+
+Only valid documents are handled by the compiled function. Whenever it finds
+a problem the document is validated again by Cerberus, so errors are exactly
+the ones Cerberus reports. Schemas using any other rule are not compiled.
+"""
+import re
+import threading
+from collections.abc import Iterable, Mapping, Sized
+
+from cerberus import Validator
+
+compiled_rules = frozenset([
+    'allowed',
+    'default',
+    'empty',
+    'max',
+    'maxlength',
+    'meta',
+    'min',
+    'minlength',
+    'nullable',
+    'regex',
+    'required',
+    'schema',
+    'type',
+])
+
+
+class _Invalid(Exception):
+    """ The document needs Cerberus to tell what is wrong with it """
+
+
+class _Unsupported(Exception):
+    """ The schema uses something that can't be compiled """
+
+
+class CompiledValidator(object):
+    """
+    A stand-in for `cerberus.Validator` on a compiled schema, with the same
+    `validate`, `document` and `errors`. Use `compile_schema` to create it.
+    """
+
+    def __init__(self, check, fallback):
+        self._check = check
+        self.fallback = fallback
+        self.schema = fallback.schema
+        self.document = None
+        self._valid = True
+
+    @property
+    def errors(self):
+        if self._valid:
+            return {}
+        return self.fallback.errors
+
+    def validate(self, document):
+        try:
+            self.document = self._check(document)
+        except Exception:
+            self._valid = self.fallback.validate(document)
+            self.document = self.fallback.document
+            return self._valid
+        self._valid = True
+        return True
+
+    __call__ = validate
+
+
+class ValidatorPool(object):
+    """
+    Hands out one validator per thread, created by factory on first use.
+    Validators keep the last document and errors as instance state, so a
+    single one can't be shared by concurrent requests.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._local = threading.local()
+
+    def get(self):
+        """ The validator of the current thread """
+        try:
+            return self._local.validator
+        except AttributeError:
+            self._local.validator = self.factory()
+            return self._local.validator
+
+
+def compile_schema(schema, validator_cls=Validator):
+    """
+    Returns a validator for schema: a `CompiledValidator` if every rule on
+    it can be compiled, otherwise a regular Cerberus validator.
+    """
+    fallback = validator_cls(schema)
+    if (fallback.allow_unknown or fallback.purge_unknown or
+            getattr(fallback, 'require_all', False)):
+        return fallback
+    try:
+        check = _compile_mapping(schema, validator_cls.types_mapping)
+    except _Unsupported:
+        return fallback
+    return CompiledValidator(check, fallback)
+
+
+def _compile_mapping(schema, types_mapping):
+    if not isinstance(schema, Mapping):
+        raise _Unsupported()
+    fields = {
+        name: _compile_field(rules, types_mapping)
+        for name, rules in schema.items()
+    }
+    required = [name for name, rules in schema.items()
+                if rules.get('required') is True]
+    defaults = [(name, rules['default']) for name, rules in schema.items()
+                if 'default' in rules]
+
+    def check(mapping):
+        if mapping.__class__ is not dict:
+            raise _Invalid()
+        document = dict(mapping)
+        for name, default in defaults:
+            if name not in document:
+                document[name] = default
+        try:
+            for name in document:
+                document[name] = fields[name](document[name])
+        except KeyError:
+            raise _Invalid()
+        for name in required:
+            if name not in document:
+                raise _Invalid()
+        return document
+
+    return check
+
+
+def _compile_field(rules, types_mapping):
+    """ A function that normalizes and validates a single value """
+    if not isinstance(rules, Mapping) or not compiled_rules.issuperset(rules):
+        raise _Unsupported()
+
+    nullable = rules.get('nullable', False)
+    has_default = 'default' in rules and not nullable
+    default = rules.get('default')
+    matches_type = _compile_type(rules.get('type'), types_mapping)
+    empty = rules.get('empty')
+    nested = _compile_nested(rules, types_mapping)
+
+    # Rules skipped by Cerberus for empty values when `empty` is set
+    skippable = []
+    checks = []
+    if 'allowed' in rules:
+        skippable.append(_allowed(rules['allowed']))
+    if 'minlength' in rules:
+        skippable.append(_minlength(rules['minlength']))
+    if 'maxlength' in rules:
+        skippable.append(_maxlength(rules['maxlength']))
+    if 'regex' in rules:
+        skippable.append(_regex(rules['regex']))
+    if 'min' in rules:
+        checks.append(_min(rules['min']))
+    if 'max' in rules:
+        checks.append(_max(rules['max']))
+    all_checks = skippable + checks
+
+    def check(value):
+        if value is None:
+            if has_default:
+                value = default
+            if value is None:
+                if nullable:
+                    return None
+                raise _Invalid()
+        if matches_type is not None and not matches_type(value):
+            raise _Invalid()
+        if (empty is not None and isinstance(value, Sized) and
+                len(value) == 0):
+            if not empty:
+                raise _Invalid()
+            value_checks = checks
+        else:
+            value_checks = all_checks
+        for value_check in value_checks:
+            if not value_check(value):
+                raise _Invalid()
+        if nested is not None:
+            return nested(value)
+        return value
+
+    return check
+
+
+def _compile_type(data_type, types_mapping):
+    if not data_type:
+        return None
+    names = (data_type,) if isinstance(data_type, str) else data_type
+    definitions = []
+    for name in names:
+        if name not in types_mapping:
+            raise _Unsupported()
+        definitions.append((types_mapping[name].included_types,
+                            types_mapping[name].excluded_types))
+
+    if len(definitions) == 1 and not definitions[0][1]:
+        included = definitions[0][0]
+        return lambda value: isinstance(value, included)
+
+    def matches_type(value):
+        for included, excluded in definitions:
+            if isinstance(value, included) and not isinstance(value,
+                                                              excluded):
+                return True
+        return False
+
+    return matches_type
+
+
+def _compile_nested(rules, types_mapping):
+    """ The normalization of dict and list values with a `schema` rule """
+    if 'schema' not in rules:
+        return None
+
+    if rules.get('type') == 'dict':
+        return _compile_mapping(rules['schema'], types_mapping)
+
+    if rules.get('type') == 'list':
+        item = _compile_field(rules['schema'], types_mapping)
+
+        def check_items(value):
+            if value.__class__ is not list:
+                raise _Invalid()
+            return [item(v) for v in value]
+
+        return check_items
+
+    raise _Unsupported()
+
+
+def _allowed(allowed_values):
+    def check(value):
+        if isinstance(value, Iterable) and not isinstance(value, str):
+            return all(v in allowed_values for v in value)
+        return value in allowed_values
+
+    return check
+
+
+def _min(min_value):
+    def check(value):
+        try:
+            return not value < min_value
+        except TypeError:
+            return True
+
+    return check
+
+
+def _max(max_value):
+    def check(value):
+        try:
+            return not value > max_value
+        except TypeError:
+            return True
+
+    return check
+
+
+def _minlength(min_length):
+    def check(value):
+        return not (isinstance(value, Iterable) and len(value) < min_length)
+
+    return check
+
+
+def _maxlength(max_length):
+    def check(value):
+        return not (isinstance(value, Iterable) and len(value) > max_length)
+
+    return check
+
+
+def _regex(pattern):
+    if not pattern.endswith('$'):
+        pattern += '$'
+    match = re.compile(pattern).match
+
+    def check(value):
+        return not isinstance(value, str) or match(value) is not None
+
+    return check
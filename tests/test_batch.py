@@ -0,0 +1,43 @@
+import unittest
+
+from flask_kit.simple_router.batch import (
+    BatchError,
+    parse_operations,
+    schedule,
+)
+
+
+class TestParseOperations(unittest.TestCase):
+    def test_valid(self):
+        self.assertEqual(parse_operations([
+            {'path': '/items'},
+            {'method': 'post', 'path': '/items', 'body': {'a': 1}},
+        ]), [('GET', '/items', None), ('POST', '/items', {'a': 1})])
+
+    def test_invalid(self):
+        invalid = [
+            {'operations': []},
+            [1],
+            [{'method': 'GET'}],
+            [{'path': 'items'}],
+            [{'method': 'CONNECT', 'path': '/items'}],
+            [{'path': '/items', 'headers': {}}],
+        ]
+        for document in invalid:
+            with self.subTest(document=document):
+                with self.assertRaises(BatchError):
+                    parse_operations(document)
+
+    def test_max_operations(self):
+        parse_operations([{'path': '/'}] * 2, max_operations=2)
+        with self.assertRaises(BatchError):
+            parse_operations([{'path': '/'}] * 3, max_operations=2)
+
+
+class TestSchedule(unittest.TestCase):
+    def test_groups(self):
+        operations = [(method, '/', None) for method in
+                      ['GET', 'GET', 'POST', 'GET', 'DELETE', 'DELETE',
+                       'GET', 'GET', 'GET']]
+        self.assertEqual(schedule(operations),
+                         [[0, 1], [2], [3], [4], [5], [6, 7, 8]])
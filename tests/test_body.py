@@ -0,0 +1,135 @@
+import io
+import json
+import unittest
+
+from flask_kit.json_formatter import StdlibBackend, available_json_backends
+from flask_kit.simple_router.body import (
+    BodyError,
+    parse_json_body,
+    read_body,
+    scan_structure,
+)
+
+
+class StreamRequest(object):
+    """ The body reading parts of a Werkzeug request """
+
+    def __init__(self, body, content_length=None):
+        self.headers = {}
+        if content_length is not None:
+            self.headers['Content-Length'] = str(content_length)
+        if isinstance(content_length, int):
+            # The stream isn't read past the Content-Length
+            body = body[:content_length]
+        self.stream = io.BytesIO(body)
+        self.cached_data = None
+
+    def get_data(self, cache=True):
+        data = self.cached_data
+        if data is None:
+            data = self.stream.read()
+        if cache:
+            self.cached_data = data
+        return data
+
+
+class TestReadBody(unittest.TestCase):
+    def test_unlimited(self):
+        request = StreamRequest(b'x' * 100000, 100000)
+        self.assertEqual(len(read_body(request)), 100000)
+
+    def test_content_length(self):
+        request = StreamRequest(b'x' * 100, 100)
+        with self.assertRaises(BodyError) as raised:
+            read_body(request, max_size=10)
+        self.assertEqual(raised.exception.status, 413)
+        self.assertEqual(request.stream.tell(), 0)
+
+    def test_streamed(self):
+        for content_length in [None, 'nope']:
+            with self.subTest(content_length=content_length):
+                request = StreamRequest(b'x' * 100, content_length)
+                with self.assertRaises(BodyError):
+                    read_body(request, max_size=10, chunk_size=4)
+                self.assertLess(request.stream.tell(), 20)
+
+    def test_within_limit(self):
+        for content_length in [10, None]:
+            with self.subTest(content_length=content_length):
+                request = StreamRequest(b'x' * 10, content_length)
+                self.assertEqual(read_body(request, max_size=10), b'x' * 10)
+                self.assertEqual(request.get_data(), b'x' * 10)
+
+
+class TestScanStructure(unittest.TestCase):
+    def test_depth(self):
+        data = json.dumps({'a': [{'b': [1]}], 'c': '[[{{'}).encode()
+        scan_structure(data, max_depth=4)
+        with self.assertRaises(BodyError):
+            scan_structure(data, max_depth=3)
+        scan_structure(b'1', max_depth=0)
+
+    def test_keys(self):
+        data = json.dumps({'a': 1, 'b': [{'c': 1, 'd': {'e': ':"\\:'}}]})
+        scan_structure(data.encode(), max_keys=5)
+        with self.assertRaises(BodyError):
+            scan_structure(data.encode(), max_keys=4)
+
+
+class RecordingBackend(StdlibBackend):
+    def __init__(self):
+        self.parsed = []
+
+    def loads(self, data):
+        self.parsed.append(data)
+        return super(RecordingBackend, self).loads(data)
+
+
+class TestParseJsonBody(unittest.TestCase):
+    def parse(self, body, **kwargs):
+        return parse_json_body(StreamRequest(body, len(body)), **kwargs)
+
+    def test_parse(self):
+        self.assertEqual(self.parse(b'{"a": [1, 2]}'), {'a': [1, 2]})
+        self.assertIsNone(self.parse(b''))
+        self.assertIsNone(self.parse(b'  \n'))
+
+    def test_invalid(self):
+        for body in [b'{"a": ', b'\xff\xfe', b'[' * 100000]:
+            with self.subTest(body=body[:10]):
+                with self.assertRaises(BodyError) as raised:
+                    self.parse(body)
+                self.assertEqual(raised.exception.status, 400)
+
+    def test_limits(self):
+        body = json.dumps({'a': [[[1]]], 'b': 2}).encode()
+        with self.assertRaises(BodyError):
+            self.parse(body, max_size=5)
+        with self.assertRaises(BodyError):
+            self.parse(body, max_depth=3)
+        with self.assertRaises(BodyError):
+            self.parse(body, max_keys=1)
+        self.assertEqual(self.parse(body, max_size=100, max_depth=4,
+                                    max_keys=2), {'a': [[[1]]], 'b': 2})
+
+    def test_limits_before_parsing(self):
+        # Refused bodies are never parsed
+        decoder = RecordingBackend()
+        for body, limits in [(b'[' * 100000, {'max_depth': 10}),
+                             (b'{"a": {}, "b": {}, "c": [' * 1000,
+                              {'max_keys': 10})]:
+            with self.subTest(limits=limits):
+                with self.assertRaises(BodyError):
+                    self.parse(body, decoder=decoder, **limits)
+        self.assertEqual(decoder.parsed, [])
+        self.parse(b'[[1]]', decoder=decoder, max_depth=2)
+        self.assertEqual(decoder.parsed, [b'[[1]]'])
+
+    def test_decoders(self):
+        body = '{"a": [1, 2.5, null, true, "é"]}'.encode('utf-8')
+        for decoder in available_json_backends():
+            with self.subTest(decoder=decoder):
+                self.assertEqual(self.parse(body, decoder=decoder),
+                                 json.loads(body))
+                with self.assertRaises(BodyError):
+                    self.parse(b'{bad', decoder=decoder)
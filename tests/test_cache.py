@@ -0,0 +1,131 @@
+import datetime
+import unittest
+from unittest.mock import patch
+
+from flask_kit.simple_router.cache import (
+    MemoryCache,
+    ResponseCache,
+    cache_key,
+    cache_options,
+)
+
+
+def entry(body='body'):
+    return (body, 200, {'Content-Type': 'application/json'}), {}
+
+
+class TestMemoryCache(unittest.TestCase):
+    def test_get_set(self):
+        cache = MemoryCache()
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', entry(), 10)
+        self.assertEqual(cache.get('a'), entry())
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_ttl(self):
+        cache = MemoryCache()
+        with patch('time.monotonic', return_value=100):
+            cache.set('a', entry(), 10)
+        with patch('time.monotonic', return_value=109):
+            self.assertIsNotNone(cache.get('a'))
+        with patch('time.monotonic', return_value=110):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_lru(self):
+        cache = MemoryCache(max_size=1500)
+        cache.set('a', entry('a' * 300), 10)
+        cache.set('b', entry('b' * 300), 10)
+        cache.get('a')
+        cache.set('c', entry('c' * 300), 10)
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertLessEqual(cache.size, 1500)
+
+    def test_too_large(self):
+        cache = MemoryCache(max_size=100)
+        cache.set('a', entry('a' * 1000), 10)
+        self.assertIsNone(cache.get('a'))
+
+    def test_tags(self):
+        cache = MemoryCache()
+        cache.set('a', entry(), 10, ['items', 'item:1'])
+        cache.set('b', entry(), 10, ['items', 'item:2'])
+        cache.set('c', entry(), 10)
+        cache.invalidate(['item:1'])
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+        cache.invalidate(['items'])
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache._tags, {})
+
+    def test_replace(self):
+        cache = MemoryCache()
+        cache.set('a', entry('x'), 10, ['old'])
+        cache.set('a', entry('y'), 10, ['new'])
+        cache.invalidate(['old'])
+        self.assertEqual(cache.get('a'), entry('y'))
+        self.assertEqual(cache.size, cache.stats()['size'])
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_stats(self):
+        cache = ResponseCache()
+        cache.get('a')
+        cache.set('a', entry(), 10, ['t'])
+        cache.get('a')
+        cache.get('a')
+        cache.invalidate('t')
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertAlmostEqual(stats['hit_ratio'], 2 / 3)
+        self.assertEqual(stats['stores'], 1)
+        self.assertEqual(stats['invalidations'], 1)
+        self.assertEqual(stats['entries'], 0)
+
+
+class TestCacheKey(unittest.TestCase):
+    def test_filter_order(self):
+        filters = [{'field': 'a', 'op': 'eq', 'value': '1'},
+                   {'field': 'b', 'op': 'gt', 'value': '2'}]
+        self.assertEqual(
+            cache_key('r', {'id': 1}, filters, [], None, None, []),
+            cache_key('r', {'id': 1}, filters[::-1], [], None, None, []))
+
+    def test_parts(self):
+        base = ['r', {'id': 1}, [], [], 10, 0, ['json', None]]
+        key = cache_key(*base)
+        self.assertTrue(key.startswith('r:'))
+        for index, other in [(0, 's'), (1, {'id': 2}), (4, 20), (5, 10),
+                             (6, ['json', 'gzip'])]:
+            changed = list(base)
+            changed[index] = other
+            with self.subTest(part=index):
+                self.assertNotEqual(cache_key(*changed), key)
+
+    def test_values(self):
+        when = datetime.datetime(2018, 5, 17)
+        key = cache_key('r', {'at': when}, [], [], None, None, [])
+        self.assertEqual(
+            cache_key('r', {'at': when}, [], [], None, None, []), key)
+        self.assertNotEqual(
+            cache_key('r', {'at': str(when)}, [], [], None, None, []), key)
+        # Objects whose str doesn't identify them can't be keys
+        with self.assertRaises(TypeError):
+            cache_key('r', {'user': object()}, [], [], None, None, [])
+
+    def test_options(self):
+        self.assertIsNone(cache_options(None))
+        self.assertEqual(cache_options(60),
+                         {'ttl': 60, 'tags': (), 'vary': None})
+        self.assertEqual(cache_options({'ttl': 1, 'tags': ['a']})['tags'],
+                         ['a'])
+        for invalid in ['60', {'tags': ['a']}, {'ttl': 1, 'other': 1}]:
+            with self.subTest(option=invalid):
+                with self.assertRaises(ValueError):
+                    cache_options(invalid)
@@ -0,0 +1,111 @@
+import threading
+import time
+import unittest
+
+from flask_kit.simple_router.coalescing import SingleFlight, coalesce_options
+
+
+class TestSingleFlight(unittest.TestCase):
+    def run_concurrently(self, flight, fn, callers=10, timeout=None):
+        results = []
+        errors = []
+
+        def call():
+            try:
+                results.append(flight.do('key', fn, timeout))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_coalesced(self):
+        flight = SingleFlight()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'result'
+
+        results, errors = self.run_concurrently(flight, fn)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(results), [('result', False)] * 9 +
+                         [('result', True)])
+        self.assertEqual(flight.stats(), {
+            'executions': 1,
+            'coalesced': 9,
+            'timeouts': 0,
+            'in_flight': 0,
+        })
+
+    def test_sequential(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do('key', lambda: 1), (1, True))
+        self.assertEqual(flight.do('key', lambda: 2), (2, True))
+        self.assertEqual(flight.do('other', lambda: 3), (3, True))
+        self.assertEqual(flight.stats()['coalesced'], 0)
+
+    def test_error(self):
+        flight = SingleFlight()
+
+        def fn():
+            time.sleep(0.2)
+            raise LookupError('missing')
+
+        results, errors = self.run_concurrently(flight, fn)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 10)
+        self.assertTrue(all(isinstance(e, LookupError) for e in errors))
+        self.assertEqual(flight.stats()['in_flight'], 0)
+
+    def test_timeout(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            if len(calls) == 1:
+                release.wait(5)
+            return len(calls)
+
+        leader = threading.Thread(target=flight.do, args=('key', fn))
+        leader.start()
+        time.sleep(0.05)
+        self.assertEqual(flight.do('key', fn, timeout=0.05), (2, True))
+        release.set()
+        leader.join()
+        self.assertEqual(flight.stats()['timeouts'], 1)
+
+    def test_finished_later(self):
+        flight = SingleFlight()
+        call, leader = flight.join('key')
+        self.assertTrue(leader)
+        joined, leader = flight.join('key')
+        self.assertIs(joined, call)
+        self.assertFalse(leader)
+        self.assertFalse(flight.wait(joined, timeout=0.01))
+
+        threading.Timer(0.05, flight.finish, args=(call, 'result')).start()
+        self.assertTrue(flight.wait(joined, timeout=1))
+        self.assertEqual(joined.result, 'result')
+        self.assertTrue(flight.join('key')[1])
+        self.assertEqual(flight.stats(), {
+            'executions': 2,
+            'coalesced': 1,
+            'timeouts': 1,
+            'in_flight': 1,
+        })
+
+    def test_options(self):
+        self.assertIsNone(coalesce_options(False))
+        self.assertIsNone(coalesce_options(None))
+        self.assertEqual(coalesce_options(True), {'vary': None})
+        with self.assertRaises(ValueError):
+            coalesce_options({'ttl': 1})
@@ -0,0 +1,63 @@
+import datetime
+import unittest
+
+from bson import ObjectId
+
+from flask_kit.simple_router.coercion import coercer
+
+
+class TestCoercer(unittest.TestCase):
+    def test_types(self):
+        oid = ObjectId()
+        values = [
+            ('string', ' a ', ' a '),
+            ('integer', '10', 10),
+            ('float', '10', 10.0),
+            ('number', '10', 10),
+            ('number', '10.5', 10.5),
+            ('boolean', 'True', True),
+            ('boolean', '0', False),
+            ('date', '2018-05-17', datetime.date(2018, 5, 17)),
+            ('datetime', '2018-05-17T10:20:30',
+             datetime.datetime(2018, 5, 17, 10, 20, 30)),
+            ('datetime', '2018-05-17T10:20:30Z',
+             datetime.datetime(2018, 5, 17, 10, 20, 30,
+                               tzinfo=datetime.timezone.utc)),
+            ('objectid', str(oid), oid),
+        ]
+        for kind, value, expected in values:
+            coerced = coercer(kind)(value)
+            self.assertEqual(coerced, expected, kind)
+            self.assertIs(type(coerced), type(expected), kind)
+
+    def test_invalid(self):
+        invalid = [
+            ('integer', '10.5'),
+            ('integer', ''),
+            ('float', 'abc'),
+            ('float', 'nan'),
+            ('number', 'inf'),
+            ('boolean', 'yes'),
+            ('date', '2018-13-01'),
+            ('datetime', 'yesterday'),
+            ('objectid', '123'),
+        ]
+        for kind, value in invalid:
+            with self.assertRaises(ValueError, msg=kind):
+                coercer(kind)(value)
+
+    def test_rules(self):
+        self.assertEqual(coercer({'type': 'integer', 'min': 0})('3'), 3)
+        self.assertEqual(coercer({})('3'), '3')
+        self.assertEqual(
+            coercer({'type': 'list', 'schema': {'type': 'float'}})('3'), 3.0)
+        self.assertEqual(coercer({'type': 'set'})('3'), '3')
+        either = coercer({'type': ['integer', 'boolean']})
+        self.assertEqual(either('3'), 3)
+        self.assertIs(either('true'), True)
+        with self.assertRaises(ValueError):
+            either('x')
+
+    def test_unknown(self):
+        with self.assertRaises(TypeError):
+            coercer('dict')
@@ -0,0 +1,71 @@
+import gzip
+import unittest
+import zlib
+
+import brotli
+
+from flask_kit.compression import (
+    compress,
+    iter_compressed,
+    negotiate_encoding,
+)
+
+
+def decompress(data, encoding):
+    if encoding == 'gzip':
+        return gzip.decompress(data)
+    if encoding == 'deflate':
+        return zlib.decompress(data)
+    return brotli.decompress(data)
+
+
+class TestNegotiation(unittest.TestCase):
+    def test_negotiate(self):
+        cases = [
+            (None, None),
+            ('', None),
+            ('identity', None),
+            ('gzip', 'gzip'),
+            ('deflate', 'deflate'),
+            ('gzip, deflate, br', 'br'),
+            ('gzip;q=1.0, br;q=0.5', 'gzip'),
+            ('deflate, gzip', 'gzip'),
+            ('deflate;q=0.9, gzip;q=0', 'deflate'),
+            ('*', 'br'),
+            ('*;q=0.5, gzip', 'gzip'),
+            ('*, br;q=0', 'gzip'),
+            ('compress, x-unknown', None),
+        ]
+        for header, expected in cases:
+            with self.subTest(header=header):
+                self.assertEqual(negotiate_encoding(header), expected)
+
+
+class TestCompress(unittest.TestCase):
+    data = b'{"some": "json", "values": [1, 2, 3]}' * 100
+
+    def test_roundtrip(self):
+        for encoding in ['gzip', 'deflate', 'br']:
+            with self.subTest(encoding=encoding):
+                compressed = compress(self.data, encoding, level=9)
+                self.assertLess(len(compressed), len(self.data))
+                self.assertEqual(decompress(compressed, encoding), self.data)
+
+    def test_deterministic(self):
+        self.assertEqual(compress(self.data, 'gzip'),
+                         compress(self.data, 'gzip'))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            compress(self.data, 'lzma')
+
+    def test_incremental(self):
+        chunks = ['[', '1, ' * 1000, b'2, ' * 1000, '3]']
+        expected = b''.join(c if isinstance(c, bytes) else c.encode()
+                            for c in chunks)
+        for encoding in ['gzip', 'deflate', 'br']:
+            with self.subTest(encoding=encoding):
+                compressed = list(iter_compressed(chunks, encoding))
+                self.assertGreater(len(compressed), 1)
+                self.assertEqual(decompress(b''.join(compressed), encoding),
+                                 expected)
@@ -0,0 +1,230 @@
+import datetime
+import unittest
+from urllib.parse import parse_qs, urlsplit
+
+from flask_kit.simple_router import QueryError, Selector
+from flask_kit.simple_router.cursor import (
+    Page,
+    decode_cursor,
+    encode_cursor,
+    keyset_filters,
+    keyset_page,
+    with_tiebreaker,
+)
+from flask_kit.simple_router.memory import MemoryCollection
+from tests.utils import FakeRequest
+
+secret = 'cursor-secret'
+
+
+def s(field, direction='asc'):
+    return {'field': field, 'direction': direction}
+
+
+def f(field, op, value):
+    return {'field': field, 'op': op, 'value': value}
+
+
+class TestTokens(unittest.TestCase):
+    sorting = [s('price', 'desc'), s('id')]
+
+    def test_round_trip(self):
+        values = [9.5, datetime.datetime(2020, 1, 2, 3, 4, 5)]
+        token = encode_cursor(values, 'prev', self.sorting, secret)
+        decoded, direction = decode_cursor(token, self.sorting, secret)
+        self.assertEqual(direction, 'prev')
+        self.assertEqual(decoded[0], 9.5)
+        self.assertEqual(decoded[1].replace(tzinfo=None), values[1])
+        self.assertNotIn('=', token)
+
+    def test_tampered(self):
+        token = encode_cursor([1, 2], 'next', self.sorting, secret)
+        payload, signature = token.split('.')
+        other = encode_cursor([1, 3], 'next', self.sorting, secret)
+        for bad in [other.split('.')[0] + '.' + signature,
+                    payload + '.' + signature[:-2],
+                    payload, '', 'a.b.c', '%%%.%%%']:
+            with self.assertRaisesRegex(QueryError, 'Invalid cursor'):
+                decode_cursor(bad, self.sorting, secret)
+        with self.assertRaisesRegex(QueryError, 'Invalid cursor'):
+            decode_cursor(token, self.sorting, 'other-secret')
+
+    def test_other_sorting(self):
+        token = encode_cursor([1, 2], 'next', self.sorting, secret)
+        with self.assertRaisesRegex(QueryError, 'does not match'):
+            decode_cursor(token, [s('price'), s('id')], secret)
+
+
+class TestKeyset(unittest.TestCase):
+    def test_tiebreaker(self):
+        self.assertEqual(with_tiebreaker([s('a')], 'id'), [s('a'), s('id')])
+        self.assertEqual(with_tiebreaker([s('id', 'desc')], 'id'),
+                         [s('id', 'desc')])
+        self.assertEqual(with_tiebreaker([], 'id'), [s('id')])
+
+    def test_filters(self):
+        self.assertEqual(
+            keyset_filters([s('a'), s('b', 'desc'), s('id')], [1, 2, 3]), [
+                [f('a', 'gt', 1)],
+                [f('a', 'eq', 1), f('b', 'lt', 2)],
+                [f('a', 'eq', 1), f('b', 'eq', 2), f('id', 'gt', 3)],
+            ])
+
+    def test_nulls_first(self):
+        sorting = [s('a'), s('id')]
+        self.assertEqual(keyset_filters(sorting, [None, 3], True), [
+            [f('a', 'ne', None)],
+            [f('a', 'eq', None), f('id', 'gt', 3)],
+        ])
+        self.assertEqual(keyset_filters(sorting, [1, 3], True), [
+            [f('a', 'gt', 1)],
+            [f('a', 'eq', 1), f('id', 'gt', 3)],
+        ])
+        sorting = [s('a', 'desc'), s('id')]
+        self.assertEqual(keyset_filters(sorting, [None, 3], True), [
+            [f('a', 'eq', None), f('id', 'gt', 3)],
+        ])
+        self.assertEqual(keyset_filters(sorting, [1, 3], True), [
+            [f('a', 'lt', 1)],
+            [f('a', 'eq', None)],
+            [f('a', 'eq', 1), f('id', 'gt', 3)],
+        ])
+
+    def test_links(self):
+        page = Page([1], next_cursor='n', prev_cursor=None)
+        self.assertEqual(
+            page.links('http://x/items?a=1&offset=10&cursor=old'),
+            '<http://x/items?a=1&cursor=n>; rel="next"')
+        self.assertEqual(Page([]).headers('http://x/items'), {})
+        page = Page([1], next_cursor='n', prev_cursor='p')
+        link = page.headers('/items')['Link']
+        self.assertIn('</items?cursor=p>; rel="prev"', link)
+        self.assertEqual(page.to_dict(),
+                         {'items': [1], 'next': 'n', 'prev': 'p'})
+
+    def test_page(self):
+        items = list(range(10))
+        sorting = [s('id')]
+
+        def fetch(values, order, count):
+            ordered = sorted(items, reverse=order[0]['direction'] == 'desc')
+            if values is not None:
+                ordered = [i for i in ordered if (
+                    i > values[0] if order[0]['direction'] == 'asc'
+                    else i < values[0])]
+            return ordered[:count]
+
+        page = keyset_page(fetch, lambda i: [i], sorting, 4, None, secret)
+        self.assertEqual(page.items, [0, 1, 2, 3])
+        self.assertIsNone(page.prev_cursor)
+        page = keyset_page(fetch, lambda i: [i], sorting, 4,
+                           page.next_cursor, secret)
+        self.assertEqual(page.items, [4, 5, 6, 7])
+        back = keyset_page(fetch, lambda i: [i], sorting, 4,
+                           page.prev_cursor, secret)
+        self.assertEqual(back.items, [0, 1, 2, 3])
+        self.assertIsNone(back.prev_cursor)
+        page = keyset_page(fetch, lambda i: [i], sorting, 4,
+                           page.next_cursor, secret)
+        self.assertEqual(page.items, [8, 9])
+        self.assertIsNone(page.next_cursor)
+
+        page = keyset_page(fetch, lambda i: [i], sorting, None, None, secret)
+        self.assertEqual(page.items, items)
+        self.assertIsNone(page.next_cursor)
+
+        with self.assertRaisesRegex(QueryError, 'at least 1'):
+            keyset_page(fetch, lambda i: [i], sorting, 0, None, secret)
+
+
+def make_items():
+    # Repeated prices, so pages split items with the same sort value
+    return [{'id': i, 'price': (i * 7) % 5, 'kind': 'ab'[i % 2]}
+            for i in range(23)]
+
+
+class TestMemoryPages(unittest.TestCase):
+    def setUp(self):
+        self.collection = MemoryCollection(make_items(), indexes=['kind'])
+
+    def page(self, args, cursor=None):
+        if cursor is not None:
+            args += '&cursor=' + cursor
+        selector = Selector(request_obj=FakeRequest(args=args),
+                            secret=secret)
+        return self.collection.page(selector, only=['kind', 'price'])
+
+    def walk(self, args):
+        pages = [self.page(args)]
+        while pages[-1].next_cursor:
+            pages.append(self.page(args, pages[-1].next_cursor))
+        return pages
+
+    def test_walk(self):
+        for args, key, reverse in [
+                ('limit=5&sort=price:asc', 'price', False),
+                ('limit=4&sort=price:desc', 'price', True),
+                ('limit=6', 'id', False)]:
+            pages = self.walk(args)
+            expected = sorted(make_items(),
+                              key=lambda i: (i[key], i['id']),
+                              reverse=reverse)
+            if reverse:
+                # The tiebreaker is ascending
+                expected.sort(key=lambda i: (-i[key], i['id']))
+            self.assertEqual([i for p in pages for i in p.items], expected)
+            self.assertIsNone(pages[0].prev_cursor)
+
+            # Going back gives the same pages
+            for previous, page in zip(pages, pages[1:]):
+                self.assertEqual(
+                    self.page(args, page.prev_cursor).items, previous.items)
+
+    def test_missing_values(self):
+        items = make_items()
+        for item in items[::3]:
+            del item['price']
+        self.collection = MemoryCollection(items)
+        for direction in ['asc', 'desc']:
+            args = 'limit=4&sort=price:' + direction
+            pages = self.walk(args)
+            ids = [i['id'] for p in pages for i in p.items]
+            present = sorted((i for i in items if 'price' in i),
+                             key=lambda i: (i['price'], i['id']))
+            if direction == 'desc':
+                present.sort(key=lambda i: (-i['price'], i['id']))
+            missing = [i for i in items if 'price' not in i]
+            expected = (present + missing if direction == 'asc'
+                        else missing + present)
+            self.assertEqual(ids, [i['id'] for i in expected])
+            for previous, page in zip(pages, pages[1:]):
+                self.assertEqual(
+                    self.page(args, page.prev_cursor).items, previous.items)
+
+    def test_filtered(self):
+        pages = self.walk('kind=b&price=ge:2&limit=3&sort=price:asc')
+        ids = [i['id'] for p in pages for i in p.items]
+        expected = sorted((i for i in make_items()
+                           if i['kind'] == 'b' and i['price'] >= 2),
+                          key=lambda i: (i['price'], i['id']))
+        self.assertEqual(ids, [i['id'] for i in expected])
+
+    def test_empty_limit(self):
+        with self.assertRaises(QueryError):
+            self.page('limit=0')
+
+    def test_other_sorting(self):
+        page = self.page('limit=5&sort=price:asc')
+        with self.assertRaises(QueryError):
+            self.page('limit=5&sort=price:desc', page.next_cursor)
+
+    def test_links(self):
+        page = self.page('limit=5&sort=price:asc')
+        url = 'http://x/items?sort=price:asc&limit=5&offset=3'
+        link = urlsplit(page.links(url)[1:].split('>')[0])
+        args = {k: v[0] for k, v in parse_qs(link.query).items()}
+        self.assertNotIn('offset', args)
+        self.assertEqual(self.page('limit=5&sort=price:asc',
+                                   args['cursor']).items,
+                         self.page('limit=5&sort=price:asc',
+                                   page.next_cursor).items)
@@ -0,0 +1,97 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import inspect
+import threading
+import time
+import unittest
+
+from flask_kit.simple_router.event_loop import EventLoopBridge
+
+variable = contextvars.ContextVar('variable', default=None)
+
+
+class TestEventLoopBridge(unittest.TestCase):
+    def setUp(self):
+        self.bridge = EventLoopBridge()
+
+    def tearDown(self):
+        self.bridge.stop()
+
+    def test_result(self):
+        async def add(a, b):
+            await asyncio.sleep(0)
+            return a + b
+
+        self.assertEqual(self.bridge.run(add(1, 2)), 3)
+
+    def test_exception(self):
+        async def fail():
+            raise KeyError('nope')
+
+        with self.assertRaises(KeyError):
+            self.bridge.run(fail())
+
+    def test_context(self):
+        async def read():
+            return variable.get()
+
+        variable.set('caller')
+        self.assertEqual(self.bridge.run(read()), 'caller')
+
+    def test_timeout(self):
+        cancelled = threading.Event()
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            self.bridge.run(slow(), timeout=0.05)
+        self.assertTrue(cancelled.wait(1))
+
+    def test_timeout_before_scheduled(self):
+        started = threading.Event()
+
+        async def view():
+            started.set()
+
+        # The loop is busy until after the timeout
+        self.bridge.start()
+        self.bridge.loop.call_soon_threadsafe(time.sleep, 0.2)
+        coroutine = view()
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            self.bridge.run(coroutine, timeout=0.05)
+        self.assertFalse(started.wait(0.4))
+        self.assertEqual(inspect.getcoroutinestate(coroutine),
+                         inspect.CORO_CLOSED)
+
+    def test_shared_by_threads(self):
+        async def wait():
+            await asyncio.sleep(0.1)
+            return threading.current_thread().name
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                self.bridge.run(wait())))
+            for _ in range(20)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertEqual(set(results), {'flask-kit-event-loop'})
+
+    def test_restart(self):
+        async def value():
+            return 1
+
+        self.bridge.run(value())
+        self.bridge.stop()
+        self.assertEqual(self.bridge.run(value()), 1)
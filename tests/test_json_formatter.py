@@ -1,11 +1,39 @@
 import datetime
+import enum
+import io
 import json
 import unittest
-from unittest.mock import MagicMock
+import uuid
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+import cbor2
+import mongoengine
+import msgpack
+from bson import ObjectId
 
 from dateutil import parser as date_parser
 
-from flask_kit.json_formatter import make_response
+from flask_kit.json_formatter import (
+    Encoder,
+    RawJSON,
+    available_binary_formats,
+    available_json_backends,
+    compile_response,
+    get_json_backend,
+    iter_json,
+    json_backends,
+    make_response,
+    pack,
+    project,
+    projection_tree,
+    register_encoder,
+    response_format,
+    set_datetime_mode,
+    set_json_backend,
+    set_raw_json,
+)
+from flask_kit import json_formatter
 
 
 class IsSerializable(object):
@@ -26,6 +54,29 @@ class NotSerializable(object):
     pass
 
 
+class Color(enum.Enum):
+    red = 'red'
+    blue = 2
+
+
+class Money(object):
+    def __init__(self, cents):
+        self.cents = cents
+
+    def to_dict(self):
+        return {'cents': self.cents}
+
+
+class Euro(Money):
+    pass
+
+
+def reset_encoders():
+    json_formatter._encoders.clear()
+    for table in json_formatter._dispatch.values():
+        table.clear()
+
+
 def sec_diff(d1, d2):
     return abs((d1 - d2).total_seconds())
 
@@ -160,3 +211,528 @@ class TestDecorator(ResponseCase):
             dt, datetime.datetime.utcfromtimestamp(date_resp['unix'])
         ), 1, [dt, datetime.datetime.utcfromtimestamp(date_resp['unix'])])
         self.assertIs(date_resp['with_time'], False)
+
+
+class TestBackends(unittest.TestCase):
+    payloads = [
+        {'test': {'test': 1}, 'other': [1, True, 2.2, None, 'text']},
+        [1, -2, 3.5, 0.1, 'a/b', 'ação', '\n\t"quoted"'],
+        {'dict': IsAlsoSerializable(), 'json': IsSerializable()},
+        [IsAlsoSerializable(), IsSerializable()],
+        {'datetime': datetime.datetime(2018, 5, 17, 13, 45, 12, 123456)},
+        {'datetime': datetime.datetime(2018, 5, 17, 13, 45,
+                                       tzinfo=datetime.timezone.utc)},
+        {'date': datetime.date(2018, 5, 17)},
+        {'nested': [{'date': datetime.date(1999, 12, 31)}, [[[]]], {}]},
+        {1: 'int key', 2.5: 'float key'},
+        {'uuid': uuid.UUID(int=42)},
+        {'enum': [Color.red, Color.blue], 'set': {1}, 'bytes': b'\x00ab'},
+        {'object_id': ObjectId('5b4d5a2d3c1a7d0001a2b3c4')},
+        'just a string',
+        12345,
+        [2 ** 64, -2 ** 63 - 1, 2 ** 63 - 1, 1.5, 1e15, 1e-4, -0.0],
+    ]
+
+    # Values written differently by some backends, see
+    # JsonBackend.differences
+    differences = {
+        'float exponents': [1e16, 1e-07, {1e22: 'float key'}],
+        'non-finite floats': [float('nan'), float('inf')],
+        'decimals': {'decimal': Decimal('10.25')},
+        'null and boolean keys': {None: 1, True: 2},
+    }
+
+    def tearDown(self):
+        set_json_backend('json')
+
+    def backends(self):
+        return [b() for b in json_backends if b.available()]
+
+    def expected(self, backend, payload):
+        return json.dumps(payload,
+                          cls=Encoder,
+                          separators=backend.separators,
+                          ensure_ascii=backend.ensure_ascii)
+
+    def test_conformance(self):
+        for backend in self.backends():
+            for payload in self.payloads:
+                with self.subTest(backend=backend.name, payload=payload):
+                    self.assertEqual(backend.dumps(payload, Encoder()),
+                                     self.expected(backend, payload))
+
+    def test_differences(self):
+        # Backends only differ on the values they document
+        for backend in self.backends():
+            for name, payload in self.differences.items():
+                with self.subTest(backend=backend.name, values=name):
+                    same = (backend.dumps(payload, Encoder()) ==
+                            self.expected(backend, payload))
+                    self.assertEqual(same, name not in backend.differences)
+
+    def test_not_serializable(self):
+        for backend in self.backends():
+            with self.subTest(backend=backend.name):
+                with self.assertRaises(TypeError):
+                    backend.dumps(NotSerializable(), Encoder())
+
+    def test_default_is_stdlib(self):
+        payload = {'date': datetime.date(2018, 5, 17), 'a': [1, 2]}
+        resp = make_response(payload)
+        self.assertEqual(resp[0], json.dumps(payload, cls=Encoder))
+
+    def test_make_response_uses_backend(self):
+        for name in available_json_backends():
+            backend = set_json_backend(name)
+            self.assertIs(get_json_backend(), backend)
+            resp = make_response({'a': [1, 2]})
+            self.assertEqual(resp[0], backend.dumps({'a': [1, 2]}, Encoder()))
+
+    def test_auto(self):
+        backend = set_json_backend('auto')
+        self.assertEqual(backend.name, available_json_backends()[0])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            set_json_backend('not_a_backend')
+
+
+class TestEncoderRegistry(unittest.TestCase):
+    def tearDown(self):
+        reset_encoders()
+
+    def encode(self, value):
+        return json.loads(make_response({'value': value})[0])['value']
+
+    def test_builtin_types(self):
+        object_id = ObjectId('5b4d5a2d3c1a7d0001a2b3c4')
+        self.assertEqual(self.encode(Decimal('1.10')), '1.10')
+        self.assertEqual(self.encode(uuid.UUID(int=1)), str(uuid.UUID(int=1)))
+        self.assertEqual(self.encode(Color.blue), 2)
+        self.assertEqual(self.encode(b'abc'), 'YWJj')
+        self.assertEqual(sorted(self.encode({3, 1, 2})), [1, 2, 3])
+        self.assertEqual(self.encode(frozenset(['a'])), ['a'])
+        self.assertEqual(self.encode(object_id), str(object_id))
+
+    def test_register(self):
+        register_encoder(NotSerializable, lambda obj: 'registered')
+        self.assertEqual(self.encode(NotSerializable()), 'registered')
+
+    def test_register_precedence(self):
+        self.assertEqual(self.encode(Money(10)), {'cents': 10})
+        register_encoder(Money, lambda obj: obj.cents)
+        self.assertEqual(self.encode(Money(10)), 10)
+        register_encoder(datetime.date, lambda obj: obj.year)
+        self.assertEqual(self.encode(datetime.date(2018, 1, 1)), 2018)
+        self.assertEqual(self.encode(datetime.datetime(2018, 1, 1)), 2018)
+
+    def test_subclass(self):
+        register_encoder(Money, lambda obj: obj.cents)
+        self.assertEqual(self.encode(Euro(5)), 5)
+        register_encoder(Euro, lambda obj: 'EUR %d' % obj.cents)
+        self.assertEqual(self.encode(Euro(5)), 'EUR 5')
+        self.assertEqual(self.encode(Money(5)), 5)
+
+    def test_dispatch_cache(self):
+        self.encode([Money(1), Money(2)])
+        self.assertIn(Money, json_formatter._dispatch['full'])
+        self.assertNotIn(Euro, json_formatter._dispatch['full'])
+        with self.assertRaises(TypeError):
+            self.encode(NotSerializable())
+        self.assertIsNone(
+            json_formatter._dispatch['full'][NotSerializable])
+
+
+class OddlyFormatted(object):
+    def to_json(self):
+        return '{ "b" :[1 ,2],"a":"\u00e9"}'
+
+
+class TestRawJSON(unittest.TestCase):
+    def setUp(self):
+        set_raw_json(True)
+
+    def tearDown(self):
+        set_raw_json(False)
+        set_json_backend('json')
+        reset_encoders()
+
+    def test_splice(self):
+        resp = make_response(IsSerializable())
+        self.assertEqual(resp[0], IsSerializable.custom)
+        resp = make_response({'x': OddlyFormatted()})
+        self.assertEqual(resp[0], '{"x": %s}' % OddlyFormatted().to_json())
+
+    def test_many(self):
+        payload = [OddlyFormatted(), {'nested': [IsSerializable()]}, 1]
+        expected = '[%s, {"nested": [%s]}, 1]' % (
+            OddlyFormatted().to_json(), IsSerializable.custom)
+        self.assertEqual(make_response(payload)[0], expected)
+
+    def test_backends(self):
+        payload = {'a': [OddlyFormatted(), OddlyFormatted()]}
+        for name in available_json_backends():
+            set_json_backend(name)
+            with self.subTest(backend=name):
+                body = make_response(payload)[0]
+                self.assertEqual(body.count(OddlyFormatted().to_json()), 2)
+                self.assertEqual(json.loads(body), {
+                    'a': [{'b': [1, 2], 'a': 'é'}, {'b': [1, 2], 'a': 'é'}]
+                })
+
+    def test_stdlib_encoder(self):
+        payload = {'x': [OddlyFormatted(), IsSerializable()]}
+        expected = '{"x": [%s, %s]}' % (OddlyFormatted().to_json(),
+                                        IsSerializable.custom)
+        self.assertEqual(json.dumps(payload, cls=Encoder), expected)
+        output = io.StringIO()
+        json.dump(payload, output, cls=Encoder)
+        self.assertEqual(output.getvalue(), expected)
+        self.assertEqual(json.dumps(IsSerializable(), cls=Encoder),
+                         IsSerializable.custom)
+
+    def test_disabled(self):
+        set_raw_json(False)
+        body = make_response({'x': OddlyFormatted()})[0]
+        self.assertEqual(body, '{"x": {"b": [1, 2], "a": "\\u00e9"}}')
+
+    def test_registered(self):
+        register_encoder(NotSerializable, lambda obj: RawJSON('[1,2]'))
+        self.assertEqual(make_response([NotSerializable()])[0], '[[1,2]]')
+
+    def test_validate(self):
+        register_encoder(NotSerializable, lambda obj: RawJSON('{nope'))
+        self.assertEqual(make_response([NotSerializable()])[0], '[{nope]')
+        set_raw_json(True, validate=True)
+        with self.assertRaises(ValueError):
+            make_response([NotSerializable()])
+        self.assertEqual(make_response([OddlyFormatted()])[0],
+                         '[%s]' % OddlyFormatted().to_json())
+
+
+class TestDatetimeModes(unittest.TestCase):
+    dt = datetime.datetime(2018, 5, 17, 13, 45, 12, 123456)
+    aware = datetime.datetime(2018, 5, 17, 13, 45, 12,
+                              tzinfo=datetime.timezone(
+                                  datetime.timedelta(hours=-3)))
+    date = datetime.date(2018, 5, 17)
+
+    def tearDown(self):
+        set_datetime_mode('full')
+
+    def encode(self, value, mode=None):
+        body = make_response({'value': value}, datetime_mode=mode)[0]
+        return json.loads(body)['value']
+
+    def test_full(self):
+        self.assertEqual(self.encode(self.dt), {
+            'with_time': True,
+            'iso': '2018-05-17T13:45:12.123456',
+            'unix': 1526564712.123456,
+            'tuple': [2018, 5, 17, 13, 45, 12],
+            'tz': None,
+        })
+        self.assertEqual(self.encode(self.date), {
+            'with_time': False,
+            'iso': '2018-05-17T00:00:00',
+            'unix': 1526515200.0,
+            'tuple': [2018, 5, 17, 0, 0, 0],
+            'tz': None,
+        })
+        self.assertEqual(self.encode(self.aware)['tz'], 'UTC-03:00')
+
+    def test_modes(self):
+        cases = [
+            ('iso', self.dt, '2018-05-17T13:45:12.123456'),
+            ('iso', self.date, '2018-05-17T00:00:00'),
+            ('iso', self.aware, '2018-05-17T13:45:12-03:00'),
+            ('unix', self.dt, 1526564712.123456),
+            ('unix', self.date, 1526515200.0),
+            ('epoch_millis', self.dt, 1526564712123),
+            ('epoch_millis', self.date, 1526515200000),
+            ('epoch_millis', datetime.datetime(1969, 12, 31, 23, 59, 59,
+                                               999999), -1),
+            # 13:45:12-03:00 is 16:45:12 UTC
+            ('unix', self.aware, 1526575512.0),
+            ('epoch_millis', self.aware, 1526575512000),
+        ]
+        for mode, value, expected in cases:
+            with self.subTest(mode=mode, value=value):
+                self.assertEqual(self.encode(value, mode), expected)
+
+    def test_default_mode(self):
+        set_datetime_mode('epoch_millis')
+        self.assertEqual(self.encode(self.date), 1526515200000)
+        self.assertEqual(self.encode(self.date, 'iso'), '2018-05-17T00:00:00')
+        with self.assertRaises(ValueError):
+            set_datetime_mode('invalid')
+        with self.assertRaises(ValueError):
+            self.encode(self.date, 'invalid')
+
+    def test_cached_values(self):
+        first = datetime.datetime(2018, 1, 1, 12)
+        same = datetime.datetime(2018, 1, 1, 12)
+        self.assertEqual(self.encode([first, same], 'iso'),
+                         ['2018-01-01T12:00:00', '2018-01-01T12:00:00'])
+
+        # equal instants on different timezones must not share an encoding
+        utc = datetime.datetime(2018, 1, 1, 12, tzinfo=datetime.timezone.utc)
+        other = utc.astimezone(datetime.timezone(datetime.timedelta(hours=2)))
+        self.assertEqual(utc, other)
+        self.assertEqual(self.encode([utc, other], 'iso'),
+                         ['2018-01-01T12:00:00+00:00',
+                          '2018-01-01T14:00:00+02:00'])
+
+    def test_shared_values(self):
+        # Encoded values are cached, callers can't alter the cached ones
+        value = json_formatter.encode_datetime(self.dt, True)
+        value['iso'] = 'changed'
+        self.assertEqual(json_formatter.encode_datetime(self.dt, True)['iso'],
+                         '2018-05-17T13:45:12.123456')
+        self.assertEqual(self.encode(self.dt)['iso'],
+                         '2018-05-17T13:45:12.123456')
+
+    def test_no_output(self):
+        with patch('builtins.print') as mock_print:
+            make_response({'date': self.date, 'datetime': self.dt})
+        mock_print.assert_not_called()
+
+
+class TestBinaryFormats(unittest.TestCase):
+    loads = {
+        'msgpack': lambda data: msgpack.unpackb(data, strict_map_key=False),
+        'cbor': cbor2.loads,
+    }
+    mimes = {'msgpack': 'application/msgpack', 'cbor': 'application/cbor'}
+
+    def tearDown(self):
+        reset_encoders()
+
+    def test_negotiation(self):
+        cases = [
+            (None, 'json'),
+            ('', 'json'),
+            ('*/*', 'json'),
+            ('text/html', 'json'),
+            ('application/msgpack', 'msgpack'),
+            ('application/x-msgpack', 'msgpack'),
+            ('application/cbor', 'cbor'),
+            ('application/json, application/cbor', 'json'),
+            ('application/json;q=0.5, application/cbor', 'cbor'),
+            ('application/cbor;q=0, application/msgpack;q=0.1', 'msgpack'),
+        ]
+        for accept, expected in cases:
+            with self.subTest(accept=accept):
+                self.assertEqual(response_format(accept), expected)
+
+    def test_unavailable(self):
+        with patch.object(json_formatter, 'msgpack', None):
+            self.assertEqual(response_format('application/msgpack'), 'json')
+            self.assertEqual(available_binary_formats(), ['cbor'])
+            with self.assertRaises(ValueError):
+                pack({}, 'msgpack')
+
+    def test_make_response(self):
+        payload = {'a': [1, 2.5, None, True, 'text'], 'b': {'c': {}}}
+        for name, mime in self.mimes.items():
+            with self.subTest(format=name):
+                body, status, headers = make_response(payload, accept=mime)
+                self.assertIsInstance(body, bytes)
+                self.assertEqual(status, 200)
+                self.assertEqual(headers['Content-Type'], mime)
+                self.assertEqual(headers['Vary'], 'Accept')
+                self.assertEqual(self.loads[name](body), payload)
+
+    def test_json_default(self):
+        body, _, headers = make_response({'a': 1}, accept='text/html')
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(body), {'a': 1})
+        self.assertEqual(make_response('text', accept='application/cbor'),
+                         ('text', 200, {'Content-Type': 'text/plain'}))
+
+    def test_hooks(self):
+        register_encoder(NotSerializable, lambda obj: 'registered')
+        date = datetime.date(2018, 5, 17)
+        payload = {
+            'dict': IsAlsoSerializable(),
+            'json': IsSerializable(),
+            'date': date,
+            'datetime': datetime.datetime(2018, 5, 17, 13, 45),
+            'decimal': Decimal('1.5'),
+            'uuid': uuid.UUID(int=1),
+            'enum': Color.red,
+            'set': {1},
+            'registered': NotSerializable(),
+        }
+        expected = json.loads(json.dumps(payload, cls=Encoder))
+        for name in self.mimes:
+            with self.subTest(format=name):
+                self.assertEqual(self.loads[name](pack(payload, name)),
+                                 expected)
+                self.assertEqual(
+                    self.loads[name](pack([date], name, 'epoch_millis')),
+                    [1526515200000])
+
+    def test_bytes(self):
+        for name in self.mimes:
+            with self.subTest(format=name):
+                self.assertEqual(self.loads[name](pack([b'\x00'], name)),
+                                 [b'\x00'])
+
+    def test_not_serializable(self):
+        for name in self.mimes:
+            with self.subTest(format=name):
+                with self.assertRaises(Exception):
+                    pack(NotSerializable(), name)
+
+
+class TestCompiledResponse(unittest.TestCase):
+    responses = [
+        None,
+        '',
+        'text',
+        {},
+        [],
+        {'a': [1, 2]},
+        [{'a': 1}],
+        False,
+        IsSerializable(),
+        ('', 123),
+        ({'a': 1}, 201),
+        ({'a': 1}, 200, {'X-My-Header': 'Foobar'}),
+        (None, None, {'Vary': 'Origin'}),
+    ]
+    accepts = [None, '', '*/*', 'application/msgpack', 'application/cbor']
+
+    def test_generic_equivalence(self):
+        respond = compile_response()
+        for resp in self.responses:
+            for accept in self.accepts:
+                with self.subTest(resp=resp, accept=accept):
+                    self.assertEqual(respond(resp, accept),
+                                     make_response(resp, accept=accept))
+
+    def test_traits_equivalence(self):
+        traits = {'status': 201, 'headers': {'Vary': 'Origin', 'X-A': 'a'}}
+        respond = compile_response(**traits)
+        for resp in self.responses:
+            for accept in self.accepts:
+                with self.subTest(resp=resp, accept=accept):
+                    self.assertEqual(
+                        respond(resp, accept),
+                        make_response(resp, accept=accept, **traits))
+
+    def test_status(self):
+        respond = compile_response(status=201)
+        self.assertEqual(respond({'a': 1})[1], 201)
+        self.assertEqual(respond(None), ('', 201, {'Content-Type':
+                                                   'text/plain'}))
+        self.assertEqual(respond(({'a': 1}, 202))[1], 202)
+
+    def test_headers(self):
+        respond = compile_response(headers={'X-A': 'a', 'X-B': 'b'})
+        headers = respond(({}, 200, {'X-B': 'view'}))[2]
+        self.assertEqual(headers['X-A'], 'a')
+        self.assertEqual(headers['X-B'], 'view')
+        self.assertEqual(respond({}, '')[2], {
+            'Content-Type': 'application/json',
+            'Vary': 'Accept',
+            'X-A': 'a',
+            'X-B': 'b',
+        })
+
+    def test_headers_are_copied(self):
+        respond = compile_response(headers={'X-A': 'a'})
+        respond({})[2]['X-A'] = 'changed'
+        self.assertEqual(respond({})[2]['X-A'], 'a')
+
+    def test_json_only(self):
+        respond = compile_response(json_only=True)
+        for accept in self.accepts:
+            with self.subTest(accept=accept):
+                body, status, headers = respond({'a': 1}, accept)
+                self.assertEqual(body, '{"a": 1}')
+                self.assertEqual(headers, {'Content-Type': 'application/json'})
+        self.assertEqual(respond(({'a': 1}, 201), 'application/cbor'),
+                         ('{"a": 1}', 201,
+                          {'Content-Type': 'application/json'}))
+
+    def test_datetime_mode(self):
+        respond = compile_response(datetime_mode='iso')
+        body = respond({'date': datetime.date(2018, 5, 17)})[0]
+        self.assertEqual(body, '{"date": "2018-05-17T00:00:00"}')
+
+
+class Costly(object):
+    """ Fails the test if it's encoded """
+
+    def to_dict(self):
+        raise AssertionError('Encoded a field that was not selected')
+
+
+class Product(object):
+    def __init__(self, name):
+        self.name = name
+
+    def to_dict(self):
+        return {'name': self.name, 'size': {'w': 1, 'h': 2},
+                'extra': Costly()}
+
+
+class Item(mongoengine.Document):
+    name = mongoengine.StringField()
+    price = mongoengine.FloatField()
+
+
+class TestProjection(unittest.TestCase):
+    def test_tree(self):
+        self.assertEqual(projection_tree(('a', 'b.c', 'b.d')),
+                         {'a': None, 'b': {'c': None, 'd': None}})
+        self.assertEqual(projection_tree(('b.c', 'b')), {'b': None})
+        self.assertEqual(projection_tree(('b', 'b.c')), {'b': None})
+
+    def test_project(self):
+        body = [Product('tv'), {'name': 'radio', 'size': [{'w': 3, 'h': 4}],
+                                'price': 1}]
+        self.assertEqual(project(body, ['name', 'size.w']), [
+            {'name': 'tv', 'size': {'w': 1}},
+            {'name': 'radio', 'size': [{'w': 3}]},
+        ])
+        self.assertEqual(project({'a': 1, 'b': 2}, ['c']), {})
+        self.assertEqual(project({'a': 'text'}, ['a.b']), {'a': 'text'})
+
+    def test_raw_json(self):
+        self.assertEqual(project(RawJSON('{"a": 1, "b": 2}'), ['a']),
+                         {'a': 1})
+        self.assertEqual(project({'a': IsSerializable(), 'b': 1},
+                                 ['a.custom_serialization']),
+                         {'a': IsAlsoSerializable.custom})
+        items = [Item(name='tv', price=10.5), Item(name='radio', price=2)]
+        self.assertEqual(json.loads(make_response(items, fields=['name'])[0]),
+                         [{'name': 'tv'}, {'name': 'radio'}])
+
+    def test_datetime_mode(self):
+        body = {'date': datetime.date(2018, 5, 17), 'other': 1}
+        self.assertEqual(project(body, ['date'], 'iso'),
+                         {'date': datetime.date(2018, 5, 17)})
+        self.assertEqual(project(datetime.date(2018, 5, 17), ['a'], 'iso'),
+                         '2018-05-17T00:00:00')
+
+    def test_responses(self):
+        body = {'name': 'tv', 'extra': Costly()}
+        self.assertEqual(make_response(body, fields=['name'])[0],
+                         '{"name": "tv"}')
+        self.assertEqual(make_response((body, 201), fields=['name'])[:2],
+                         ('{"name": "tv"}', 201))
+        self.assertEqual(make_response('text', fields=['name'])[0], 'text')
+        respond = compile_response()
+        self.assertEqual(respond([body], fields=['name'])[0],
+                         '[{"name": "tv"}]')
+        self.assertEqual(respond(([body], 201), fields=['name'])[:2],
+                         ('[{"name": "tv"}]', 201))
+        packed = respond(body, 'application/msgpack', fields=['name'])[0]
+        self.assertEqual(msgpack.unpackb(packed), {'name': 'tv'})
+        chunks = iter_json(iter([body, Product('radio')]), ndjson=True,
+                           fields=['name'])
+        self.assertEqual(''.join(chunks),
+                         '{"name": "tv"}\n{"name": "radio"}\n')
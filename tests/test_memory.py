@@ -0,0 +1,222 @@
+import datetime
+import random
+import unittest
+from decimal import Decimal
+
+from flask_kit.simple_router import Selector
+from flask_kit.simple_router.memory import (
+    MemoryCollection,
+    compile_filters,
+    field_getter,
+    query,
+)
+from tests.utils import FakeRequest
+
+
+class Thing(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def make_items(count=200, seed=1):
+    rng = random.Random(seed)
+    return [{
+        'id': i,
+        'price': round(rng.uniform(0, 100), 2),
+        'stock': rng.randint(0, 5),
+        'category': rng.choice(['audio', 'video', 'misc']),
+        'active': rng.random() > 0.3,
+        'size': {'width': rng.randint(1, 10)} if i % 7 else None,
+    } for i in range(count)]
+
+
+def f(field, op, value):
+    return {'field': field, 'op': op, 'value': value}
+
+
+def s(field, direction='asc'):
+    return {'field': field, 'direction': direction}
+
+
+class TestFieldGetter(unittest.TestCase):
+    def test_paths(self):
+        item = {'a': {'b': Thing(c=1)}, 'd': 2}
+        self.assertEqual(field_getter('d')(item), 2)
+        self.assertEqual(field_getter('a.b.c')(item), 1)
+        self.assertIsNone(field_getter('a.x.c')(item))
+        self.assertIsNone(field_getter('x')(item))
+        self.assertEqual(field_getter('c')(Thing(c=3)), 3)
+
+
+class TestFilters(unittest.TestCase):
+    def ids(self, filters, items=None):
+        items = items or [{'id': i, 'n': i, 's': str(i), 'f': i / 2,
+                           'b': i % 2 == 0} for i in range(6)]
+        return [item['id'] for item in query(items, filters)]
+
+    def test_operators(self):
+        self.assertEqual(self.ids([f('n', 'eq', '2')]), [2])
+        self.assertEqual(self.ids([f('n', 'ne', '2')]), [0, 1, 3, 4, 5])
+        self.assertEqual(self.ids([f('n', 'lt', '2')]), [0, 1])
+        self.assertEqual(self.ids([f('n', 'le', '2')]), [0, 1, 2])
+        self.assertEqual(self.ids([f('n', 'gt', '3')]), [4, 5])
+        self.assertEqual(self.ids([f('n', 'ge', '3')]), [3, 4, 5])
+        self.assertEqual(self.ids([f('n', 'in', ['1', '3'])]), [1, 3])
+        self.assertEqual(self.ids([f('n', 'nin', ['1', '3'])]), [0, 2, 4, 5])
+        self.assertEqual(self.ids([f('n', 'gt', '1'), f('n', 'lt', '4')]),
+                         [2, 3])
+
+    def test_not(self):
+        self.assertEqual(self.ids([f('n', 'not', 'gt:1')]), [0, 1])
+        self.assertEqual(self.ids([f('n', 'not', 'in:0,1,2')]), [3, 4, 5])
+        self.assertEqual(self.ids([f('n', 'not', '1')]), [0, 2, 3, 4, 5])
+
+    def test_conversion(self):
+        self.assertEqual(self.ids([f('s', 'gt', '3')]), [4, 5])
+        self.assertEqual(self.ids([f('f', 'eq', '1.5')]), [3])
+        self.assertEqual(self.ids([f('b', 'eq', 'true')]), [0, 2, 4])
+        self.assertEqual(self.ids([f('n', 'eq', 'abc')]), [])
+        self.assertEqual(self.ids([f('n', 'gt', 'abc')]), [])
+
+    def test_conversion_types(self):
+        class Tracked(object):
+            created = []
+
+            def __init__(self, value):
+                self.created.append(value)
+
+        items = [
+            {'id': 0, 'd': Decimal('1.5'), 'l': ['a', 'b', 'c'],
+             't': Tracked(None), 'day': datetime.date(2018, 5, 17),
+             'at': datetime.datetime(2018, 5, 17, 10, 20)},
+        ]
+        Tracked.created.clear()
+        self.assertEqual(self.ids([f('d', 'eq', '1.50')], items), [0])
+        self.assertEqual(self.ids([f('d', 'eq', 'x')], items), [])
+        self.assertEqual(self.ids([f('day', 'eq', '2018-05-17')], items),
+                         [0])
+        self.assertEqual(self.ids([f('at', 'lt', '2018-05-17T11:00')],
+                                  items), [0])
+        # Only scalar types get query string values
+        self.assertEqual(self.ids([f('l', 'eq', 'abc')], items), [])
+        self.assertEqual(self.ids([f('t', 'eq', 'abc')], items), [])
+        self.assertEqual(Tracked.created, [])
+
+    def test_missing(self):
+        items = [{'id': 0, 'n': 1}, {'id': 1}, {'id': 2, 'n': None}]
+        self.assertEqual(self.ids([f('n', 'eq', '1')], items), [0])
+        self.assertEqual(self.ids([f('n', 'ne', '1')], items), [1, 2])
+        self.assertEqual(self.ids([f('n', 'gt', '0')], items), [0])
+        self.assertEqual(self.ids([f('n', 'nin', ['1'])], items), [1, 2])
+
+    def test_no_filters(self):
+        self.assertIsNone(compile_filters([]))
+
+
+class TestSortAndPages(unittest.TestCase):
+    def setUp(self):
+        self.items = make_items()
+
+    def expected(self, items, sorting, limit=None, offset=None):
+        for descriptor in reversed(sorting):
+            desc = descriptor['direction'] == 'desc'
+            present = [i for i in items
+                       if field_getter(descriptor['field'])(i) is not None]
+            missing = [i for i in items
+                       if field_getter(descriptor['field'])(i) is None]
+            present.sort(key=field_getter(descriptor['field']), reverse=desc)
+            items = missing + present if desc else present + missing
+        start = offset or 0
+        return items[start:None if limit is None else start + limit]
+
+    def test_sort(self):
+        cases = [
+            [s('price')],
+            [s('price', 'desc')],
+            [s('category'), s('price', 'desc')],
+            [s('stock', 'desc'), s('id')],
+            [s('size.width'), s('id', 'desc')],
+        ]
+        for sorting in cases:
+            for limit, offset in [(None, None), (10, None), (5, 17),
+                                  (None, 190), (0, 3)]:
+                with self.subTest(sorting=sorting, limit=limit,
+                                  offset=offset):
+                    self.assertEqual(
+                        list(query(self.items, (), sorting, limit, offset)),
+                        self.expected(self.items, sorting, limit, offset))
+
+    def test_lazy(self):
+        consumed = []
+
+        def items():
+            for item in self.items:
+                consumed.append(item)
+                yield item
+
+        page = query(items(), [f('stock', 'ge', '1')], limit=3)
+        self.assertEqual(consumed, [])
+        self.assertEqual(len(list(page)), 3)
+        self.assertLess(len(consumed), 10)
+
+
+class TestMemoryCollection(unittest.TestCase):
+    def test_indexes(self):
+        items = make_items(500)
+        indexed = MemoryCollection(items, indexes=['category', 'stock',
+                                                   'active', 'size.width'])
+        plain = MemoryCollection(items)
+        rng = random.Random(2)
+        for _ in range(200):
+            filters = []
+            if rng.random() > 0.3:
+                filters.append(rng.choice([
+                    f('category', 'eq', 'audio'),
+                    f('category', 'in', ['video', 'misc']),
+                ]))
+            if rng.random() > 0.3:
+                filters.append(f('stock', 'in',
+                                 rng.sample(['0', '1', '2', '3', 'x'], 2)))
+            if rng.random() > 0.5:
+                filters.append(f('active', 'eq', rng.choice(['true', '0'])))
+            if rng.random() > 0.5:
+                filters.append(f('size.width', 'eq', str(rng.randint(1, 10))))
+            if rng.random() > 0.5:
+                filters.append(f('price', 'lt', str(rng.randint(0, 100))))
+            sorting = [s('price', rng.choice(['asc', 'desc']))]
+            with self.subTest(filters=filters):
+                self.assertEqual(
+                    list(indexed.query(filters, sorting, 20, 5)),
+                    list(plain.query(filters, sorting, 20, 5)))
+
+    def test_index_types(self):
+        items = [{'id': 0, 'v': 1}, {'id': 1, 'v': True}, {'id': 2, 'v': '1'},
+                 {'id': 3, 'v': 1.0}, {'id': 4}]
+        collection = MemoryCollection(items, indexes=['v'])
+        ids = [i['id'] for i in collection.query([f('v', 'eq', 'true')])]
+        self.assertEqual(ids, [1])
+        ids = [i['id'] for i in collection.query([f('v', 'eq', '1')])]
+        self.assertEqual(ids, [0, 1, 2, 3])
+        self.assertEqual(len(collection), 5)
+
+    def test_typed_values(self):
+        items = [{'id': i, 'n': i} for i in range(4)]
+        # Typed values are compared as they are, not truncated to int
+        self.assertEqual([i['id'] for i in query(items, [f('n', 'ge', 1.5)])],
+                         [2, 3])
+        self.assertEqual([i['id'] for i in query(
+            items, [f('n', 'not', {'op': 'in', 'value': [1, 2.0]})])], [0, 3])
+        collection = MemoryCollection(items, indexes=['n'])
+        self.assertEqual([i['id'] for i in collection.query(
+            [f('n', 'in', [2.0, 2.5])])], [2])
+
+    def test_select(self):
+        collection = MemoryCollection(make_items(), indexes=['category'])
+        request = FakeRequest(args='category=in:audio,video&stock=gt:2'
+                                   '&size=1&sort=price:desc&limit=5&offset=2')
+        page = collection.select(Selector(request_obj=request),
+                                 only=['category', 'stock', 'price'])
+        expected = [i for i in make_items()
+                    if i['category'] in ('audio', 'video') and i['stock'] > 2]
+        expected.sort(key=lambda i: i['price'], reverse=True)
+        self.assertEqual(page, expected[2:7])
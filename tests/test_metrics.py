@@ -0,0 +1,85 @@
+import threading
+import unittest
+
+from flask_kit.simple_router.metrics import RouteMetrics, mark
+
+
+class TestRouteMetrics(unittest.TestCase):
+    def test_observe(self):
+        metrics = RouteMetrics(buckets=(0.1, 1.0))
+        for seconds in [0.05, 0.1, 0.5, 2.0]:
+            metrics.observe('items', 'view', seconds)
+        histogram = metrics.snapshot()['items']['view']
+        self.assertEqual(histogram['count'], 4)
+        self.assertAlmostEqual(histogram['sum'], 2.65)
+        self.assertEqual(histogram['buckets'],
+                         [(0.1, 2), (1.0, 3), (float('inf'), 4)])
+
+    def test_threads(self):
+        metrics = RouteMetrics()
+
+        def record():
+            for _ in range(1000):
+                metrics.observe('items', 'view', 0.001)
+
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics.snapshot()['items']['view']['count'], 8000)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test_ended_threads(self):
+        metrics = RouteMetrics()
+        metrics.observe('items', 'view', 0.001)
+        for _ in range(50):
+            thread = threading.Thread(
+                target=metrics.observe, args=('items', 'view', 0.001))
+            thread.start()
+            thread.join()
+        # The shards of the threads that ended are folded into one total
+        self.assertEqual(len(metrics._shards), 1)
+        self.assertEqual(metrics.snapshot()['items']['view']['count'], 51)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test_timer(self):
+        metrics = RouteMetrics()
+        mark('ignored')
+        timer = metrics.start('items')
+        mark('parse')
+        mark('view')
+        metrics.finish(timer)
+        mark('ignored')
+        self.assertEqual(sorted(metrics.snapshot()['items']),
+                         ['parse', 'total', 'view'])
+
+    def test_sampling(self):
+        metrics = RouteMetrics(sample_rate=0)
+        self.assertIsNone(metrics.start('items'))
+        metrics = RouteMetrics(sample_rate=0.5)
+        sampled = [metrics.start('items') for _ in range(1000)]
+        timers = [timer for timer in sampled if timer is not None]
+        self.assertTrue(300 < len(timers) < 700)
+        for timer in reversed(timers):
+            metrics.finish(timer)
+
+    def test_prometheus(self):
+        metrics = RouteMetrics(sample_rate=0.5, buckets=(0.1,))
+        metrics.observe('bp_"items"', 'view', 0.05)
+        text = metrics.prometheus()
+        labels = 'endpoint="bp_\\"items\\"",phase="view"'
+        self.assertIn('# TYPE flask_kit_request_phase_seconds histogram\n',
+                      text)
+        self.assertIn('flask_kit_request_phase_seconds_bucket{%s,le="0.1"} 1'
+                      % labels, text)
+        self.assertIn('flask_kit_request_phase_seconds_bucket{%s,le="+Inf"} 1'
+                      % labels, text)
+        self.assertIn('flask_kit_request_phase_seconds_sum{%s} 0.05'
+                      % labels, text)
+        self.assertIn('flask_kit_request_phase_seconds_count{%s} 1' % labels,
+                      text)
+        self.assertTrue(text.endswith(
+            'flask_kit_request_phase_seconds_sample_rate 0.5\n'))
@@ -0,0 +1,297 @@
+import unittest
+
+import mongoengine
+import mongomock
+import pymongo
+
+from flask_kit.simple_router import QueryError, Selector
+from flask_kit.simple_router.mongo import (
+    MongoQuery,
+    covering_fields,
+    mongo_filter,
+    mongo_sort,
+    mongoengine_order,
+)
+from tests.utils import FakeRequest
+
+
+class Product(mongoengine.Document):
+    name = mongoengine.StringField()
+    category = mongoengine.StringField()
+    price = mongoengine.FloatField()
+    stock = mongoengine.IntField()
+
+
+products = [
+    {'name': 'tv', 'category': 'video', 'price': 500.0, 'stock': 3},
+    {'name': 'radio', 'category': 'audio', 'price': 50.0, 'stock': 0},
+    {'name': 'speaker', 'category': 'audio', 'price': 120.0, 'stock': 10},
+    {'name': 'cable', 'category': 'misc', 'price': 5.0, 'stock': 100},
+    {'name': 'projector', 'category': 'video', 'price': 900.0, 'stock': 1},
+]
+
+
+def mongo_query(args, **kwargs):
+    return MongoQuery(Selector(request_obj=FakeRequest(args=args),
+                               secret='secret'), **kwargs)
+
+
+def walk(page, args, **kwargs):
+    """ The names of the pages of args, following the next cursors """
+    pages = [page(mongo_query(args, **kwargs))]
+    while pages[-1].next_cursor:
+        query = mongo_query(args + '&cursor=' + pages[-1].next_cursor,
+                            **kwargs)
+        pages.append(page(query))
+    return pages
+
+
+class TestTranslation(unittest.TestCase):
+    def filters(self, args):
+        return mongo_filter(Selector(request_obj=FakeRequest(args=args))
+                            .filter())
+
+    def test_operators(self):
+        self.assertEqual(self.filters(''), {})
+        self.assertEqual(self.filters('a=1&b=ne:2&c=in:x,y&d=nin:z'), {
+            'a': {'$eq': '1'},
+            'b': {'$ne': '2'},
+            'c': {'$in': ['x', 'y']},
+            'd': {'$nin': ['z']},
+        })
+        self.assertEqual(self.filters('a=gt:1&a=le:5&b=lt:2&b=ge:0'), {
+            'a': {'$gt': '1', '$lte': '5'},
+            'b': {'$lt': '2', '$gte': '0'},
+        })
+
+    def test_not(self):
+        self.assertEqual(self.filters('a=not:gt:1&b=not:in:x,y&c=not:z'), {
+            'a': {'$not': {'$gt': '1'}},
+            'b': {'$not': {'$in': ['x', 'y']}},
+            'c': {'$not': {'$eq': 'z'}},
+        })
+
+    def test_repeated(self):
+        self.assertEqual(self.filters('a=ne:1&a=ne:2'), {
+            '$and': [{'a': {'$ne': '1'}}, {'a': {'$ne': '2'}}],
+        })
+
+    def test_reserved(self):
+        self.assertEqual(self.filters('a=1&sort=a&limit=2&offset=1'),
+                         {'a': {'$eq': '1'}})
+
+    def test_sort(self):
+        sorting = Selector(request_obj=FakeRequest(
+            args='sort=a:asc,b,c.d:desc')).sort()
+        self.assertEqual(mongo_sort(sorting), [
+            ('a', pymongo.ASCENDING),
+            ('b', pymongo.DESCENDING),
+            ('c.d', pymongo.DESCENDING),
+        ])
+        self.assertEqual(mongoengine_order(sorting), ['+a', '-b', '-c__d'])
+
+    def test_whitelist(self):
+        query = mongo_query('a=1&b=2&sort=a:asc,b:asc', only=['a'],
+                            mapping={'a': 'x.a'})
+        self.assertEqual(query.query(), {'x.a': {'$eq': '1'}})
+        self.assertEqual(query.sort(), [('x.a', pymongo.ASCENDING)])
+        query = mongo_query('a=1&sort=b:asc', only=['a'], sort_only=['b'])
+        self.assertEqual(query.sort(), [('b', pymongo.ASCENDING)])
+
+    def test_find_args(self):
+        self.assertEqual(mongo_query('').find_args(), {'filter': {}})
+        self.assertEqual(mongo_query('a=1&limit=2&offset=3').find_args(), {
+            'filter': {'a': {'$eq': '1'}}, 'skip': 3, 'limit': 2})
+
+    def test_injection(self):
+        for args in ['$where=1', 'a.$ne=1', '__raw__=1', 'a__ne=1',
+                     'sort=$natural:asc', 'fields=a,$where']:
+            with self.subTest(args=args):
+                with self.assertRaises(QueryError):
+                    mongo_query(args).find_args()
+        for args in ['$where=1', '__raw__=1', 'a__ne=1']:
+            with self.subTest(args=args):
+                with self.assertRaises(QueryError):
+                    mongo_query(args).q()
+        with self.assertRaises(QueryError):
+            mongoengine_order(mongo_query('sort=a__b:asc').sorting)
+        # Whitelisted keys mapped to such fields are refused too
+        query = mongo_query('a=1', only=['a'], mapping={'a': '$where'})
+        with self.assertRaises(QueryError):
+            query.query()
+
+    def test_projection(self):
+        self.assertEqual(covering_fields(['a.b', 'c', 'a', 'c', 'd.e.f',
+                                          'd.e']), ['c', 'a', 'd.e'])
+        query = mongo_query('fields=name,dims.w,secret&a=1',
+                            fields_only=['name', 'dims'],
+                            mapping={'name': 'title'})
+        self.assertEqual(query.projection(), {'title': 1, 'dims.w': 1})
+        self.assertEqual(query.find_args(), {
+            'filter': {'a': {'$eq': '1'}},
+            'projection': {'title': 1, 'dims.w': 1},
+        })
+        self.assertIsNone(mongo_query('').projection())
+
+
+class TestPymongo(unittest.TestCase):
+    def setUp(self):
+        self.collection = mongomock.MongoClient().db.products
+        self.collection.insert_many([dict(p) for p in products])
+
+    def names(self, args, **kwargs):
+        cursor = self.collection.find(**mongo_query(args, **kwargs)
+                                      .find_args())
+        return [doc['name'] for doc in cursor]
+
+    def test_find(self):
+        self.assertEqual(self.names('category=audio&sort=name:asc'),
+                         ['radio', 'speaker'])
+        self.assertEqual(
+            self.names('category=not:in:audio,misc&sort=name:asc'),
+            ['projector', 'tv'])
+        self.assertEqual(self.names('name=not:tv&category=video'),
+                         ['projector'])
+
+    def test_pagination(self):
+        self.assertEqual(self.names('sort=name:asc&offset=1&limit=2'),
+                         ['projector', 'radio'])
+        self.assertEqual(self.names('limit=0'), [])
+
+    def test_only(self):
+        self.assertEqual(
+            sorted(self.names('category=audio&name=tv', only=['category'])),
+            ['radio', 'speaker'])
+
+    def test_types(self):
+        # Strings never match numbers
+        self.assertEqual(self.names('price=gt:100'), [])
+        self.assertEqual(
+            self.names('price=gt:100&stock=not:in:3,4&sort=price:asc',
+                       types={'price': 'float', 'stock': 'integer'}),
+            ['speaker', 'projector'])
+        query = mongo_query('_id=' + str(self.collection.find_one(
+            {'name': 'tv'})['_id']), types={'_id': 'objectid'})
+        self.assertEqual([doc['name'] for doc in
+                          self.collection.find(query.query())], ['tv'])
+
+    def test_fields(self):
+        cursor = self.collection.find(**mongo_query(
+            'fields=name&category=audio&sort=name:asc').find_args())
+        self.assertEqual([sorted(doc) for doc in cursor],
+                         [['_id', 'name'], ['_id', 'name']])
+        page = mongo_query('fields=name&sort=price:asc&limit=2').page(
+            self.collection)
+        # The sort fields are fetched for the cursors
+        self.assertEqual([sorted(doc) for doc in page.items],
+                         [['_id', 'name', 'price']] * 2)
+
+    def test_page(self):
+        pages = walk(lambda query: query.page(self.collection),
+                     'sort=category:asc&limit=2')
+        self.assertEqual(
+            [[doc['name'] for doc in page.items] for page in pages],
+            [['radio', 'speaker'], ['cable', 'tv'], ['projector']])
+        query = mongo_query('sort=category:asc&limit=2&cursor='
+                            + pages[2].prev_cursor)
+        self.assertEqual([doc['name'] for doc in
+                          query.page(self.collection).items],
+                         ['cable', 'tv'])
+
+        pages = walk(lambda query: query.page(self.collection),
+                     'category=in:audio,video&sort=price:desc&limit=3',
+                     only=['category', 'price'])
+        self.assertEqual(
+            [[doc['name'] for doc in page.items] for page in pages],
+            [['projector', 'tv', 'speaker'], ['radio']])
+
+    def test_page_nulls(self):
+        # MongoDB sorts null and missing values first
+        self.collection.insert_many(
+            [{'name': 'null %d' % i, 'price': None} for i in range(3)] +
+            [{'name': 'missing %d' % i} for i in range(3)])
+        for direction in ['asc', 'desc']:
+            args = 'sort=price:%s&limit=2' % direction
+            expected = [doc['name'] for doc in self.collection.find(
+                sort=mongo_sort(mongo_query(args).sorting + [
+                    {'field': '_id', 'direction': 'asc'}]))]
+            pages = walk(lambda query: query.page(self.collection), args)
+            self.assertEqual(
+                [doc['name'] for page in pages for doc in page.items],
+                expected)
+            self.assertEqual(len(expected), 11)
+            for previous, page in zip(pages, pages[1:]):
+                query = mongo_query(args + '&cursor=' + page.prev_cursor)
+                self.assertEqual(query.page(self.collection).items,
+                                 previous.items)
+
+
+class TestMongoengine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        mongoengine.connect('flask_kit_test', host='mongodb://localhost',
+                            mongo_client_class=mongomock.MongoClient,
+                            alias='default')
+
+    @classmethod
+    def tearDownClass(cls):
+        mongoengine.disconnect(alias='default')
+
+    def setUp(self):
+        Product.drop_collection()
+        for product in products:
+            Product(**product).save()
+
+    def names(self, args, **kwargs):
+        return [p.name for p in mongo_query(args, **kwargs)
+                .apply(Product.objects)]
+
+    def test_coercion(self):
+        # Fields convert the query string values to their types
+        self.assertEqual(self.names('price=gt:100&sort=price:desc'),
+                         ['projector', 'tv', 'speaker'])
+        self.assertEqual(self.names('stock=in:0,1&sort=stock:asc'),
+                         ['radio', 'projector'])
+        self.assertEqual(self.names('price=not:ge:50&stock=ne:0'), ['cable'])
+
+    def test_pagination(self):
+        self.assertEqual(self.names('sort=price:asc&offset=1&limit=2'),
+                         ['radio', 'speaker'])
+        self.assertEqual(self.names('limit=0'), [])
+
+    def test_mapping(self):
+        self.assertEqual(
+            self.names('kind=misc', only=['kind'],
+                       mapping={'kind': 'category'}),
+            ['cable'])
+
+    def test_page(self):
+        pages = walk(lambda query: query.page(Product.objects),
+                     'price=gt:10&sort=stock:asc&limit=2')
+        self.assertEqual([[p.name for p in page.items] for page in pages],
+                         [['radio', 'projector'], ['tv', 'speaker']])
+        self.assertIsNone(pages[0].prev_cursor)
+        query = mongo_query('price=gt:10&sort=stock:asc&limit=2&cursor='
+                            + pages[1].prev_cursor)
+        self.assertEqual([p.name for p in query.page(Product.objects).items],
+                         ['radio', 'projector'])
+
+    def test_page_nulls(self):
+        for i in range(3):
+            Product(name='null %d' % i).save()
+        pages = walk(lambda query: query.page(Product.objects),
+                     'sort=price:desc&limit=3')
+        self.assertEqual(
+            [p.name for page in pages for p in page.items],
+            ['projector', 'tv', 'speaker', 'radio', 'cable',
+             'null 0', 'null 1', 'null 2'])
+
+    def test_fields(self):
+        products = mongo_query('fields=name&sort=price:asc&limit=1').apply(
+            Product.objects)
+        self.assertEqual([(p.name, p.price) for p in products],
+                         [('cable', None)])
+        page = mongo_query('fields=name&sort=price:asc&limit=1').page(
+            Product.objects)
+        self.assertEqual([(p.name, p.price, p.stock) for p in page.items],
+                         [('cable', 5.0, None)])
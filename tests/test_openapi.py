@@ -0,0 +1,137 @@
+import json
+import os
+import tempfile
+import unittest
+
+from flask_kit.simple_router.openapi import (
+    json_schema,
+    openapi_path,
+    openapi_spec,
+    write_openapi,
+)
+
+
+class TestOpenAPIPath(unittest.TestCase):
+    def test_rules(self):
+        self.assertEqual(openapi_path('/items'), ('/items', []))
+        self.assertEqual(
+            openapi_path('/items/<int:id>/<name>/<string(length=2):code>'),
+            ('/items/{id}/{name}/{code}', [
+                ('id', {'type': 'integer'}),
+                ('name', {'type': 'string'}),
+                ('code', {'type': 'string'}),
+            ]))
+
+
+class TestJsonSchema(unittest.TestCase):
+    def test_types(self):
+        schema = json_schema({
+            'name': {'type': 'string', 'required': True, 'minlength': 2,
+                     'maxlength': 10, 'regex': '[a-z]+'},
+            'age': {'type': 'integer', 'min': 0, 'max': 150,
+                    'nullable': True},
+            'score': {'type': ['integer', 'float']},
+            'at': {'type': 'datetime', 'meta': {'description': 'When'}},
+            'kind': {'type': 'string', 'allowed': ['a', 'b'], 'default': 'a'},
+            'free': {},
+        })
+        self.assertEqual(schema['required'], ['name'])
+        self.assertFalse(schema['additionalProperties'])
+        properties = schema['properties']
+        self.assertEqual(properties['name'], {
+            'type': 'string', 'minLength': 2, 'maxLength': 10,
+            'pattern': '^(?:[a-z]+)$'})
+        self.assertEqual(properties['age'], {
+            'type': 'integer', 'minimum': 0, 'maximum': 150,
+            'nullable': True})
+        self.assertEqual(properties['score'], {
+            'anyOf': [{'type': 'integer'}, {'type': 'number'}]})
+        self.assertEqual(properties['at'], {
+            'type': 'string', 'format': 'date-time', 'description': 'When'})
+        self.assertEqual(properties['kind'], {
+            'type': 'string', 'enum': ['a', 'b'], 'default': 'a'})
+        self.assertEqual(properties['free'], {})
+
+    def test_nested(self):
+        schema = json_schema({
+            'address': {'type': 'dict', 'schema': {
+                'city': {'type': 'string', 'empty': False, 'required': True},
+            }},
+            'tags': {'type': 'list', 'maxlength': 3,
+                     'schema': {'type': 'string'}},
+            'flags': {'type': 'list', 'allowed': ['x', 'y']},
+            'counts': {'type': 'dict', 'valuesrules': {'type': 'integer'}},
+            'id': {'anyof': [{'type': 'integer'}, {'type': 'string'}]},
+        })
+        properties = schema['properties']
+        self.assertEqual(properties['address'], {
+            'type': 'object',
+            'properties': {'city': {'type': 'string', 'minLength': 1}},
+            'additionalProperties': False,
+            'required': ['city'],
+        })
+        self.assertEqual(properties['tags'], {
+            'type': 'array', 'items': {'type': 'string'}, 'maxItems': 3})
+        self.assertEqual(properties['flags'], {
+            'type': 'array', 'items': {'enum': ['x', 'y']}})
+        self.assertEqual(properties['counts'], {
+            'type': 'object', 'additionalProperties': {'type': 'integer'}})
+        self.assertEqual(properties['id'], {
+            'anyOf': [{'type': 'integer'}, {'type': 'string'}]})
+
+
+class TestOpenAPISpec(unittest.TestCase):
+    routes = {
+        '/items/<int:id>': {
+            'GET': {'description': 'Get an item\n\nBy id', 'name': 'get'},
+            'PUT': {'description': None, 'name': 'put',
+                    'parameters': {'name': {'type': 'string'}}},
+        },
+        '/items': {
+            'POST': {'description': None, 'name': 'post', 'parameters': {
+                'name': {'type': 'string', 'required': True}}},
+            'GET': {'description': None, 'name': 'search', 'parameters': {
+                'name': {'type': 'string'}}},
+        },
+    }
+
+    def test_spec(self):
+        spec = openapi_spec(self.routes, title='Things', version='2.0',
+                            servers=['https://api.example.com'])
+        self.assertEqual(spec['openapi'], '3.0.3')
+        self.assertEqual(spec['info'], {'title': 'Things', 'version': '2.0'})
+        self.assertEqual(spec['servers'], [{'url': 'https://api.example.com'}])
+        self.assertEqual(sorted(spec['paths']), ['/items', '/items/{id}'])
+
+        get = spec['paths']['/items/{id}']['get']
+        self.assertEqual(get['operationId'], 'get')
+        self.assertEqual(get['summary'], 'Get an item')
+        self.assertEqual(get['parameters'], [{
+            'name': 'id', 'in': 'path', 'required': True,
+            'schema': {'type': 'integer'}}])
+        self.assertNotIn('requestBody', get)
+        self.assertEqual(list(get['responses']), ['200'])
+
+        put = spec['paths']['/items/{id}']['put']
+        self.assertFalse(put['requestBody']['required'])
+        self.assertEqual(sorted(put['responses']), ['200', '400'])
+        post = spec['paths']['/items']['post']
+        self.assertTrue(post['requestBody']['required'])
+        self.assertEqual(
+            post['requestBody']['content']['application/json']['schema'],
+            json_schema({'name': {'type': 'string', 'required': True}}))
+
+        # Router validates the body of every method, GETs included
+        search = spec['paths']['/items']['get']
+        self.assertNotIn('parameters', search)
+        self.assertEqual(
+            search['requestBody']['content']['application/json']['schema'],
+            json_schema({'name': {'type': 'string'}}))
+
+    def test_write(self):
+        spec = openapi_spec(self.routes)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'openapi.json')
+            write_openapi(spec, path)
+            with open(path) as f:
+                self.assertEqual(json.load(f), spec)
@@ -1,12 +1,24 @@
+import asyncio
+import datetime
+import gzip
 import json
+import os
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import MagicMock
+from urllib.parse import parse_qsl
 
+import msgpack
+
+from flask import Blueprint, Flask, Response
+from flask import request as flask_request
 from werkzeug.datastructures import ImmutableMultiDict
-from werkzeug.urls import url_decode
 
-from flask_kit import Router
-from flask_kit.simple_router import Selector
+from flask_kit import BasicAccessControl, Router, make_error
+from flask_kit.simple_router import QueryError, RenderedResponse, Selector
+from tests.utils import FakeRequest
 
 
 # TODO: Cover help route better, and individual help routes on options
@@ -106,6 +118,42 @@ class TestRouteDoc(unittest.TestCase):
         self.assertEquals(router.routes['/route1']['GET']['description'], 'route 1 help')
         self.assertIsNone(router.routes['/route2']['POST']['description'])
 
+    def test_openapi(self):
+        router = Router(FakeBlueprint(url_prefix='api'))
+
+        @router.get('items/<int:item_id>')
+        def get_item(item_id):
+            """ An item """
+            return {}
+
+        @router.post('items', validate={'name': {'type': 'string',
+                                                 'required': True}})
+        def create_item(data):
+            return data
+
+        spec = router.openapi(title='Items')
+        self.assertEqual(spec['info']['title'], 'Items')
+        self.assertEqual(sorted(spec['paths']),
+                         ['/api/items', '/api/items/{item_id}'])
+        get = spec['paths']['/api/items/{item_id}']['get']
+        self.assertEqual(get['operationId'], 'bp_name_get_item')
+        self.assertEqual(get['summary'], 'An item')
+        post = spec['paths']['/api/items']['post']
+        self.assertEqual(
+            post['requestBody']['content']['application/json']['schema'],
+            {'type': 'object',
+             'properties': {'name': {'type': 'string'}},
+             'additionalProperties': False,
+             'required': ['name']})
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'openapi.json')
+            router.write_openapi(path, version='2.0')
+            with open(path) as f:
+                written = json.load(f)
+        self.assertEqual(written['info']['version'], '2.0')
+        self.assertEqual(written['paths'], spec['paths'])
+
 
 class TestSelector(unittest.TestCase):
     def test_empty(self):
@@ -130,6 +178,117 @@ class TestSelector(unittest.TestCase):
             s = Selector(request_obj=FakeRequest(args=lim))
             self.assertEquals(s.limit(), res)
 
+    def test_types(self):
+        args = ('price=gt:10.5&price=lt:20&stock=in:1,2&on=true&name=5'
+                '&age=not:le:3&day=2018-05-17')
+        s = Selector(request_obj=FakeRequest(args=args))
+        filters = s.filter(types={
+            'price': 'float',
+            'stock': {'type': 'list', 'schema': {'type': 'integer'}},
+            'on': 'boolean',
+            'age': {'type': 'integer'},
+            'day': 'date',
+        })
+        self.assertEqual(filters, [
+            {'field': 'price', 'op': 'gt', 'value': 10.5},
+            {'field': 'price', 'op': 'lt', 'value': 20.0},
+            {'field': 'stock', 'op': 'in', 'value': [1, 2]},
+            {'field': 'on', 'op': 'eq', 'value': True},
+            {'field': 'name', 'op': 'eq', 'value': '5'},
+            {'field': 'age', 'op': 'not', 'value': {'op': 'le', 'value': 3}},
+            {'field': 'day', 'op': 'eq', 'value': datetime.date(2018, 5, 17)},
+        ])
+
+        for arg in ['price=gt:abc', 'stock=in:1,a', 'age=not:in:1,x']:
+            s = Selector(request_obj=FakeRequest(args=arg))
+            with self.assertRaisesRegex(QueryError, 'Invalid value'):
+                s.filter(types={'price': 'float', 'stock': 'integer',
+                                'age': 'integer'})
+        # Only the typed keys are checked
+        s = Selector(request_obj=FakeRequest(args='price=abc'))
+        self.assertEqual(s.filter(types={'stock': 'integer'}),
+                         [{'field': 'price', 'op': 'eq', 'value': 'abc'}])
+
+    def test_parsed_once(self):
+        request = FakeRequest(args='a=in:1,2&sort=b:asc&limit=3')
+        s = Selector(request_obj=request)
+        parsed = s.parsed()
+        self.assertIs(s.parsed(), parsed)
+        self.assertEqual(parsed.filters, (('a', 'in', ('1', '2')),))
+        self.assertEqual(parsed.sort, (('b', 'asc'),))
+        self.assertEqual(parsed.limit, 3)
+
+        # Changes to the results don't reach the parsed query
+        s.filter()[0]['value'].append('3')
+        self.assertEqual(s.filter(), [{'field': 'a', 'op': 'in',
+                                       'value': ['1', '2']}])
+
+        request.args = ImmutableMultiDict(parse_qsl('a=4'))
+        self.assertEqual(s.filter(), [{'field': 'a', 'op': 'eq',
+                                       'value': '4'}])
+        self.assertIsNone(s.limit())
+
+    def test_shared_query_strings(self):
+        app = Flask(__name__)
+        s = Selector()
+        query = '/?cat=in:a,b&price=gt:10&sort=price&limit=5'
+        with app.test_request_context(query):
+            parsed = s.parsed()
+            filters = s.filter(only=['cat'], mapping={'cat': 'category'})
+        with app.test_request_context(query):
+            self.assertIs(s.parsed(), parsed)
+            self.assertEqual(
+                s.filter(only=['cat'], mapping={'cat': 'category'}), filters)
+            self.assertEqual(filters, [{'field': 'category', 'op': 'in',
+                                        'value': ['a', 'b']}])
+            self.assertEqual(s.sort(), [{'field': 'price',
+                                         'direction': 'desc'}])
+            self.assertEqual(s.limit(), 5)
+        with app.test_request_context('/?price=gt:10'):
+            self.assertIsNot(s.parsed(), parsed)
+
+    def test_fields(self):
+        args = {
+            '': None,
+            'fields=': None,
+            'fields=a,b.c': ['a', 'b.c'],
+            'fields=a, b&fields=c': ['a', 'b', 'c'],
+        }
+        for arg, res in args.items():
+            s = Selector(request_obj=FakeRequest(args=arg))
+            self.assertEqual(s.fields(), res)
+
+        s = Selector(request_obj=FakeRequest(
+            args='fields=a,b.c,d,e.f&a=1'))
+        self.assertEqual(s.fields(only=['a', 'b', 'e.f']),
+                         ['a', 'b.c', 'e.f'])
+        self.assertEqual(s.fields(mapping={'b': 'bee', 'e.f': 'x.y'}),
+                         ['a', 'bee.c', 'd', 'x.y'])
+        self.assertIsNone(s.fields(only=['z']))
+        # Not a filter
+        self.assertEqual(len(s.filter()), 1)
+
+    def test_page_caps(self):
+        limits = {'': 20, 'limit=5': 5, 'limit=100': 50, 'limit=a': 20}
+        for lim, res in limits.items():
+            s = Selector(request_obj=FakeRequest(args=lim), max_page=50,
+                         page_size=20)
+            self.assertEqual(s.limit(), res)
+        s = Selector(request_obj=FakeRequest(), max_page=50)
+        self.assertEqual(s.limit(), 50)
+
+    def test_cursor(self):
+        s = Selector(request_obj=FakeRequest(args='cursor=abc&a=1'),
+                     secret='key')
+        self.assertEqual(s.cursor(), 'abc')
+        self.assertEqual(s.cursor_secret(), 'key')
+        self.assertEqual(s.filter(), [{'field': 'a', 'op': 'eq',
+                                       'value': '1'}])
+        s = Selector(request_obj=FakeRequest(args='cursor='))
+        self.assertIsNone(s.cursor())
+        with self.assertRaises(RuntimeError):
+            s.cursor_secret()
+
     def test_offset(self):
         offsets = {
             'offset=0': 0,
@@ -182,6 +341,7 @@ class TestSelector(unittest.TestCase):
             ('sort=a,b,c', ['a'], ['a']),
             ('sort=a,b,c', ['a', 'b'], ['a', 'b']),
             ('sort=a', ['a', 'b'], ['a']),
+            ('sort=a:asc,b:desc,c', ['a', 'b'], ['a', 'b']),
         ]
         for arg, only, expected in args:
             s = Selector(request_obj=FakeRequest(args=arg))
@@ -193,6 +353,7 @@ class TestSelector(unittest.TestCase):
             ('key1=1&key2=2&key3', ['key1'], ['key1']),
             ('key1&key2=le:2&key3', ['key1', 'key2'], ['key1', 'key2']),
             ('key1', ['key1', 'key2'], ['key1']),
+            ('key1&sort=key1&limit=1&offset=2', None, ['key1']),
         ]
         for arg, only, expected in args:
             s = Selector(request_obj=FakeRequest(args=arg))
@@ -342,6 +503,148 @@ class TestRouter(RouterTestCase):
         res = my_route()
         self.assertIs(res[0]['success'], False, res)
 
+    def test_query_error(self):
+        blueprint = FakeBlueprint()
+        router = Router(blueprint, request=FakeRequest(), as_json=False)
+
+        @router.get('items')
+        def items():
+            raise QueryError('Invalid cursor')
+
+        res = items()
+        self.assertEqual(res[1], 400)
+        self.assertIs(res[0]['success'], False, res)
+        self.assertIn('Invalid cursor', str(res[0]))
+
+    def test_invalid_filter_type(self):
+        blueprint = FakeBlueprint()
+        router = Router(blueprint, request=FakeRequest(args='price=gt:x'),
+                        as_json=False)
+
+        @router.get('items')
+        def items():
+            return router.selector.filter(types={'price': 'float'})
+
+        res = items()
+        self.assertEqual(res[1], 400)
+        self.assertIn('Invalid value for price', str(res[0]))
+
+    def test_fields(self):
+        blueprint = FakeBlueprint()
+        request = FakeRequest(args='fields=name,size.w,secret')
+        router = Router(blueprint, request=request)
+        item = {'name': 'tv', 'size': {'w': 1, 'h': 2}, 'secret': 's'}
+
+        @router.get('any', fields=True)
+        def any_field():
+            return [item]
+
+        @router.get('some', fields=['name', 'size'])
+        def some():
+            return item, 201
+
+        @router.get('none')
+        def none():
+            return item
+
+        @router.get('stream', fields=True, stream='ndjson')
+        def stream():
+            return iter([item])
+
+        self.assertEqual(json.loads(any_field()[0]),
+                         [{'name': 'tv', 'size': {'w': 1}, 'secret': 's'}])
+        res = some()
+        self.assertEqual(json.loads(res[0]),
+                         {'name': 'tv', 'size': {'w': 1}})
+        self.assertEqual(res[1], 201)
+        self.assertEqual(json.loads(none()[0]), item)
+        body = ''.join(stream().response)
+        self.assertEqual(json.loads(body), {'name': 'tv', 'size': {'w': 1},
+                                            'secret': 's'})
+
+    def test_page_size(self):
+        blueprint = FakeBlueprint()
+        router = Router(blueprint, request=FakeRequest(args='limit=80'),
+                        max_page=50, page_size=10)
+        self.assertEqual(router.selector.limit(), 50)
+        router = Router(blueprint, request=FakeRequest())
+        self.assertEqual(router.selector.limit(), 500)
+
+    def test_json_list_is_not_streamed(self):
+        blueprint = FakeBlueprint()
+        router = Router(blueprint, request=FakeRequest())
+
+        @router.get('items')
+        def items():
+            return [1, 2, 3]
+
+        res = items()
+        self.assertIsInstance(res, tuple)
+        self.assertEqual(json.loads(res[0]), [1, 2, 3])
+
+    def test_datetime_mode(self):
+        blueprint = FakeBlueprint()
+        router = Router(blueprint, request=FakeRequest())
+        date = datetime.date(2018, 5, 17)
+
+        @router.get('iso', datetime_mode='iso')
+        def iso():
+            return {'date': date}
+
+        @router.get('full')
+        def full():
+            return {'date': date}
+
+        self.assertEqual(json.loads(iso()[0]), {'date': '2018-05-17T00:00:00'})
+        self.assertIs(json.loads(full()[0])['date']['with_time'], False)
+
+    def test_msgpack(self):
+        blueprint = FakeBlueprint()
+        request = FakeRequest(headers={'Accept': 'application/msgpack'})
+        router = Router(blueprint, request=request)
+
+        @router.get('items')
+        def items():
+            return {'items': [1, 2]}
+
+        body, status, headers = items()
+        self.assertEqual(headers['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(body), {'items': [1, 2]})
+
+    def test_response_traits(self):
+        blueprint = FakeBlueprint()
+        request = FakeRequest(headers={'Accept': 'application/msgpack'})
+        router = Router(blueprint, request=request)
+
+        @router.post('items', status=201, headers={'X-Kind': 'item'},
+                     json_only=True)
+        def create():
+            return {'id': 1}
+
+        @router.post('fail', status=201, json_only=True)
+        def fail():
+            return make_error('nope')
+
+        body, status, headers = create()
+        self.assertEqual(json.loads(body), {'id': 1})
+        self.assertEqual(status, 201)
+        self.assertEqual(headers, {
+            'Content-Type': 'application/json',
+            'X-Kind': 'item',
+        })
+        self.assertEqual(fail()[1], 400)
+
+    def test_stream_response_traits(self):
+        router = Router(FakeBlueprint(), request=FakeRequest())
+
+        @router.get('items', status=206, headers={'X-Kind': 'item'})
+        def items():
+            return iter([1])
+
+        res = items()
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res.headers['X-Kind'], 'item')
+
     # def test_decorator(self):
     #     decorator = MagicMock()
     #     blueprint = FakeBlueprint()
@@ -355,20 +658,1248 @@ class TestRouter(RouterTestCase):
     #         return 'deco'
 
 
+class TestStreaming(RouterTestCase):
+    def create_router(self, headers=None, **kwargs):
+        return Router(FakeBlueprint(),
+                      request=FakeRequest(headers=headers),
+                      **kwargs)
+
+    def test_generator(self):
+        router = self.create_router()
+
+        @router.get('items')
+        def items():
+            return ({'i': i} for i in range(3))
+
+        res = items()
+        self.assertIsInstance(res, Response)
+        self.assertEqual(res.mimetype, 'application/json')
+        self.assertEqual(json.loads(res.get_data(as_text=True)),
+                         [{'i': 0}, {'i': 1}, {'i': 2}])
+
+    def test_empty(self):
+        router = self.create_router()
+
+        @router.get('items')
+        def items():
+            return iter([])
+
+        self.assertEqual(items().get_data(as_text=True), '[]')
+
+    def test_status_and_headers(self):
+        router = self.create_router()
+
+        @router.get('items')
+        def items():
+            return iter([1]), 206, {'X-Total': '10'}
+
+        res = items()
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res.headers['X-Total'], '10')
+        self.assertEqual(res.get_data(as_text=True), '[1]')
+
+    def test_ndjson_accept(self):
+        router = self.create_router(headers={
+            'Accept': 'application/json;q=0.5, application/x-ndjson'
+        })
+
+        @router.get('items')
+        def items():
+            return iter([{'a': 1}, [2], 'three'])
+
+        res = items()
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(res.get_data(as_text=True),
+                         '{"a": 1}\n[2]\n"three"\n')
+
+    def test_route_option(self):
+        router = self.create_router(headers={'Accept': 'application/json'})
+
+        @router.get('items', stream='ndjson')
+        def items():
+            return [1, 2]
+
+        @router.get('other', stream='json')
+        def other():
+            return [1, 2]
+
+        self.assertEqual(items().get_data(as_text=True), '1\n2\n')
+        self.assertEqual(other().get_data(as_text=True), '[1, 2]')
+
+        with self.assertRaises(ValueError):
+            router.get('invalid', stream='xml')
+
+    def test_flush_size(self):
+        router = self.create_router(stream_flush_size=10)
+        consumed = []
+
+        def generate():
+            for i in range(10):
+                consumed.append(i)
+                yield 'item %d' % i
+
+        @router.get('items')
+        def items():
+            return generate()
+
+        chunks = iter(items().response)
+        first = next(chunks)
+        self.assertLess(len(consumed), 10)
+        self.assertGreaterEqual(len(first), 10)
+        rest = ''.join(c.decode() if isinstance(c, bytes) else c
+                       for c in chunks)
+        self.assertEqual(json.loads(first + rest),
+                         ['item %d' % i for i in range(10)])
+
+    def test_flask(self):
+        app = Flask(__name__)
+        blueprint = Blueprint('bp', __name__)
+        router = Router(blueprint)
+
+        @router.get('items')
+        def items():
+            return ({'path': flask_request.path} for _ in range(2))
+
+        app.register_blueprint(blueprint)
+        client = app.test_client()
+        res = client.get('/items', headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_data(as_text=True),
+                         '{"path": "/items"}\n{"path": "/items"}\n')
+
+
+class TestThreading(RouterTestCase):
+    schema = {
+        'name': {'type': 'string', 'required': True, 'regex': 'n[0-9]+'},
+        'value': {'type': 'integer', 'min': 0, 'default': 0},
+    }
+
+    def hammer(self, compile_schemas, threads=16, requests=50):
+        app = Flask(__name__)
+        blueprint = Blueprint('bp', __name__)
+        router = Router(blueprint, compile_schemas=compile_schemas)
+
+        @router.post('echo', validate=self.schema)
+        def echo(data):
+            return data
+
+        app.register_blueprint(blueprint)
+        failures = []
+
+        def worker(index):
+            client = app.test_client()
+            for i in range(requests):
+                value = index * requests + i
+                if i % 3:
+                    sent = {'name': 'n%d' % value, 'value': value}
+                    res = client.post('/echo', json=sent)
+                    if res.status_code != 200 or res.get_json() != sent:
+                        failures.append((sent, res.get_json()))
+                else:
+                    res = client.post('/echo', json={'name': value})
+                    errors = res.get_json()['error']
+                    if errors != {'name': ['must be of string type']}:
+                        failures.append((value, errors))
+
+        workers = [threading.Thread(target=worker, args=(i,))
+                   for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.assertEqual(failures, [])
+
+    def test_concurrent_requests(self):
+        self.hammer(compile_schemas=True)
+
+    def test_concurrent_requests_cerberus(self):
+        self.hammer(compile_schemas=False)
+
+
+class TestAsync(RouterTestCase):
+    def test_async_view(self):
+        router = Router(FakeBlueprint(), request=FakeRequest())
+
+        @router.get('items')
+        async def items():
+            await asyncio.sleep(0)
+            return {'items': [1, 2]}, 201
+
+        body, status, headers = items()
+        self.assertEqual(json.loads(body), {'items': [1, 2]})
+        self.assertEqual(status, 201)
+        self.assertEqual(headers['Content-Type'], 'application/json')
+
+    def test_validation(self):
+        router = Router(FakeBlueprint(), request=FakeRequest({'value': 2}))
+        schema = {'value': {'type': 'integer', 'max': 1}}
+
+        @router.post('items', validate=schema)
+        async def create(data):
+            return data
+
+        self.assertEqual(json.loads(create()[0])['error'],
+                         {'value': ['max value is 1']})
+
+    def test_decorator(self):
+        calls = []
+
+        def decorator(f, *args, **kwargs):
+            calls.append(f.__name__)
+            return f(*args, **kwargs)
+
+        router = Router(FakeBlueprint(), request=FakeRequest(),
+                        decorator=decorator)
+
+        @router.get('items')
+        async def items():
+            return [1]
+
+        self.assertEqual(items()[0], '[1]')
+        self.assertEqual(calls, ['items'])
+
+    def test_exception(self):
+        router = Router(FakeBlueprint(), request=FakeRequest())
+
+        @router.get('items')
+        async def items():
+            raise LookupError('missing')
+
+        with self.assertRaises(LookupError):
+            items()
+
+    def test_flask(self):
+        app = Flask(__name__)
+        blueprint = Blueprint('bp', __name__)
+        router = Router(blueprint)
+
+        @router.post('echo', validate={'name': {'type': 'string'}})
+        async def echo(data):
+            await asyncio.sleep(0)
+            return {'path': flask_request.path, **data}
+
+        app.register_blueprint(blueprint)
+        res = app.test_client().post('/echo', json={'name': 'x'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json(), {'path': '/echo', 'name': 'x'})
+
+
+class TestBodyLimits(RouterTestCase):
+    schema = {'items': {'type': 'list'}}
+
+    def create_client(self, route_options=None, **kwargs):
+        app = Flask(__name__)
+        blueprint = Blueprint('bp', __name__)
+        router = Router(blueprint, **kwargs)
+
+        @router.post('items', validate=self.schema, **(route_options or {}))
+        def items(data):
+            return data
+
+        app.register_blueprint(blueprint)
+        return app.test_client()
+
+    def test_size(self):
+        client = self.create_client(max_body_size=100)
+        res = client.post('/items', json={'items': list(range(100))})
+        self.assertEqual(res.status_code, 413)
+        self.assertIs(res.get_json()['success'], False)
+        res = client.post('/items', json={'items': [1]})
+        self.assertEqual(res.get_json(), {'items': [1]})
+
+    def test_route_size(self):
+        client = self.create_client({'max_body_size': 1000},
+                                    max_body_size=100)
+        res = client.post('/items', json={'items': list(range(100))})
+        self.assertEqual(res.status_code, 200)
+
+    def test_structure(self):
+        client = self.create_client(max_json_depth=2, max_json_keys=1)
+        res = client.post('/items', json={'items': [[1]]})
+        self.assertEqual(res.status_code, 400)
+        res = client.post('/items', json={'items': [], 'other': 1})
+        self.assertEqual(res.status_code, 400)
+        res = client.post('/items', json={'items': [1]})
+        self.assertEqual(res.status_code, 200)
+
+    def test_invalid_json(self):
+        client = self.create_client(json_decoder='auto')
+        res = client.post('/items', data='{"items": [',
+                          content_type='application/json')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.get_json()['error'], 'Invalid JSON body')
+        res = client.post('/items', data='')
+        self.assertEqual(res.get_json(), {})
+
+    def test_unbounded(self):
+        client = self.create_client()
+        res = client.post('/items', data='{"items": [',
+                          content_type='application/json')
+        self.assertEqual(res.get_json(), {})
+
+    def test_body_kept(self):
+        app = Flask(__name__)
+        blueprint = Blueprint('bp', __name__)
+        router = Router(blueprint, max_body_size=100)
+
+        @router.post('items', validate=self.schema)
+        def items(data):
+            return {'data': data, 'json': flask_request.get_json(),
+                    'raw': flask_request.get_data(as_text=True)}
+
+        app.register_blueprint(blueprint)
+        res = app.test_client().post('/items', data='{"items": [1]}',
+                                     content_type='application/json')
+        self.assertEqual(res.get_json(), {
+            'data': {'items': [1]},
+            'json': {'items': [1]},
+            'raw': '{"items": [1]}',
+        })
+
+
+class TestCache(RouterTestCase):
+    def setUp(self):
+        self.calls = 0
+
+    def create_router(self, args='', headers=None, **kwargs):
+        self.request = FakeRequest(args=args, headers=headers)
+        return Router(FakeBlueprint(), request=self.request, **kwargs)
+
+    def set_args(self, args):
+        self.request.args = ImmutableMultiDict(
+            parse_qsl(args, keep_blank_values=True))
+
+    def test_hit(self):
+        router = self.create_router()
+
+        @router.get('items/<item_id>', cache=60)
+        def item(item_id):
+            self.calls += 1
+            return {'id': item_id}
+
+        first = item(item_id='1')
+        self.assertEqual(item(item_id='1'), first)
+        self.assertEqual(self.calls, 1)
+        item(item_id='2')
+        self.assertEqual(self.calls, 2)
+        stats = router.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_query(self):
+        router = self.create_router('a=1&b=gt:2')
+
+        @router.get('items', cache=60)
+        def items():
+            self.calls += 1
+            return []
+
+        items()
+        self.set_args('b=gt:2&a=1')
+        items()
+        self.assertEqual(self.calls, 1)
+        self.set_args('b=gt:2&a=1&limit=10')
+        items()
+        self.assertEqual(self.calls, 2)
+
+    def test_fields_and_cursor(self):
+        router = self.create_router('fields=a')
+
+        @router.get('items', cache=60, fields=True)
+        def items():
+            self.calls += 1
+            return [{'a': 1, 'b': 2}]
+
+        self.assertEqual(json.loads(items()[0]), [{'a': 1}])
+        self.set_args('fields=b')
+        self.assertEqual(json.loads(items()[0]), [{'b': 2}])
+        self.set_args('fields=b&cursor=abc')
+        items()
+        self.assertEqual(self.calls, 3)
+
+    def test_variants(self):
+        router = self.create_router()
+        user = {'role': 'admin'}
+
+        @router.get('items', cache={'ttl': 60, 'vary': lambda: user['role']},
+                    compress=True)
+        def items():
+            self.calls += 1
+            return list(range(500))
+
+        items()
+        self.request.headers['Accept'] = 'application/msgpack'
+        self.assertEqual(items()[2]['Content-Type'], 'application/msgpack')
+        self.request.headers['Accept-Encoding'] = 'gzip'
+        self.assertEqual(items()[2]['Content-Encoding'], 'gzip')
+        user['role'] = 'guest'
+        items()
+        self.assertEqual(self.calls, 4)
+
+    def test_invalidation(self):
+        router = self.create_router()
+
+        @router.get('items', cache={'ttl': 60, 'tags': ['items']})
+        def items():
+            self.calls += 1
+            return []
+
+        @router.get('items/<item_id>', cache={
+            'ttl': 60,
+            'tags': lambda item_id: ['item:%s' % item_id],
+        })
+        def item(item_id):
+            self.calls += 1
+            return {}
+
+        @router.post('items', invalidates=['items'])
+        def create():
+            return {}, 201
+
+        @router.put('items/<item_id>',
+                    invalidates=lambda item_id: ['item:%s' % item_id])
+        def update(item_id):
+            return make_error('nope') if item_id == 'bad' else {}
+
+        items(), item(item_id='1'), item(item_id='2')
+        create()
+        items(), item(item_id='1')
+        self.assertEqual(self.calls, 4)
+        update(item_id='1')
+        update(item_id='bad')
+        item(item_id='1'), item(item_id='2')
+        self.assertEqual(self.calls, 5)
+
+    def test_errors_not_cached(self):
+        router = self.create_router()
+
+        @router.get('items', cache=60)
+        def items():
+            self.calls += 1
+            return make_error('nope', 404)
+
+        items(), items()
+        self.assertEqual(self.calls, 2)
+
+    def test_conditional(self):
+        router = self.create_router()
+
+        @router.get('items', cache=60, etag=True)
+        def items():
+            self.calls += 1
+            return [1]
+
+        etag = items()[2]['ETag']
+        self.request.headers['If-None-Match'] = etag
+        self.assertEqual(items()[1], 304)
+        self.assertEqual(self.calls, 1)
+
+    def test_decorator(self):
+        def authorize(f, *args, **kwargs):
+            user = self.request.headers.get('Authorization')
+            if user not in ('alice', 'bob'):
+                return make_error('Forbidden', 403)
+            return f(*args, user=user, **kwargs)
+
+        router = self.create_router(decorator=authorize)
+
+        def caller():
+            return self.request.headers.get('Authorization')
+
+        @router.get('private', cache={'ttl': 60, 'vary': caller})
+        def private(user):
+            self.calls += 1
+            return {'user': user}
+
+        self.assertEqual(private()[1], 403)
+        self.request.headers['Authorization'] = 'alice'
+        self.assertEqual(json.loads(private()[0]), {'user': 'alice'})
+        self.assertEqual(json.loads(private()[0]), {'user': 'alice'})
+        self.assertEqual(self.calls, 1)
+
+        # The cached response is only given to the callers let in, and
+        # varies with the caller
+        del self.request.headers['Authorization']
+        self.assertEqual(private()[1], 403)
+        self.request.headers['Authorization'] = 'bob'
+        self.assertEqual(json.loads(private()[0]), {'user': 'bob'})
+        self.assertEqual(self.calls, 2)
+
+    def test_decorator_wraps_view(self):
+        seen = []
+
+        def wrap(f, *args, **kwargs):
+            try:
+                resp = f(*args, **kwargs)
+            except LookupError:
+                return make_error('Not found', 404)
+            seen.append(resp)
+            if isinstance(resp, dict):
+                return {**resp, 'wrapped': True}
+            return resp
+
+        router = self.create_router(decorator=wrap)
+
+        @router.get('items/<item_id>', cache=60)
+        def item(item_id):
+            self.calls += 1
+            if item_id == 'missing':
+                raise LookupError(item_id)
+            return {'id': item_id}
+
+        # The response cached is the one of the hook, which gets it back
+        # rendered on hits
+        for _ in range(2):
+            self.assertEqual(json.loads(item(item_id='1')[0]),
+                             {'id': '1', 'wrapped': True})
+        self.assertEqual(seen[0], {'id': '1'})
+        self.assertIsInstance(seen[1], RenderedResponse)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(item(item_id='missing')[1], 404)
+        self.assertEqual(item(item_id='missing')[1], 404)
+        self.assertEqual(self.calls, 3)
+
+    def test_without_key(self):
+        router = self.create_router()
+
+        @router.get('items', cache={'ttl': 60, 'vary': object})
+        def items():
+            self.calls += 1
+            return []
+
+        self.assertEqual(items()[1], 200)
+        self.assertEqual(items()[1], 200)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(router.cache.stats()['misses'], 0)
+
+    def test_only_get(self):
+        router = self.create_router()
+        with self.assertRaises(ValueError):
+            router.post('items', cache=60)
+
+
+class TestCoalescing(RouterTestCase):
+    def concurrent_calls(self, view, count=10, **kwargs):
+        results = []
+        errors = []
+
+        def call():
+            try:
+                results.append(view(**kwargs))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_coalesced(self):
+        router = Router(FakeBlueprint(), request=FakeRequest(),
+                        coalesce=True)
+        calls = []
+
+        @router.get('items/<item_id>')
+        def item(item_id):
+            calls.append(item_id)
+            time.sleep(0.2)
+            return {'id': item_id}
+
+        results, _ = self.concurrent_calls(item, item_id='1')
+        self.assertEqual(calls, ['1'])
+        self.assertEqual(len(set(r[0] for r in results)), 1)
+        self.assertEqual(router.single_flight.stats()['coalesced'], 9)
+
+    def test_errors(self):
+        router = Router(FakeBlueprint(), request=FakeRequest())
+
+        @router.get('items', coalesce=True)
+        def items():
+            time.sleep(0.2)
+            raise LookupError('missing')
+
+        results, errors = self.concurrent_calls(items)
+        self.assertEqual(len(errors), 10)
+        self.assertEqual(router.single_flight.stats()['executions'], 1)
+
+    def test_stream(self):
+        router = Router(FakeBlueprint(), request=FakeRequest(),
+                        coalesce=True)
+
+        @router.get('items')
+        def items():
+            time.sleep(0.2)
+            return iter([1, 2])
+
+        results, _ = self.concurrent_calls(items, count=3)
+        self.assertEqual([r.get_data(as_text=True) for r in results],
+                         ['[1, 2]'] * 3)
+
+    def test_decorator(self):
+        caller = threading.local()
+
+        def authorize(f, *args, **kwargs):
+            if caller.user is None:
+                return make_error('Forbidden', 403)
+            return f(*args, user=caller.user, **kwargs)
+
+        router = Router(FakeBlueprint(), request=FakeRequest(),
+                        decorator=authorize, coalesce=True)
+        calls = []
+
+        @router.get('private', coalesce={'vary': lambda: caller.user})
+        def private(user):
+            calls.append(user)
+            time.sleep(0.2)
+            return {'user': user}
+
+        results = {}
+
+        def call(user):
+            caller.user = user
+            results[user] = private()
+
+        threads = [threading.Thread(target=call, args=(user,))
+                   for user in ['alice', None, 'bob']]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results[None][1], 403)
+        self.assertEqual(json.loads(results['alice'][0]), {'user': 'alice'})
+        self.assertEqual(json.loads(results['bob'][0]), {'user': 'bob'})
+        self.assertEqual(sorted(calls), ['alice', 'bob'])
+
+    def test_decorator_wraps_view(self):
+        seen = []
+
+        def wrap(f, *args, **kwargs):
+            try:
+                resp = f(*args, **kwargs)
+            except LookupError:
+                return make_error('Not found', 404)
+            seen.append(resp)
+            if isinstance(resp, dict):
+                return {**resp, 'wrapped': True}
+            return resp
+
+        router = Router(FakeBlueprint(), request=FakeRequest(),
+                        decorator=wrap, coalesce=True)
+        calls = []
+
+        @router.get('items/<item_id>')
+        def item(item_id):
+            calls.append(item_id)
+            time.sleep(0.2)
+            if item_id == 'missing':
+                raise LookupError(item_id)
+            return {'id': item_id}
+
+        # The requests joining the running one get its rendered response
+        results, _ = self.concurrent_calls(item, count=3, item_id='1')
+        self.assertEqual([json.loads(r[0]) for r in results],
+                         [{'id': '1', 'wrapped': True}] * 3)
+        self.assertEqual(calls, ['1'])
+        self.assertEqual(
+            len([r for r in seen if isinstance(r, RenderedResponse)]), 2)
+        results, _ = self.concurrent_calls(item, count=3, item_id='missing')
+        self.assertEqual([r[1] for r in results], [404] * 3)
+        self.assertEqual(calls, ['1', 'missing'])
+
+    def test_without_key(self):
+        def authorize(f, *args, **kwargs):
+            return f(*args, user=object(), **kwargs)
+
+        router = Router(FakeBlueprint(), request=FakeRequest(),
+                        decorator=authorize, coalesce=True)
+
+        @router.get('items/<item_id>')
+        def item(item_id, user):
+            time.sleep(0.1)
+            return {'id': item_id}
+
+        @router.get('items', coalesce={'vary': object})
+        def items(user):
+            time.sleep(0.1)
+            return []
+
+        # The arguments given by the hook aren't part of the key
+        results, _ = self.concurrent_calls(item, count=3, item_id='1')
+        self.assertEqual([r[1] for r in results], [200] * 3)
+        self.assertEqual(router.single_flight.stats()['executions'], 1)
+        results, _ = self.concurrent_calls(items, count=3)
+        self.assertEqual([r[1] for r in results], [200] * 3)
+        self.assertEqual(router.single_flight.stats()['executions'], 1)
+
+    def test_opt_out(self):
+        router = Router(FakeBlueprint(), request=FakeRequest(),
+                        coalesce=True)
+
+        @router.get('items', coalesce=False)
+        def items():
+            time.sleep(0.1)
+            return []
+
+        @router.post('items')
+        def create():
+            time.sleep(0.1)
+            return {}
+
+        self.concurrent_calls(items, count=3)
+        self.concurrent_calls(create, count=3)
+        self.assertEqual(router.single_flight.stats()['executions'], 0)
+        with self.assertRaises(ValueError):
+            router.post('other', coalesce=True)
+
+
+class TestBatch(RouterTestCase):
+    def create_client(self, **kwargs):
+        app = Flask(__name__)
+        blueprint = Blueprint('bp', __name__)
+        self.router = Router(blueprint, batch_route='batch', **kwargs)
+        self.items = {}
+
+        def permissions():
+            return flask_request.headers.get('X-Permissions', '').split(',')
+
+        access = BasicAccessControl(permissions)
+
+        @self.router.get('items/<int:item_id>')
+        def get_item(item_id):
+            if item_id not in self.items:
+                return make_error('Not found', 404)
+            return self.items[item_id]
+
+        @self.router.post('items', validate={
+            'name': {'type': 'string', 'required': True}})
+        def create_item(data):
+            item_id = len(self.items) + 1
+            self.items[item_id] = data
+            return {'id': item_id}, 201
+
+        @self.router.delete('items')
+        @access.allow('admin')
+        def clear_items():
+            self.items.clear()
+
+        @self.router.get('fail')
+        def fail():
+            raise RuntimeError()
+
+        @self.router.get('wait')
+        def wait():
+            return {'party': self.barrier.wait()}
+
+        app.register_blueprint(blueprint)
+        return app.test_client()
+
+    def test_operations(self):
+        client = self.create_client()
+        res = client.post('/batch', json=[
+            {'method': 'POST', 'path': '/items', 'body': {'name': 'a'}},
+            {'method': 'POST', 'path': '/items', 'body': {}},
+            {'method': 'GET', 'path': '/items/1'},
+            {'path': '/items/2?verbose=1'},
+            {'method': 'delete', 'path': '/items'},
+        ])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json(), [
+            {'status': 201, 'body': {'id': 1}},
+            {'status': 400, 'body': {
+                'success': False, 'error': {'name': ['required field']}}},
+            {'status': 200, 'body': {'name': 'a'}},
+            {'status': 404, 'body': {'success': False, 'error': 'Not found'}},
+            {'status': 403, 'body': {'error': 'access_denied'}},
+        ])
+
+    def test_access(self):
+        client = self.create_client()
+        self.items[1] = {'name': 'a'}
+        res = client.post('/batch', json=[{'method': 'DELETE',
+                                           'path': '/items'}],
+                          headers={'X-Permissions': 'admin'})
+        self.assertEqual(res.get_json(), [{'status': 204, 'body': None}])
+        self.assertEqual(self.items, {})
+
+    def test_errors(self):
+        client = self.create_client()
+        self.assertEqual(client.post('/batch', json={'a': 1}).status_code, 400)
+        self.assertEqual(client.post('/batch', data='[').status_code, 400)
+        for operation in [{'path': 'items'}, {'method': 'TRACE', 'path': '/'},
+                          {'path': '/items', 'query': 'a'}]:
+            res = client.post('/batch', json=[operation])
+            self.assertEqual(res.status_code, 400)
+
+        res = client.post('/batch', json=[{'path': '/fail'},
+                                          {'path': '/missing'}])
+        self.assertEqual([r['status'] for r in res.get_json()], [500, 404])
+
+        res = client.post('/batch', json=[{'method': 'POST',
+                                           'path': '/batch', 'body': []}])
+        self.assertEqual(res.get_json()[0]['status'], 400)
+
+    def test_max_operations(self):
+        client = self.create_client(batch_max_operations=2)
+        res = client.post('/batch', json=[{'path': '/items/1'}] * 3)
+        self.assertEqual(res.status_code, 400)
+
+    def test_concurrent_gets(self):
+        client = self.create_client(batch_workers=2)
+        # Deadlocks (and times out) unless both GETs run at the same time
+        self.barrier = threading.Barrier(2, timeout=5)
+        res = client.post('/batch', json=[{'path': '/wait'},
+                                          {'path': '/wait'}])
+        parties = sorted(r['body']['party'] for r in res.get_json())
+        self.assertEqual(parties, [0, 1])
+
+    def test_sequential(self):
+        client = self.create_client(batch_workers=0)
+        self.assertIsNone(self.router._batch_pool())
+        self.items[1] = {'name': 'a'}
+        res = client.post('/batch', json=[{'path': '/items/1'}] * 3)
+        self.assertEqual([r['status'] for r in res.get_json()], [200] * 3)
+
+
+class TestMetrics(RouterTestCase):
+    def test_phases(self):
+        router = Router(FakeBlueprint(), request=FakeRequest({'a': 1}),
+                        metrics=True, compress=True)
+
+        @router.post('items', validate={'a': {'type': 'integer'}})
+        def create(data):
+            return data
+
+        @router.get('items')
+        def items():
+            return list(range(1000))
+
+        create()
+        items()
+        items()
+        snapshot = router.metrics.snapshot()
+        self.assertEqual(sorted(snapshot['bp_name_create']), [
+            'compress', 'parse', 'prepare', 'serialize', 'total', 'validate',
+            'view'])
+        self.assertEqual(sorted(snapshot['bp_name_items']), [
+            'compress', 'prepare', 'serialize', 'total', 'view'])
+        self.assertEqual(snapshot['bp_name_items']['total']['count'], 2)
+
+    def test_disabled(self):
+        router = Router(FakeBlueprint(), request=FakeRequest())
+        self.assertIsNone(router.metrics)
+
+        @router.get('items')
+        def items():
+            return []
+
+        self.assertEqual(items()[1], 200)
+
+    def test_errors(self):
+        router = Router(FakeBlueprint(), request=FakeRequest(), metrics=True)
+
+        @router.get('items')
+        def items():
+            raise LookupError()
+
+        with self.assertRaises(LookupError):
+            items()
+        totals = router.metrics.snapshot()['bp_name_items']['total']
+        self.assertEqual(totals['count'], 1)
+
+    def test_route(self):
+        app = Flask(__name__)
+        blueprint = Blueprint('bp', __name__)
+        router = Router(blueprint, metrics=True, metrics_route='metrics')
+
+        @router.get('items')
+        def items():
+            return []
+
+        app.register_blueprint(blueprint)
+        client = app.test_client()
+        client.get('/items')
+        res = client.get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/plain')
+        self.assertIn('flask_kit_request_phase_seconds_count'
+                      '{endpoint="bp_items",phase="view"} 1',
+                      res.get_data(as_text=True))
+        self.assertNotIn('/metrics', client.get('/').get_json())
+
+
+class TestCompression(RouterTestCase):
+    payload = [{'index': i, 'name': 'item %d' % (i * 7919 % 10007)}
+               for i in range(500)]
+
+    def create_router(self, encoding='gzip', compress=True, **kwargs):
+        request = FakeRequest(headers={'Accept-Encoding': encoding})
+        return Router(FakeBlueprint(), request=request, compress=compress,
+                      **kwargs)
+
+    def test_gzip(self):
+        router = self.create_router()
+
+        @router.get('items')
+        def items():
+            return self.payload
+
+        body, status, headers = items()
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept, Accept-Encoding')
+        self.assertEqual(json.loads(gzip.decompress(body)), self.payload)
+
+    def test_not_accepted(self):
+        router = self.create_router(encoding='identity')
+
+        @router.get('items')
+        def items():
+            return self.payload
+
+        body, status, headers = items()
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(headers['Vary'], 'Accept, Accept-Encoding')
+        self.assertEqual(json.loads(body), self.payload)
+
+    def test_min_size(self):
+        router = self.create_router(compress_min_size=100000)
+
+        @router.get('items')
+        def items():
+            return self.payload
+
+        body, status, headers = items()
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(headers['Vary'], 'Accept')
+        self.assertEqual(json.loads(body), self.payload)
+
+    def test_level(self):
+        fast = self.create_router(compress_level=1)
+        best = self.create_router(compress_level=9)
+
+        def items():
+            return self.payload
+
+        fast_body = fast.get('items')(items)()[0]
+        best_body = best.get('items')(items)()[0]
+        self.assertLess(len(best_body), len(fast_body))
+
+    def test_opt_out(self):
+        router = self.create_router()
+        disabled = self.create_router(compress=False)
+
+        @router.get('items', compress=False)
+        def items():
+            return self.payload
+
+        @disabled.get('other')
+        def other():
+            return self.payload
+
+        for view in [items, other]:
+            body, status, headers = view()
+            self.assertNotIn('Content-Encoding', headers)
+            self.assertEqual(json.loads(body), self.payload)
+
+    def test_opt_in(self):
+        # Compression is off by default, routes can enable it
+        request = FakeRequest(headers={'Accept-Encoding': 'gzip'})
+        router = Router(FakeBlueprint(), request=request)
+
+        @router.get('items')
+        def items():
+            return self.payload
+
+        @router.get('other', compress=True)
+        def other():
+            return self.payload
+
+        self.assertNotIn('Content-Encoding', items()[2])
+        self.assertEqual(other()[2]['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Encoding',
+                         router._documentation_view()[2])
+
+    def test_existing_vary(self):
+        router = self.create_router()
+
+        @router.get('items')
+        def items():
+            return self.payload, 200, {'Vary': 'Origin'}
+
+        self.assertEqual(items()[2]['Vary'],
+                         'Origin, Accept, Accept-Encoding')
+
+    def test_stream(self):
+        router = self.create_router(stream_flush_size=100)
+
+        @router.get('items')
+        def items():
+            return iter(self.payload)
+
+        res = items()
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(res.get_data())),
+                         self.payload)
+
+    def test_documentation(self):
+        router = self.create_router(compress_min_size=0)
+        view = router._documentation_view
+
+        first = view()
+        self.assertEqual(first[2]['Content-Encoding'], 'gzip')
+        self.assertIs(view(), first)
+        self.assertEqual(json.loads(gzip.decompress(first[0])), {})
+
+        @router.get('items')
+        def items():
+            return self.payload
+
+        updated = view()
+        self.assertIsNot(updated, first)
+        self.assertIn('/items', json.loads(gzip.decompress(updated[0])))
+
+    def test_documentation_etag(self):
+        headers = {'Accept-Encoding': 'gzip'}
+        router = Router(FakeBlueprint(), request=FakeRequest(headers=headers),
+                        compress=True, compress_min_size=0)
+
+        @router.get('items')
+        def items():
+            return self.payload
+
+        first = router._documentation_view()
+        etag = first[2]['ETag']
+        self.assertTrue(etag.endswith('-gzip"'))
+        self.assertEqual(first[2]['Content-Type'], 'application/json')
+
+        headers['If-None-Match'] = etag
+        not_modified = router._documentation_view()
+        self.assertEqual(not_modified[1], 304)
+        self.assertEqual(not_modified[0], '')
+
+        @router.post('items')
+        def create():
+            pass
+
+        updated = router._documentation_view()
+        self.assertEqual(updated[1], 200)
+        self.assertNotEqual(updated[2]['ETag'], etag)
+
+    def test_flask(self):
+        app = Flask(__name__)
+        blueprint = Blueprint('bp', __name__)
+        router = Router(blueprint, compress=True)
+
+        @router.get('items')
+        def items():
+            return self.payload
+
+        app.register_blueprint(blueprint)
+        client = app.test_client()
+        res = client.get('/items', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(res.data)), self.payload)
+        res = client.get('/items')
+        self.assertEqual(json.loads(res.data), self.payload)
+
+
+class TestConditional(RouterTestCase):
+    payload = {'name': 'thing', 'value': 1}
+
+    def create_router(self, headers=None, **kwargs):
+        return Router(FakeBlueprint(),
+                      request=FakeRequest(headers=headers),
+                      **kwargs)
+
+    def test_body_etag(self):
+        router = self.create_router()
+
+        @router.get('thing', etag=True)
+        def thing():
+            return self.payload
+
+        body, status, headers = thing()
+        self.assertEqual(status, 200)
+        etag = headers['ETag']
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+
+        router.request.headers['If-None-Match'] = etag
+        self.assertEqual(thing(), ('', 304, {'ETag': etag}))
+
+        router.request.headers['If-None-Match'] = 'W/%s, "other"' % etag
+        self.assertEqual(thing()[1], 304)
+
+        router.request.headers['If-None-Match'] = '"other"'
+        self.assertEqual(thing()[1], 200)
+
+    def test_etag_changes(self):
+        router = self.create_router()
+        values = [1]
+
+        @router.get('thing', etag=True)
+        def thing():
+            return {'value': values[-1]}
+
+        etag = thing()[2]['ETag']
+        values.append(2)
+        router.request.headers['If-None-Match'] = etag
+        body, status, headers = thing()
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headers['ETag'], etag)
+
+    def test_version_key(self):
+        router = self.create_router()
+        calls = []
+
+        def version(thing_id):
+            return 'v3'
+
+        @router.get('thing/<thing_id>', etag=version)
+        def thing(thing_id):
+            calls.append(thing_id)
+            return self.payload
+
+        etag = thing(thing_id='a')[2]['ETag']
+        self.assertEqual(calls, ['a'])
+
+        router.request.headers['If-None-Match'] = etag
+        self.assertEqual(thing(thing_id='a')[1], 304)
+        self.assertEqual(calls, ['a'])
+
+    def test_only_get(self):
+        router = self.create_router(headers={'If-None-Match': '*'})
+
+        @router.post('thing', etag=True)
+        def thing():
+            return self.payload
+
+        self.assertEqual(thing()[1], 200)
+        self.assertNotIn('ETag', thing()[2])
+
+    def test_errors(self):
+        router = self.create_router(headers={'If-None-Match': '*'})
+
+        @router.get('thing', etag=True)
+        def thing():
+            return {'error': 'not found'}, 404
+
+        self.assertEqual(thing()[1], 404)
+
+    def test_decorator(self):
+        def authorize(f, *args, **kwargs):
+            if 'Authorization' not in router.request.headers:
+                return make_error('Forbidden', 403)
+            return f(*args, **kwargs)
+
+        router = self.create_router(headers={'If-None-Match': '*'},
+                                    decorator=authorize)
+        versions = []
+
+        @router.get('thing', etag=lambda: versions.append(1) or 1)
+        def thing():
+            return self.payload
+
+        body, status, headers = thing()
+        self.assertEqual(status, 403)
+        self.assertNotIn('ETag', headers)
+        self.assertEqual(versions, [])
+
+        router.request.headers['Authorization'] = 'user'
+        self.assertEqual(thing()[1], 304)
+
+    def test_decorator_wraps_view(self):
+        def wrap(f, *args, **kwargs):
+            try:
+                resp = f(*args, **kwargs)
+            except LookupError:
+                return make_error('Not found', 404)
+            # 304s reach the hook as the response tuple
+            return {'data': resp} if isinstance(resp, dict) else resp
+
+        router = self.create_router(headers={'If-None-Match': '"other"'},
+                                    decorator=wrap)
+        found = [True]
+
+        @router.get('thing', etag=lambda: 1)
+        def thing():
+            if not found[0]:
+                raise LookupError('thing')
+            return self.payload
+
+        body, status, headers = thing()
+        self.assertEqual(json.loads(body), {'data': self.payload})
+        self.assertIn('ETag', headers)
+        found[0] = False
+        self.assertEqual(thing()[1], 404)
+        router.request.headers['If-None-Match'] = headers['ETag']
+        self.assertEqual(thing()[1], 304)
+
+    def test_last_modified(self):
+        router = self.create_router()
+        modified = datetime.datetime(2018, 5, 17, 13, 45, 12, 500)
+        calls = []
+
+        @router.get('thing', last_modified=lambda: modified)
+        def thing():
+            calls.append(1)
+            return self.payload
+
+        headers = thing()[2]
+        self.assertEqual(headers['Last-Modified'],
+                         'Thu, 17 May 2018 13:45:12 GMT')
+
+        cases = [
+            ('Thu, 17 May 2018 13:45:12 GMT', 304),
+            ('Fri, 18 May 2018 00:00:00 GMT', 304),
+            ('Thu, 17 May 2018 13:45:11 GMT', 200),
+            ('invalid date', 200),
+        ]
+        for since, status in cases:
+            router.request.headers['If-Modified-Since'] = since
+            self.assertEqual(thing()[1], status, since)
+        self.assertEqual(len(calls), 3)
+
+    def test_if_none_match_precedence(self):
+        router = self.create_router(headers={
+            'If-Modified-Since': 'Fri, 18 May 2018 00:00:00 GMT',
+            'If-None-Match': '"other"',
+        })
+
+        @router.get('thing',
+                    etag=lambda: 1,
+                    last_modified=lambda: datetime.datetime(2018, 5, 17))
+        def thing():
+            return self.payload
+
+        self.assertEqual(thing()[1], 200)
+
+    def test_compressed(self):
+        router = self.create_router(headers={'Accept-Encoding': 'gzip'},
+                                    compress=True, compress_min_size=0)
+
+        @router.get('thing', etag=True)
+        def thing():
+            return self.payload
+
+        etag = thing()[2]['ETag']
+        self.assertTrue(etag.endswith('-gzip"'))
+        router.request.headers['If-None-Match'] = etag
+        self.assertEqual(thing(), ('', 304, {'ETag': etag}))
+
+    def test_stream(self):
+        router = self.create_router()
+
+        @router.get('things', etag=lambda: 'v1')
+        def things():
+            return iter([self.payload])
+
+        etag = things().headers['ETag']
+        router.request.headers['If-None-Match'] = etag
+        self.assertEqual(things()[1], 304)
+
+
 class FakeBlueprint(object):
     def __init__(self, name='bp_name', url_prefix=None):
         self.name = name
         self.url_prefix = url_prefix
         self.add_url_rule = MagicMock()
-
-
-class FakeRequest(object):
-    def __init__(self, value=None, args=None):
-        self.value = value
-        if args is not None:
-            self.args = url_decode(args, 'utf-8', cls=ImmutableMultiDict)
-        else:
-            self.args = ImmutableMultiDict()
-
-    def get_json(self, **_):
-        return self.value
@@ -0,0 +1,189 @@
+import random
+import threading
+import unittest
+
+from cerberus import Validator
+
+from flask_kit.simple_router.validation import (
+    CompiledValidator,
+    ValidatorPool,
+    compile_schema,
+)
+
+schema = {
+    'name': {
+        'type': 'string',
+        'required': True,
+        'regex': '[a-z]+',
+        'minlength': 2,
+        'maxlength': 5,
+    },
+    'age': {
+        'type': 'integer',
+        'min': 0,
+        'max': 150,
+        'nullable': True,
+        'default': 3,
+    },
+    'score': {'type': 'number', 'min': 0.5},
+    'kind': {'type': 'string', 'allowed': ['a', 'b', ''], 'empty': True},
+    'flag': {'type': 'boolean', 'default': False},
+    'tags': {
+        'type': 'list',
+        'empty': False,
+        'schema': {'type': 'string', 'allowed': ['a', 'b'], 'default': 'a'},
+    },
+    'address': {
+        'type': 'dict',
+        'nullable': True,
+        'schema': {
+            'city': {'type': 'string', 'default': 'X', 'required': True},
+            'zip': {'type': 'string', 'empty': False, 'regex': r'\d+'},
+        },
+    },
+    'items': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {'q': {'type': 'integer', 'default': 1, 'min': 1}},
+        },
+    },
+    'anything': {'nullable': True},
+    'multi': {'type': ['string', 'integer'], 'allowed': [1, 2, 'x']},
+    'numbers': {'type': 'list', 'allowed': [1, 2], 'minlength': 1},
+}
+
+values = [
+    None, '', 'ab', 'abc', 'A', 'abcdef', 'x', 'a', 'b', '7',
+    0, 1, 2, -1, 200, 0.1, 3.5, True, False,
+    [], ['a'], ['a', 'c'], ['a', None], [1], [1, 3], (1,),
+    {}, {'x': 1}, {'city': 'y'}, {'city': None}, {'zip': ''}, {'zip': '12'},
+    {'zip': '1a'}, {'q': 0}, [{}], [{'q': 0}], [{'q': None}],
+    [{'q': 2, 'z': 1}],
+]
+
+# Cerberus 1.2 checks `allowed` on lists with set(value), which fails on
+# unhashable items
+hashable_values = [value for value in values
+                   if not isinstance(value, list)
+                   or not any(isinstance(item, dict) for item in value)]
+
+
+class TestCompileSchema(unittest.TestCase):
+    def assertEquivalent(self, compiled, document):
+        cerberus = Validator(compiled.schema)
+        expected = cerberus.validate(document)
+        self.assertEqual(compiled.validate(document), expected)
+        self.assertEqual(compiled.errors, cerberus.errors)
+        self.assertEqual(compiled.document, cerberus.document)
+        self.assertEqual(list(compiled.document), list(cerberus.document))
+
+    def test_compiled(self):
+        self.assertIsInstance(compile_schema(schema), CompiledValidator)
+
+    def test_fallback(self):
+        unsupported = [
+            {'a': {'type': 'string', 'coerce': int}},
+            {'a': {'type': 'string', 'forbidden': ['x']}},
+            {'a': {'type': 'dict', 'schema': {'b': {'excludes': 'c'}}}},
+            {'a': {'schema': {'type': 'string'}}},
+        ]
+        for unsupported_schema in unsupported:
+            with self.subTest(schema=unsupported_schema):
+                validator = compile_schema(unsupported_schema)
+                self.assertIsInstance(validator, Validator)
+
+    def test_valid(self):
+        compiled = compile_schema(schema)
+        documents = [
+            {'name': 'ab'},
+            {'name': 'abc', 'age': None, 'flag': True, 'kind': ''},
+            {'name': 'ab', 'tags': ['a', None], 'multi': 'x'},
+            {'name': 'ab', 'address': {}, 'items': [{}, {'q': None}]},
+            {'name': 'ab', 'address': None, 'anything': [1, {}]},
+            {'name': 'ab', 'score': 0.5, 'numbers': [1, 2, 1]},
+        ]
+        for document in documents:
+            with self.subTest(document=document):
+                self.assertTrue(compiled.validate(document))
+                self.assertEquivalent(compiled, document)
+
+    def test_defaults(self):
+        compiled = compile_schema(schema)
+        self.assertTrue(compiled.validate({
+            'name': 'ab',
+            'age': None,
+            'flag': None,
+            'address': {'zip': '1'},
+            'items': [{}],
+        }))
+        self.assertEqual(compiled.document, {
+            'name': 'ab',
+            'age': None,
+            'flag': False,
+            'address': {'zip': '1', 'city': 'X'},
+            'items': [{'q': 1}],
+        })
+
+    def test_input_not_modified(self):
+        compiled = compile_schema(schema)
+        document = {'name': 'ab', 'address': {}}
+        compiled.validate(document)
+        self.assertEqual(document, {'name': 'ab', 'address': {}})
+
+    def test_invalid(self):
+        compiled = compile_schema(schema)
+        documents = [
+            {},
+            {'name': 'A'},
+            {'name': 'ab', 'unknown': 1},
+            {'name': 'ab', 'age': -1},
+            {'name': 'ab', 'score': True},
+            {'name': 'ab', 'tags': []},
+            {'name': 'ab', 'tags': ['c']},
+            {'name': 'ab', 'address': {'zip': ''}},
+            {'name': 'ab', 'address': {'city': 1}},
+            {'name': 'ab', 'items': [{'q': 0}]},
+            {'name': 'ab', 'multi': 3},
+        ]
+        for document in documents:
+            with self.subTest(document=document):
+                self.assertFalse(compiled.validate(document))
+                self.assertEquivalent(compiled, document)
+
+    def test_random_documents(self):
+        compiled = compile_schema(schema)
+        rand = random.Random(42)
+        keys = list(schema) + ['unknown']
+        for _ in range(1000):
+            document = {
+                k: rand.choice(hashable_values
+                               if 'allowed' in schema.get(k, {}) else values)
+                for k in rand.sample(keys, rand.randint(0, 3))
+            }
+            if rand.random() < 0.7:
+                document['name'] = 'ab'
+            with self.subTest(document=document):
+                self.assertEquivalent(compiled, document)
+
+    def test_reused(self):
+        compiled = compile_schema(schema)
+        self.assertFalse(compiled.validate({}))
+        self.assertTrue(compiled.validate({'name': 'ab'}))
+        self.assertEqual(compiled.errors, {})
+        self.assertEqual(compiled.document, {'name': 'ab', 'age': 3,
+                                             'flag': False})
+
+
+class TestValidatorPool(unittest.TestCase):
+    def test_per_thread(self):
+        pool = ValidatorPool(lambda: compile_schema(schema))
+        main = pool.get()
+        self.assertIs(pool.get(), main)
+
+        others = []
+        thread = threading.Thread(target=lambda: others.append(pool.get()))
+        thread.start()
+        thread.join()
+        self.assertIsInstance(others[0], CompiledValidator)
+        self.assertIsNot(others[0], main)
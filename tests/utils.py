@@ -1,3 +1,8 @@
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import ImmutableMultiDict
+
+
 class FakeOpen(object):
     def __init__(self, value=None):
         self.value = value
@@ -16,4 +21,18 @@ class FakeOpen(object):
         return self.value
 
     def write(self, value):
-        self.value = value
\ No newline at end of file
+        self.value = value
+
+
+class FakeRequest(object):
+    def __init__(self, value=None, args=None, headers=None):
+        self.value = value
+        self.headers = headers or {}
+        if args is not None:
+            self.args = ImmutableMultiDict(
+                parse_qsl(args, keep_blank_values=True))
+        else:
+            self.args = ImmutableMultiDict()
+
+    def get_json(self, **_):
+        return self.value